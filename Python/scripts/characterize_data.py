@@ -30,12 +30,15 @@
 # ]
 # ///
 
+# pandas and matplotlib are imported by the functions that use them, they are only used
+# by the main process, so worker processes started with the spawn or forkserver
+# methods, which import this module, do not import them.
 import SimpleITK as sitk
-import pandas as pd
 import numpy as np
 import os
 import sys
 import time
+import math
 import json
 import shutil
 import subprocess
@@ -43,11 +46,20 @@ import concurrent.futures
 from tqdm import tqdm
 import platform
 import copy
-import matplotlib.pyplot as plt
+import multiprocessing
+from multiprocessing import shared_memory
 from functools import partial
 import argparse
+import ast
 import hashlib
+import struct
+import zlib
 import tempfile
+import contextlib
+import threading
+import posixpath
+import zipfile
+import tarfile
 from collections import defaultdict
 
 
@@ -60,6 +72,13 @@ def dir_path(path):
     )
 
 
+def dir_path_or_url(path):
+    # URLs (e.g. s3://bucket/data) are validated when they are accessed
+    if "://" in path:
+        return path
+    return dir_path(path)
+
+
 def file_path(path):
     if os.path.isdir(path):
         raise argparse.ArgumentTypeError(f"Invalid argument ({path}), not a file path.")
@@ -73,6 +92,20 @@ def positive_int(i):
     raise argparse.ArgumentTypeError(f"Invalid argument ({i}), expected value > 0 .")
 
 
+def non_negative_int(i):
+    res = int(i)
+    if res >= 0:
+        return res
+    raise argparse.ArgumentTypeError(f"Invalid argument ({i}), expected value >= 0 .")
+
+
+def positive_float(f):
+    res = float(f)
+    if res > 0:
+        return res
+    raise argparse.ArgumentTypeError(f"Invalid argument ({f}), expected value > 0 .")
+
+
 def load_optional_parameters(file_name, parser):
     """
     Loading optional argparse parameters from a JSON configuration file.
@@ -129,357 +162,2524 @@ class RawDescriptionAndDefaultHelpFormatter(
     pass
 
 
-def inspect_grayscale_image(sitk_image, image_info):
-    np_arr_view = sitk.GetArrayViewFromImage(sitk_image)
-    image_info["MD5 intensity hash"] = hashlib.md5(np_arr_view).hexdigest()
-    mmfilter = sitk.MinimumMaximumImageFilter()
-    mmfilter.Execute(sitk_image)
-    image_info["min intensity"] = mmfilter.GetMinimum()
-    image_info["max intensity"] = mmfilter.GetMaximum()
-    image_info["mean intensity"] = np_arr_view.mean()
-    image_info["std intensity"] = np_arr_view.std()
-    # Potentially provide more complete information on intensity distribution:
-    # skew (scipy.stats.skew, asymmetry around mean),
-    # kurtosis (scipy.stats.kurtosis, how heavy are the distribution tails / how many outliers)
-    # percentiles, [10,25,50,75,90] (np.percentile)
-    # For now, not adding the dependency on scipy.stats or computational complexity of
-    # percentile computations.
+# Per worker (process or thread) state, the readers are reused by all tasks executed by the worker.
+_worker_state = threading.local()
 
 
-def inspect_image(sitk_image, image_info, meta_data_info, thumbnail_settings):
+def initialize_worker(number_of_threads):
     """
-    Inspect a SimpleITK image, and update the image_info dictionary with the values associated with the
-    contents of the meta_data_info dictionary. The values of the image meta data dictionary keys are
-    copied into the image_info dictionary (image_info[k] = sitk_image.GetMetaData(meta_data_info[k])).
+    Initialize a worker process, used as the ProcessPoolExecutor initializer. Configure the number
+    of threads used by ITK once per worker, with the spawn and forkserver start methods the parent
+    process's configuration is not inherited, and create the worker's readers.
 
     Parameters
     ----------
-    sitk_image (SimpleITK.Image): Input image for inspection, 2D or 3D.
-    image_info (dict): Image information is added to this dictionary (e.g. image_info["image size"] = "(512,512)").
-                       The image_info dict is filled with the following values:
-                           "MD5 intensity hash" - Enable identification of duplicate images in terms of intensity.
-                                                  This is different from SimpleITK image equality where the
-                                                  same intensities with different image spacing/origin/direction cosine
-                                                  are considered different images as they occupy a different spatial
-                                                  region.
-                           Image spatial information - "image size", "image spacing", "image origin", "axis direction".
-                           Image intensity information - "pixel type", if scalar or repeated scalar impersonating a
-                                                          multi-channel image:"min", "max", "mean", "std".
-                           metadata values for the values listed in the meta_data_info dictionary (e.g. "radiographic view" : "AP").
-    meta_data_info(dict(str:str)): The meta-data information whose values will be reported.
-                                   Dictionary structure is description:meta_data_tag
-                                   (e.g. {"radiographic view" : "0018|5101", "modality" : "0008|0060",
-                                          "ITK_InputFilterName" : "ITK_InputFilterName"}).
-    thumbnail_settings(dict): Dictionary containing the following keys "thumbnail_sizes", "projection_axis" and
-                              "interpolator" which are used to create a thumbnail representing this image that is
-                              stored in image_info["thumbnail"].
+    number_of_threads (int): Number of threads used by ITK filters in the worker.
     """
-    np_arr_view = sitk.GetArrayViewFromImage(sitk_image)
-    image_info["image size"] = sitk_image.GetSize()
-    image_info["image spacing"] = sitk_image.GetSpacing()
-    image_info["image origin"] = sitk_image.GetOrigin()
-    image_info["axis direction"] = sitk_image.GetDirection()
-
-    if (
-        sitk_image.GetNumberOfComponentsPerPixel() == 1
-    ):  # grayscale image, get measures of intensity location and spread the min/max pixel values
-        image_info["pixel type"] = sitk_image.GetPixelIDTypeAsString() + " gray"
-        inspect_grayscale_image(sitk_image, image_info)
-    else:  # either a color image or a grayscale image masquerading as a color one
-        pixel_type = sitk_image.GetPixelIDTypeAsString()
-        channels = [
-            sitk.VectorIndexSelectionCast(sitk_image, i)
-            for i in range(sitk_image.GetNumberOfComponentsPerPixel())
-        ]
-        # if this multi-channel is actually a grayscale image, treat
-        # it as such, call inspect_grayscale_image on the first channel
-        # this will compute the intensity statistics and the md5 hash on
-        # the actual grayscale information
-        if np.array_equal(
-            sitk.GetArrayViewFromImage(channels[0]),
-            sitk.GetArrayViewFromImage(channels[1]),
-        ) and np.array_equal(
-            sitk.GetArrayViewFromImage(channels[0]),
-            sitk.GetArrayViewFromImage(channels[2]),
-        ):
-            pixel_type = (
-                pixel_type
-                + f" {sitk_image.GetNumberOfComponentsPerPixel()} channels gray"
-            )
-            inspect_grayscale_image(channels[0], image_info)
-        else:
-            image_info["MD5 intensity hash"] = hashlib.md5(np_arr_view).hexdigest()
-            pixel_type = (
-                pixel_type
-                + f" {sitk_image.GetNumberOfComponentsPerPixel()} channels color"
-            )
-        image_info["pixel type"] = pixel_type
-    img_keys = sitk_image.GetMetaDataKeys()
-    for k, v in meta_data_info.items():
-        if v in img_keys:
-            image_info[k] = sitk_image.GetMetaData(v)
-    if thumbnail_settings:
-        image_info["thumbnail"] = image_to_thumbnail(sitk_image, **thumbnail_settings)
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(number_of_threads)
+    worker_image_file_reader()
+    worker_image_series_reader()
 
 
-def inspect_single_file(
-    file_name,
-    imageIO="",
-    meta_data_info={},
-    external_programs_info={},
-    thumbnail_settings={},
-):
+def initialize_thread_worker():
     """
-    Inspect a file using the specified imageIO, returning a dictionary with the relevant information.
+    Initialize a worker thread, used as the ThreadPoolExecutor initializer. The threads share the
+    process's ITK configuration, each thread has its own readers and is reported as a separate
+    worker in the utilization metrics (see timed_task).
+    """
+    _worker_state.worker_id = f"{os.getpid()}/{threading.current_thread().name}"
+    worker_image_file_reader()
+    worker_image_series_reader()
 
-    Parameters
-    ----------
-    file_name (str): Image file name.
-    imageIO (str): Name of image IO to use. To see the list of registered image IOs use the
-                   ImageFileReader::GetRegisteredImageIOs() or print an ImageFileReader.
-                   The empty string indicates to read all file formats supported by SimpleITK.
-    meta_data_info(dict(str:str)): The meta-data information whose values will be reported.
-                                   Dictionary structure is description:meta_data_tag
-                                   (e.g. {"radiographic view" : "0018|5101", "modality" : "0008|0060"}).
-    external_programs_info(dict(str:str)): A dictionary of programs that are run with the file_name as input
-                                  the return value 'succeeded' or 'failed' is recorded. This
-                                  is useful for example if you need to validate conformance
-                                  to a standard such as DICOM. Dictionary format is description:program (e.g.
-                                  {"DICOM compliant" : "path_to_dicom3tools/dciodvfy"}).
-    thumbnail_settings(dict): A dictionary containing the settings required for creating a 2D thumbnail.
-                              from an image. These include thumbnail_sizes (x,y size of thumbnail),
-                              projection axis (maximal intensity project 3D images along this axis and
-                              then create the 2D thumbnail from the projection), interpolator (SimpleITK
-                              interpolator used to resize the 2D image to the thumbnail size).
+
+def worker_image_file_reader():
+    """
+    Get the worker's ImageFileReader, created on first use. Callers set the ImageIO and file name
+    before every read.
 
     Returns
     -------
-     dict with the following entries: files, MD5 intensity hash,
-                                       image size, image spacing, image origin, axis direction,
-                                       pixel type, min intensity, max intensity, mean intensity,
-                                       std intensity,
-                                       meta data_1...meta_data_n,
-                                       external_program_res_1...external_program_res_m
-    If the given file is not readable by SimpleITK, the only entry in the dictionary
-    will be the "files" entry.
+    SimpleITK.ImageFileReader
     """
-    # Using a list so that returned csv is consistent with the series based analysis (an
-    # image is defined by multiple files).
-    file_info = {}
-    file_info["files"] = [file_name]
-    try:
-        reader = sitk.ImageFileReader()
-        reader.SetImageIO(imageIO)
-        reader.SetFileName(file_name)
-        img = reader.Execute()
-        inspect_image(img, file_info, meta_data_info, thumbnail_settings)
-        for k, p in external_programs_info.items():
-            try:
-                # run the external programs, check the return value, and capture all output so it
-                # doesn't appear on screen. The CalledProcessError exception is raised if the
-                # external program fails (returns non zero value).
-                subprocess.run([p, file_name], check=True, capture_output=True)
-                file_info[k] = "succeeded"
-            except Exception:
-                file_info[k] = "failed"
-    except Exception:
-        pass
-    return file_info
+    if not hasattr(_worker_state, "image_file_reader"):
+        _worker_state.image_file_reader = sitk.ImageFileReader()
+    return _worker_state.image_file_reader
 
 
-def inspect_files(
-    root_dir,
-    max_processes,
-    disable_tqdm,
-    imageIO="",
-    meta_data_info={},
-    external_programs_info={},
-    thumbnail_settings={},
-):
+def worker_image_series_reader():
     """
-    Iterate over a directory structure and return a pandas dataframe with the relevant information for the
-    image files. This also includes non image files. The resulting dataframe will only include the file name
-    if that file wasn't successfully read by SimpleITK. The two reasons for failure are: (1) the user specified
-    imageIO isn't compatible with the file format (e.g. user is only interested in reading jpg and the file
-    format is mha) or (2) the file could not be read by the SimpleITK IO (corrupt file or unexpected limitation of
-    SimpleITK).
+    Get the worker's ImageSeriesReader, created on first use, configured to load the meta-data
+    dictionaries including private tags. Callers set the file names before every read.
 
-    Parameters
-    ----------
-    root_dir (str): Path to the root of the data directory. Traverse the directory structure
-                    and inspect every file (also report non image files, in which
-                    case the only valid entry will be the file name).
-    max_processes (int): Maximal number of processes to use in when performing parallel processing.
-                         Only relevant for non-windows systems.
-    disable_tqdm (bool): Display a progress bar, or not.
-    imageIO (str): Name of image IO to use. To see the list of registered image IOs use the
-                   ImageFileReader::GetRegisteredImageIOs() or print an ImageFileReader.
-                   The empty string indicates to read all file formats supported by SimpleITK.
-    meta_data_info(dict(str:str)): The meta-data information whose values will be reported.
-                                   Dictionary structure is description:meta_data_tag
-                                   (e.g. {"radiographic view" : "0018|5101", "modality" : "0008|0060"}).
-    external_programs_info(dict(str:str)): A dictionary of programs that are run with the file_name as input
-                                  the return value 'succeeded' or 'failed' is recorded. This
-                                  is useful for example if you need to validate conformance
-                                  to a standard such as DICOM. Dictionary format is description:program (e.g.
-                                  {"DICOM compliant" : "path_to_dicom3tools/dciodvfy"}).
-    thumbnail_settings(dict): A dictionary containing the settings required for creating a 2D thumbnail.
-                              from an image. These include thumbnail_sizes (x,y size of thumbnail),
-                              projection axis (maximal intensity project 3D images along this axis and
-                              then create the 2D thumbnail from the projection), interpolator (SimpleITK
-                              interpolator used to resize the 2D image to the thumbnail size).
     Returns
     -------
-    pandas DataFrame: Each row in the data frame corresponds to a single file.
+    SimpleITK.ImageSeriesReader
     """
-    all_file_names = []
-    for dir_name, subdir_names, file_names in os.walk(root_dir):
-        all_file_names += [
-            os.path.join(os.path.abspath(dir_name), fname) for fname in file_names
-        ]
-
-    # Get list of dictionaries describing the results and then combine into a dataframe, faster
-    # than appending to the dataframe one by one. Use parallel processing to speed things up.
-    res = []
-    with concurrent.futures.ProcessPoolExecutor(max_processes) as executor:
-        futures = (
-            executor.submit(
-                partial(
-                    inspect_single_file,
-                    imageIO=imageIO,
-                    meta_data_info=meta_data_info,
-                    external_programs_info=external_programs_info,
-                    thumbnail_settings=thumbnail_settings,
-                ),
-                file_name,
-            )
-            for file_name in all_file_names
-        )
-        # tqdm configuration, set miniters (minimal number of iterations before updating the progress bar) to
-        # be about ~10% of data in combination with maxinterval of 60sec. If the 10% interval takes more
-        # than 60sec then tqdm automatically changes it to match the maxinterval. Additionally, the whole progress
-        # bar is disabled if disable_tqdm is True, for example when scheduling a job on a cluster in which case there
-        # is no person looking at the progress.
-        tqdm_total = len(all_file_names)
-        for file_name, future in tqdm(
-            zip(all_file_names, concurrent.futures.as_completed(futures)),
-            total=tqdm_total,
-            maxinterval=60,
-            miniters=tqdm_total // 10,
-            disable=disable_tqdm,
-            file=sys.stdout,
-        ):
-            try:
-                result = future.result()
-                res.append(result)
-            except Exception as e:
-                print(f"Failed process for {file_name}", file=sys.stderr)
-    return pd.DataFrame.from_dict(res)
+    if not hasattr(_worker_state, "image_series_reader"):
+        reader = sitk.ImageSeriesReader()
+        reader.MetaDataDictionaryArrayUpdateOn()
+        reader.LoadPrivateTagsOn()
+        _worker_state.image_series_reader = reader
+    return _worker_state.image_series_reader
 
 
-def inspect_single_series(series_data, meta_data_info={}, thumbnail_settings={}):
+def worker_image_slice_reader():
     """
-    Inspect a single DICOM series (DICOM hierarchy of patient-study-series-image).
-    This can be a single file, or multiple files such as a CT or MR volume.
+    Get the worker's ImageFileReader used to read the slices of a series one at a time, created on
+    first use, configured to load the private tags like the series reader. Callers set the file name
+    and output pixel type before every read.
 
-    Parameters
-    ----------
-    series_data (two entry tuple): First entry is series:study...(DICOM tag values uniquely identifying series),
-                                   second entry is the list of files comprising this series.
-    meta_data_info(dict(str:str)): The meta-data information whose values will be reported.
-                                   Dictionary structure is description:meta_data_tag
-                                   (e.g. {"radiographic view" : "0018|5101", "modality" : "0008|0060"}).
     Returns
     -------
-     dictionary containing all of the information about the series.
+    SimpleITK.ImageFileReader
     """
-    series_info = {}
-    series_info["files"] = series_data[1]
-    try:
-        reader = sitk.ImageSeriesReader()
-        reader.MetaDataDictionaryArrayUpdateOn()
+    if not hasattr(_worker_state, "image_slice_reader"):
+        reader = sitk.ImageFileReader()
         reader.LoadPrivateTagsOn()
-        # split list of tag values, sid is first entry (see inspect_series)
-        sid = series_data[0].split(":")[0]
-        file_names = series_info["files"]
-        # As the files comprising a series can reside in separate directories
-        # and may have identical file names (e.g. 1/Z0.dcm, 2/Z0.dcm)
-        # we use a tempdir and symbolic links to enable SimpleITK to read the series as
-        # a single image (ImageSeriesReader_GetGDCMSeriesFileNames expects all files to
-        # be in a single directory).
-        # On Windows we need to copy the files to the tempdir as the os.symlink documentation says that
-        # "On newer versions of Windows 10, unprivileged accounts can create symlinks
-        # if Developer Mode is enabled. When Developer Mode is not available/enabled,
-        # the SeCreateSymbolicLinkPrivilege privilege is required, or the process must be
-        # run as an administrator."
-        # To turn Developer Mode on in Windows 11:
-        # Settings->System->For Developers and turn Developer Mode on.
-        # We could then use the os.symlink function instead of the indirect usage of a
-        # copy_link_function below.
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            copy_link_function = (
-                shutil.copy if platform.system() == "Windows" else os.symlink
-            )
-            new_orig_file_name_dict = {}
-            for i, fname in enumerate(file_names):
-                new_fname = os.path.join(tmpdirname, str(i))
-                new_orig_file_name_dict[new_fname] = fname
-                copy_link_function(fname, new_fname)
-            # On windows the returned full paths use backslash
-            # for all directories except the last one which has a slash. This does not
-            # match the contents of the new_orig_file_name_dict which has a backslash
-            # for the last entry too, as expected on windows. This is an issue with GDCM
-            # and we reported it on its bug tracker. In the code below we call os.path.normpath to
-            # resolve this issue.
-            sorted_new_file_names = sitk.ImageSeriesReader_GetGDCMSeriesFileNames(
-                tmpdirname, sid
-            )
-            # store the file names in a sorted order so that they are saved in this
-            # manner. This is useful for reading from the saved csv file
-            # using the SeriesImageReader or ImageRead which expect ordered file names
-            series_info["files"] = [
-                new_orig_file_name_dict[os.path.normpath(new_fname)]
-                for new_fname in sorted_new_file_names
-            ]
-            reader.SetFileNames(sorted_new_file_names)
-            img = reader.Execute()
-            for k in meta_data_info.values():
-                if reader.HasMetaDataKey(0, k):
-                    img.SetMetaData(k, reader.GetMetaData(0, k))
-            inspect_image(img, series_info, meta_data_info, thumbnail_settings)
-    except Exception:
-        pass
-    return series_info
+        _worker_state.image_slice_reader = reader
+    return _worker_state.image_slice_reader
 
 
-def get_series_key_fname(file_name, additional_series_tags):
+def process_pool_executor(max_processes):
     """
-    If a DICOM file, create a unique string identifier representing its series. This is
-    a combination of the series UID, study UID and the values of the additional series
-    tags. For non DICOM files or files that GDCM cannot read this function will raise
-    an exception.
+    Create the process pool used for parallel processing. The workers are initialized with
+    initialize_worker, using the ITK number of threads of the current process. The start method
+    is the multiprocessing default, unless set via multiprocessing.set_start_method (see the
+    --process_start_method option).
 
     Parameters
     ----------
-    file_name (Union[str,Path]): Name of file.
-    additional_series_tags (list(str)): List of DICOM tags that together with
-    series and study UID serve to uniquely identify files belonging to the same
-    series.
+    max_processes (int): Maximal number of processes, if None the number of processors.
 
     Returns
     -------
-    A tuple (key, file_name) where key is a unique identifier string
-    comprised of series UID:study UID:values from additional series tags. This
-    will succeed if the given file_name is a DICOM file that GDCM can read,
-    if not an exception is raised by the ImageFileReader.
+    concurrent.futures.ProcessPoolExecutor
     """
-    reader = sitk.ImageFileReader()
-    # explicitly set ImageIO to GDCMImageIO so that non DICOM files that
+    return concurrent.futures.ProcessPoolExecutor(
+        max_processes,
+        initializer=initialize_worker,
+        initargs=(sitk.ProcessObject.GetGlobalDefaultNumberOfThreads(),),
+    )
+
+
+EXECUTION_BACKENDS = ["process", "thread", "serial", "auto"]
+
+
+class SerialExecutor(concurrent.futures.Executor):
+    """
+    Executor running every task in the calling thread when it is submitted, the futures are
+    returned completed. Used for debugging and profiling, the tasks run in the main process in
+    submission order.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def resolve_backend(backend, max_processes, shared_thumbnails=False):
+    """
+    Resolve the "auto" execution backend. A single worker runs serially. Otherwise, processes are
+    used when they are started by forking, which is cheap and isolates the workers, or when the
+    thumbnails are returned via shared memory. With the spawn and forkserver start methods (macOS,
+    Windows) every worker re-imports the modules and all results are pickled, threads are used
+    instead as the bulk of the work, reading images and ITK filters, hashing and numpy
+    operations, releases the GIL.
+
+    Parameters
+    ----------
+    backend (str): One of EXECUTION_BACKENDS.
+    max_processes (int): Maximal number of workers, if None the number of processors.
+    shared_thumbnails (bool): The thumbnails are returned via shared memory, see SharedThumbnailSlots.
+
+    Returns
+    -------
+    str: The backend, "process", "thread" or "serial".
+    """
+    if backend != "auto":
+        return backend
+    if (max_processes if max_processes else os.cpu_count()) == 1:
+        return "serial"
+    if shared_thumbnails or multiprocessing.get_start_method() == "fork":
+        return "process"
+    return "thread"
+
+
+def task_executor(backend, max_processes):
+    """
+    Create the executor used for parallel processing.
+
+    Parameters
+    ----------
+    backend (str): One of EXECUTION_BACKENDS, "process" for a process pool (see
+                   process_pool_executor), "thread" for a thread pool, "serial" to run the tasks
+                   in the main thread (see SerialExecutor) or "auto" (see resolve_backend).
+    max_processes (int): Maximal number of worker processes or threads, if None the number of
+                         processors.
+
+    Returns
+    -------
+    concurrent.futures.Executor
+    """
+    backend = resolve_backend(backend, max_processes)
+    if backend == "process":
+        return process_pool_executor(max_processes)
+    if backend == "thread":
+        return concurrent.futures.ThreadPoolExecutor(
+            max_processes if max_processes else os.cpu_count(),
+            thread_name_prefix="worker",
+            initializer=initialize_thread_worker,
+        )
+    return SerialExecutor()
+
+
+class SharedThumbnailSlots:
+    """
+    Shared memory ring of fixed size slots used to return thumbnails from the worker processes.
+    Each inspection task is assigned a free slot, the worker writes the thumbnail pixel data into
+    the slot and returns only the slot offset instead of a pickled SimpleITK image, the parent
+    process copies the thumbnail out of the slot and the slot is reused by a later task (see
+    completed_futures). The number of slots bounds the number of tasks in flight.
+    """
+
+    def __init__(self, thumbnail_sizes, number_of_slots):
+        self.thumbnail_sizes = list(thumbnail_sizes)
+        self.slot_size = self.thumbnail_sizes[0] * self.thumbnail_sizes[1]
+        self.shared_memory = shared_memory.SharedMemory(
+            create=True, size=self.slot_size * number_of_slots
+        )
+        self.free_offsets = [i * self.slot_size for i in range(number_of_slots)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+    def thumbnail(self, offset):
+        """
+        Copy a thumbnail out of the slot at the given offset.
+
+        Parameters
+        ----------
+        offset (int): Slot offset returned by the worker.
+
+        Returns
+        -------
+        2D SimpleITK image with sitkUInt8 pixel type, see image_to_thumbnail.
+        """
+        return sitk.GetImageFromArray(
+            np.ndarray(
+                self.thumbnail_sizes[::-1],
+                dtype=np.uint8,
+                buffer=self.shared_memory.buf,
+                offset=offset,
+            )
+        )
+
+
+def inspect_with_shared_thumbnail(inspect_function, shared_memory_name, offset, *args):
+    """
+    Run an inspection function in a worker process and write the thumbnail it created into a
+    shared memory slot (see SharedThumbnailSlots), replacing the "thumbnail" entry of the
+    returned dictionary with the slot offset.
+
+    Parameters
+    ----------
+    inspect_function (callable): Function returning a dictionary with an optional "thumbnail"
+                                 entry (e.g. inspect_single_file).
+    shared_memory_name (str): Name of the SharedThumbnailSlots shared memory.
+    offset (int): Offset of the slot assigned to this task.
+    args: Arguments passed to the inspect_function.
+
+    Returns
+    -------
+    dict: The inspect_function result.
+    """
+    info = inspect_function(*args)
+    if "thumbnail" in info:
+        if not hasattr(_worker_state, "shared_memory"):
+            _worker_state.shared_memory = {}
+        if shared_memory_name not in _worker_state.shared_memory:
+            _worker_state.shared_memory[shared_memory_name] = (
+                shared_memory.SharedMemory(name=shared_memory_name)
+            )
+        arr = sitk.GetArrayViewFromImage(info["thumbnail"])
+        np.ndarray(
+            arr.shape,
+            dtype=np.uint8,
+            buffer=_worker_state.shared_memory[shared_memory_name].buf,
+            offset=offset,
+        )[...] = arr
+        info["thumbnail"] = offset
+    return info
+
+
+def completed_futures(
+    executor, function, arguments, thumbnail_slots=None, metrics=None, prefetcher=None
+):
+    """
+    Submit the function for every argument and yield the arguments and futures as the futures
+    complete. When thumbnail slots are given, the thumbnails are returned via shared memory and at
+    most one task per slot is in flight. The thumbnails are copied out of the shared memory into
+    the "thumbnail" entry of the result dictionary before the future is yielded.
+
+    Parameters
+    ----------
+    executor (concurrent.futures.Executor): Executor running the tasks.
+    function (callable): Function called with a single argument, returning a dictionary when
+                         thumbnail slots are given.
+    arguments (iterable): The arguments, one per task.
+    thumbnail_slots (SharedThumbnailSlots): Shared memory used to return the thumbnails.
+    metrics (ProgressMetrics): Metrics updated by the tasks, see ProgressMetrics.track.
+    prefetcher (ReadAheadPrefetcher): Reads the files of upcoming tasks ahead, the tasks probe the
+                                      page cache (see page_cache_probed_task).
+
+    Returns
+    -------
+    generator(tuple(argument, concurrent.futures.Future)): The arguments and futures in
+                                                           completion order.
+    """
+    if metrics is not None:
+        function = partial(timed_task, function)
+    if prefetcher is not None:
+        function = partial(page_cache_probed_task, function)
+        prefetcher.read_ahead()
+    if thumbnail_slots is None:
+        future_arguments = {}
+        for argument in arguments:
+            future = executor.submit(function, argument)
+            if metrics is not None:
+                metrics.track(future, argument)
+            # serially executed tasks are complete once submitted
+            if isinstance(executor, SerialExecutor):
+                if prefetcher is not None:
+                    prefetcher.task_done(argument, future)
+                yield argument, future
+                continue
+            future_arguments[future] = argument
+        for future in concurrent.futures.as_completed(future_arguments):
+            if prefetcher is not None:
+                prefetcher.task_done(future_arguments[future], future)
+            yield future_arguments[future], future
+        return
+    arguments = iter(arguments)
+    pending = {}
+    listing_done = False
+    while True:
+        while not listing_done and thumbnail_slots.free_offsets:
+            try:
+                argument = next(arguments)
+            except StopIteration:
+                listing_done = True
+                break
+            offset = thumbnail_slots.free_offsets.pop()
+            future = executor.submit(
+                inspect_with_shared_thumbnail,
+                function,
+                thumbnail_slots.shared_memory.name,
+                offset,
+                argument,
+            )
+            pending[future] = (argument, offset)
+            if metrics is not None:
+                metrics.track(future, argument)
+        if not pending:
+            return
+        done, _ = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in done:
+            argument, offset = pending.pop(future)
+            if future.exception() is None and "thumbnail" in future.result():
+                future.result()["thumbnail"] = thumbnail_slots.thumbnail(offset)
+            thumbnail_slots.free_offsets.append(offset)
+            if prefetcher is not None:
+                prefetcher.task_done(argument, future)
+            yield argument, future
+
+
+# Result dictionary entry holding the worker's id and the duration of the task, added
+# by timed_task and removed from the results before they are combined into a dataframe.
+WORKER_TIME_KEY = "worker time"
+
+# Minimal interval, in seconds, between rewrites of the metrics file.
+METRICS_INTERVAL = 5.0
+
+
+def timed_task(function, *args):
+    """
+    Run a task in a worker and add the worker's id and the task duration to the returned
+    dictionary (WORKER_TIME_KEY entry), used for the per worker utilization metrics. The worker id
+    is the process id, and the thread name for worker threads (see initialize_thread_worker).
+
+    Parameters
+    ----------
+    function (callable): Function returning a dictionary (e.g. inspect_single_file) or another
+                         value which is returned as is (e.g. get_series_key_fname).
+    args: Arguments passed to the function.
+    """
+    start_time = time.perf_counter()
+    result = function(*args)
+    if isinstance(result, dict):
+        result[WORKER_TIME_KEY] = (
+            getattr(_worker_state, "worker_id", str(os.getpid())),
+            time.perf_counter() - start_time,
+        )
+    return result
+
+
+class ProgressMetrics:
+    """
+    Throughput metrics of a characterization run phase (e.g. series inspection), written to a
+    status file for monitoring long running, headless, runs. The file is rewritten at most every
+    METRICS_INTERVAL seconds as tasks complete and once more at the end of the phase. It is
+    replaced atomically, so readers never see a partially written file. Files with the .prom
+    extension use the Prometheus text exposition format (e.g. for the node exporter textfile
+    collector), otherwise the file is written in JSON format.
+
+    The task futures are tracked using done callbacks which are invoked by the executor's thread,
+    the metrics are therefore guarded by a lock.
+    """
+
+    def __init__(self, file_name, phase, total=None, count_failures=True):
+        """
+        Parameters
+        ----------
+        file_name (str): Path of the metrics file.
+        phase (str): Name of the phase reported in the metrics.
+        total (int): Total number of tasks in this phase, None if unknown (no ETA is reported).
+        count_failures (bool): Count tasks that raised an exception as failures, or not (e.g.
+                               non DICOM files when grouping files into series), can be
+                               overridden per task.
+        """
+        self.file_name = file_name
+        self.phase = phase
+        self.total = total
+        self.count_failures = count_failures
+        self.start_time = time.perf_counter()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.files = 0
+        self.bytes = 0
+        self.worker_busy_time = defaultdict(float)
+        self.last_write_time = None
+        self.lock = threading.Lock()
+
+    def track(self, future, argument, count_failures=None):
+        """
+        Track a submitted task.
+
+        Parameters
+        ----------
+        future (concurrent.futures.Future): The task's future.
+        argument (str or tuple(str, list(str))): The task argument, a file name or series data
+                                                 (see inspect_single_series).
+        count_failures (bool): Count the task as a failure if it raises an exception, if None
+                               the count_failures value given to the constructor is used.
+        """
+        file_names = [argument] if isinstance(argument, str) else argument[1]
+        if count_failures is None:
+            count_failures = self.count_failures
+        with self.lock:
+            self.submitted += 1
+            if self.last_write_time is None:
+                self._write()
+        future.add_done_callback(
+            lambda future: self._task_done(future, file_names, count_failures)
+        )
+
+    def _task_done(self, future, file_names, count_failures):
+        if future.cancelled():
+            with self.lock:
+                self.submitted -= 1
+            return
+        file_sizes = 0
+        for file_name in file_names:
+            # archive members and remote files are not counted
+            try:
+                file_sizes += os.path.getsize(file_name)
+            except OSError:
+                pass
+        with self.lock:
+            self.completed += 1
+            self.files += len(file_names)
+            self.bytes += file_sizes
+            if future.exception() is not None:
+                self.failed += count_failures
+            elif isinstance(future.result(), dict) and (
+                WORKER_TIME_KEY in future.result()
+            ):
+                worker_id, busy_time = future.result()[WORKER_TIME_KEY]
+                self.worker_busy_time[worker_id] += busy_time
+            if time.perf_counter() - self.last_write_time >= METRICS_INTERVAL:
+                self._write()
+
+    def status(self):
+        """
+        Returns
+        -------
+        dict: The current metrics, rates are averages since the start of the phase.
+        """
+        elapsed_time = max(time.perf_counter() - self.start_time, 1e-9)
+        eta = None
+        if self.total is not None and self.completed > 0:
+            eta = (self.total - self.completed) * elapsed_time / self.completed
+        return {
+            "phase": self.phase,
+            "timestamp": time.time(),
+            "elapsed seconds": elapsed_time,
+            "total": self.total,
+            "completed": self.completed,
+            "in flight": self.submitted - self.completed,
+            "failures": self.failed,
+            "files per second": self.files / elapsed_time,
+            "bytes per second": self.bytes / elapsed_time,
+            "eta seconds": eta,
+            "worker utilization": {
+                worker_id: busy_time / elapsed_time
+                for worker_id, busy_time in sorted(self.worker_busy_time.items())
+            },
+        }
+
+    def write(self):
+        """
+        Write the metrics file.
+        """
+        with self.lock:
+            self._write()
+
+    def _write(self):
+        self.last_write_time = time.perf_counter()
+        status = self.status()
+        if self.file_name.endswith(".prom"):
+            phase = status.pop("phase")
+            worker_utilization = status.pop("worker utilization")
+            lines = []
+            for name, value in status.items():
+                if value is None:
+                    continue
+                metric = "characterize_data_" + name.replace(" ", "_")
+                lines += [
+                    f"# TYPE {metric} gauge",
+                    f'{metric}{{phase="{phase}"}} {value}',
+                ]
+            metric = "characterize_data_worker_utilization"
+            lines.append(f"# TYPE {metric} gauge")
+            lines += [
+                f'{metric}{{phase="{phase}",worker="{worker_id}"}} {value}'
+                for worker_id, value in worker_utilization.items()
+            ]
+            content = "\n".join(lines) + "\n"
+        else:
+            content = json.dumps(status, indent=2)
+        tmp_file_name = self.file_name + ".tmp"
+        with open(tmp_file_name, "w") as fp:
+            fp.write(content)
+        os.replace(tmp_file_name, self.file_name)
+
+
+def progress_metrics(metrics_file, phase, total=None, count_failures=True):
+    """
+    Create the metrics for a phase of the run, see ProgressMetrics.
+
+    Returns
+    -------
+    ProgressMetrics or None if metrics_file is None.
+    """
+    if metrics_file is None:
+        return None
+    return ProgressMetrics(metrics_file, phase, total, count_failures)
+
+
+def shared_thumbnail_slots(
+    shared_thumbnails, thumbnail_settings, max_processes, backend="process"
+):
+    """
+    Create the shared memory slots used to return thumbnails from the worker processes, four
+    slots per process.
+
+    Parameters
+    ----------
+    shared_thumbnails (bool): Return the thumbnails via shared memory, or not.
+    thumbnail_settings(dict): The thumbnail settings, see inspect_files.
+    max_processes (int): Maximal number of processes, if None the number of processors.
+    backend (str): The execution backend, see task_executor. Only worker processes return the
+                   thumbnails via shared memory.
+
+    Returns
+    -------
+    Context manager, SharedThumbnailSlots or None if thumbnails are not created or shared.
+    """
+    if not (
+        shared_thumbnails
+        and thumbnail_settings
+        and resolve_backend(backend, max_processes, shared_thumbnails) == "process"
+    ):
+        return contextlib.nullcontext()
+    return SharedThumbnailSlots(
+        thumbnail_settings["thumbnail_sizes"],
+        4 * (max_processes if max_processes else os.cpu_count()),
+    )
+
+
+# Result dictionary entry holding the number of the task's files whose beginning was in the page
+# cache when the task started, added by page_cache_probed_task and removed by ReadAheadPrefetcher.
+PAGE_CACHE_KEY = "page cache hits"
+
+# Number of threads issuing the read-ahead requests, opening a file on high latency storage
+# blocks the thread.
+READ_AHEAD_THREADS = 8
+
+
+def task_file_names(argument):
+    """
+    The files read by a task, the argument is a file name (see inspect_single_file) or series data
+    (see inspect_single_series).
+    """
+    return [argument] if isinstance(argument, str) else argument[1]
+
+
+def in_page_cache(file_name):
+    """
+    Check if the beginning of a file is in the page cache, using a non blocking read (Linux).
+
+    Returns
+    -------
+    bool or None: None if this cannot be determined (platform, file system or remote file).
+    """
+    if not hasattr(os, "RWF_NOWAIT"):
+        return None
+    try:
+        fd = os.open(file_name, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        os.preadv(fd, [bytearray(4096)], 0, os.RWF_NOWAIT)
+        return True
+    except BlockingIOError:
+        return False
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+def page_cache_probed_task(function, argument):
+    """
+    Run a task in a worker and add the number of its files whose beginning was in the page cache
+    when the task started, and the number of probed files, to the returned dictionary
+    (PAGE_CACHE_KEY entry), used for the read-ahead hit rate.
+    """
+    probes = [in_page_cache(f) for f in task_file_names(argument)]
+    result = function(argument)
+    if isinstance(result, dict):
+        probes = [p for p in probes if p is not None]
+        result[PAGE_CACHE_KEY] = (sum(probes), len(probes))
+    return result
+
+
+def read_ahead_file(file_name):
+    """
+    Start reading a file into the page cache, using posix_fadvise where available, otherwise the
+    file is read and the data discarded.
+    """
+    with open(file_name, "rb", buffering=0) as fp:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fp.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            while fp.read(1 << 20):
+                pass
+
+
+class ReadAheadPrefetcher:
+    """
+    Read-ahead of the files of upcoming tasks into the page cache, so that workers reading from
+    high latency storage (e.g. network file systems) find the data already cached. The workers
+    take the tasks in submission order, so with N workers and C completed tasks the tasks up to
+    about C+N are in flight and the files of the following N*files_per_worker tasks are read ahead,
+    bounded by a byte budget for the files of tasks which did not complete yet. The read-ahead
+    requests are issued by READ_AHEAD_THREADS threads of the main process. Only local files are
+    read ahead, not archive members and remote files. The hit rate is the fraction of the tasks'
+    files whose beginning was in the page cache when the task started (see
+    page_cache_probed_task), on platforms where this can be determined (Linux).
+    """
+
+    def __init__(self, arguments, max_workers, files_per_worker, byte_budget):
+        """
+        Parameters
+        ----------
+        arguments (list): The task arguments in submission order, file names or series data.
+        max_workers (int): Number of workers.
+        files_per_worker (int): Number of upcoming tasks per worker whose files are read ahead.
+        byte_budget (int): Maximal number of bytes read ahead for tasks which did not complete.
+        """
+        self.arguments = list(arguments)
+        self.max_workers = max_workers
+        self.window = max_workers * (1 + files_per_worker)
+        self.byte_budget = byte_budget
+        self.next_index = 0
+        self.completed = 0
+        self.completed_keys = set()
+        self.pending_bytes = 0
+        self.argument_bytes = {}
+        self.read_ahead_files = 0
+        self.hits = 0
+        self.probed = 0
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            READ_AHEAD_THREADS, thread_name_prefix="read_ahead"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def task_key(argument):
+        # file name or series key
+        return argument if isinstance(argument, str) else argument[0]
+
+    def read_ahead(self):
+        """
+        Issue the read-ahead requests for the upcoming tasks allowed by the window and budget.
+        """
+        # tasks that are in flight or completed are not read ahead, otherwise their bytes would
+        # never be released from the budget
+        self.next_index = max(self.next_index, self.completed + self.max_workers)
+        while (
+            self.next_index < len(self.arguments)
+            and self.next_index < self.completed + self.window
+        ):
+            argument = self.arguments[self.next_index]
+            if self.task_key(argument) in self.completed_keys:
+                self.next_index += 1
+                continue
+            argument_bytes = 0
+            for file_name in task_file_names(argument):
+                if is_url(file_name) or ARCHIVE_MEMBER_SEPARATOR in file_name:
+                    continue
+                try:
+                    size = os.path.getsize(file_name)
+                except OSError:
+                    continue
+                if self.pending_bytes + argument_bytes + size > self.byte_budget:
+                    break
+                argument_bytes += size
+                self.read_ahead_files += 1
+                self.executor.submit(read_ahead_file, file_name)
+            if argument_bytes == 0 and self.pending_bytes > 0:
+                # the budget is exhausted, continue once tasks complete
+                break
+            self.pending_bytes += argument_bytes
+            self.argument_bytes[self.task_key(argument)] = argument_bytes
+            self.next_index += 1
+
+    def task_done(self, argument, future):
+        """
+        Account for a completed task, record its page cache hits and read ahead further.
+
+        Parameters
+        ----------
+        argument (str or tuple(str, list(str))): The task argument.
+        future (concurrent.futures.Future): The completed task's future.
+        """
+        self.completed += 1
+        self.completed_keys.add(self.task_key(argument))
+        self.pending_bytes -= self.argument_bytes.pop(self.task_key(argument), 0)
+        if future.exception() is None and isinstance(future.result(), dict):
+            hits, probed = future.result().pop(PAGE_CACHE_KEY, (0, 0))
+            self.hits += hits
+            self.probed += probed
+        self.read_ahead()
+
+    def summary(self):
+        """
+        Returns
+        -------
+        str: Number of files read ahead and the page cache hit rate.
+        """
+        hit_rate = (
+            f"{self.hits / self.probed:.1%} ({self.hits} of {self.probed} files)"
+            if self.probed
+            else "unknown"
+        )
+        return (
+            f"Read ahead {self.read_ahead_files} files, page cache hit rate {hit_rate}"
+        )
+
+
+def read_ahead_prefetcher(arguments, max_workers, files_per_worker, byte_budget):
+    """
+    Create the read-ahead prefetcher for the given tasks, see ReadAheadPrefetcher.
+
+    Returns
+    -------
+    Context manager, ReadAheadPrefetcher or None if read-ahead is disabled (files_per_worker is 0).
+    """
+    if not files_per_worker:
+        return contextlib.nullcontext()
+    return ReadAheadPrefetcher(
+        arguments,
+        max_workers if max_workers else os.cpu_count(),
+        files_per_worker,
+        byte_budget,
+    )
+
+
+# Environment variable holding the local read-through cache directory used for files in object
+# stores and other remote storage (set via the --cache_directory option). Using an environment
+# variable ensures that the worker processes use the same cache, regardless of the process start
+# method.
+CACHE_DIRECTORY_ENV = "CHARACTERIZE_DATA_CACHE_DIRECTORY"
+
+
+def is_url(file_name):
+    """
+    Check if a file name is a URL handled by fsspec (e.g. s3://bucket/data/image.dcm).
+    """
+    return "://" in file_name
+
+
+def cached_object(
+    url, header_only=False, header_size=1 << 16, range_size=1 << 23, max_ranges=8
+):
+    """
+    Get a local copy of a file stored in an object store or other remote storage supported by
+    fsspec, using a local read-through cache. Objects are identified by their URL, size and version
+    (ETag or modification time), so that modified objects are read again. Large objects are read
+    using multiple byte range requests, which are issued concurrently by asynchronous fsspec
+    file systems (e.g. s3fs).
+
+    When only the header is required, only the first header_size bytes are read and the local file
+    is extended to the object size as a sparse file, pixel data is not read and is all zeros. This
+    allows reading the image information (e.g. DICOM tags) without transferring the whole object.
+
+    Parameters
+    ----------
+    url (str): fsspec URL (e.g. s3://bucket/data/image.dcm).
+    header_only (bool): Only read the beginning of the object.
+    header_size (int): Number of bytes read when only the header is required.
+    range_size (int): Size of the byte ranges used to read large objects.
+    max_ranges (int): Maximal number of byte ranges read concurrently (bounds the memory used).
+
+    Returns
+    -------
+    str: Path to a local file with the same content (or header) and file name as the object.
+    """
+    import fsspec
+
+    fs, path = fsspec.core.url_to_fs(url)
+    info = fs.info(path)
+    size = info["size"]
+    version = info.get("ETag", info.get("etag", info.get("mtime", "")))
+    key = hashlib.sha256(f"{url}:{size}:{version}".encode()).hexdigest()
+    cache_dir = os.path.join(
+        os.environ.get(
+            CACHE_DIRECTORY_ENV,
+            os.path.join(tempfile.gettempdir(), "characterize_data_cache"),
+        ),
+        key[:2],
+        key,
+    )
+    file_name = os.path.join(cache_dir, posixpath.basename(path))
+    if os.path.exists(file_name):
+        return file_name
+    header_only = header_only and size > header_size
+    if header_only:
+        cache_dir = os.path.join(cache_dir, "header")
+        header_file_name = os.path.join(cache_dir, posixpath.basename(path))
+        if os.path.exists(header_file_name):
+            return header_file_name
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file and then rename, so that concurrent readers never see a partial file
+    with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as fp:
+        try:
+            if header_only:
+                fp.write(fs.cat_file(path, start=0, end=header_size))
+                fp.truncate(size)
+            else:
+                starts = list(range(0, size, range_size))
+                for i in range(0, len(starts), max_ranges):
+                    batch_starts = starts[i : i + max_ranges]
+                    for data in fs.cat_ranges(
+                        [path] * len(batch_starts),
+                        batch_starts,
+                        [min(s + range_size, size) for s in batch_starts],
+                        on_error="raise",
+                    ):
+                        fp.write(data)
+        except BaseException:
+            # failed reads do not leave partial files in the cache
+            fp.close()
+            os.unlink(fp.name)
+            raise
+    if header_only:
+        os.replace(fp.name, header_file_name)
+        return header_file_name
+    os.replace(fp.name, file_name)
+    return file_name
+
+
+# Extensions of the header files of formats with a separate header and data file.
+SPLIT_HEADER_EXTENSIONS = (".mhd", ".hdr", ".nhdr")
+
+
+def cached_split_header_object(url):
+    """
+    Get a local copy of the header file of a format with a separate header and data file (mhd, hdr,
+    nhdr), stored in an object store or other remote storage supported by fsspec. Objects in the same
+    directory with the same name and a different extension (e.g. MetaImage mhd/raw) are also cached
+    and linked into the directory of the header file, see cached_object.
+
+    Parameters
+    ----------
+    url (str): fsspec URL of the header file (e.g. s3://bucket/data/image.mhd).
+
+    Returns
+    -------
+    str: Path to a local file with the same content and file name as the header object, its data
+         objects are in the same directory.
+    """
+    import fsspec
+
+    header_file_name = cached_object(url)
+    fs, path = fsspec.core.url_to_fs(url)
+    object_dir, base_name = posixpath.split(path)
+    stem = base_name.split(".")[0]
+    for sibling_path in fs.ls(object_dir, detail=False):
+        sibling_base_name = posixpath.basename(sibling_path)
+        if sibling_base_name.split(".")[0] != stem or sibling_base_name == base_name:
+            continue
+        sibling_file_name = cached_object(fs.unstrip_protocol(sibling_path))
+        link_name = os.path.join(os.path.dirname(header_file_name), sibling_base_name)
+        # the data object may have been modified after the header was cached
+        if os.path.exists(link_name) and os.path.samefile(link_name, sibling_file_name):
+            continue
+        temporary_link_name = f"{link_name}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            os.link(sibling_file_name, temporary_link_name)
+        except OSError:
+            shutil.copyfile(sibling_file_name, temporary_link_name)
+        os.replace(temporary_link_name, link_name)
+    return header_file_name
+
+
+# Archive members are identified by the archive's path followed by this separator and the
+# member's path inside the archive (e.g. /data/study.zip!/series1/image1.dcm).
+ARCHIVE_MEMBER_SEPARATOR = "!/"
+ARCHIVE_EXTENSIONS = (
+    ".zip",
+    ".tar",
+    ".tar.gz",
+    ".tgz",
+    ".tar.bz2",
+    ".tbz2",
+    ".tar.xz",
+    ".txz",
+)
+# Archive members are extracted to a memory backed file system, if available, as SimpleITK
+# reads images from files.
+TMPFS_DIR = (
+    "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+)
+# Per thread cache of open archives, avoids re-reading the archive index for every member.
+_open_archives = threading.local()
+
+
+def split_archive_member_path(file_name):
+    """
+    Split an archive-qualified path into the archive path and the member path.
+
+    Parameters
+    ----------
+    file_name (str): File path, possibly archive-qualified.
+
+    Returns
+    -------
+    tuple(str, str): The archive path and member path, or the file_name and None if the path is not
+                     archive-qualified.
+    """
+    archive_name, separator, member_name = file_name.partition(ARCHIVE_MEMBER_SEPARATOR)
+    if separator and archive_name.lower().endswith(ARCHIVE_EXTENSIONS):
+        return archive_name, member_name
+    return file_name, None
+
+
+def open_archive(archive_name):
+    """
+    Open an archive for reading, archives are cached per thread and at most a few are kept open.
+
+    Parameters
+    ----------
+    archive_name (str): Path to a zip or tar archive.
+
+    Returns
+    -------
+    zipfile.ZipFile or tarfile.TarFile
+    """
+    # archives opened by a parent process are not reused after fork, the file offset is shared
+    # between the processes.
+    if getattr(_open_archives, "pid", None) != os.getpid():
+        _open_archives.archives = {}
+        _open_archives.member_indexes = {}
+        _open_archives.pid = os.getpid()
+    archives = _open_archives.archives
+    if archive_name not in archives:
+        if len(archives) >= 4:
+            evicted_archive_name = next(iter(archives))
+            archives.pop(evicted_archive_name).close()
+            _open_archives.member_indexes.pop(evicted_archive_name, None)
+        local_archive_name = (
+            cached_object(archive_name) if is_url(archive_name) else archive_name
+        )
+        if zipfile.is_zipfile(local_archive_name):
+            archives[archive_name] = zipfile.ZipFile(local_archive_name, "r")
+        else:
+            archives[archive_name] = tarfile.open(local_archive_name, "r:*")
+    return archives[archive_name]
+
+
+def get_archive_member_names(archive_name):
+    """
+    Get the archive-qualified paths of all the regular files in an archive.
+
+    Parameters
+    ----------
+    archive_name (str): Path to a zip or tar archive.
+
+    Returns
+    -------
+    list(str): Archive-qualified paths of the archive members.
+    """
+    archive = open_archive(archive_name)
+    if isinstance(archive, zipfile.ZipFile):
+        member_names = [m.filename for m in archive.infolist() if not m.is_dir()]
+    else:
+        member_names = [m.name for m in archive.getmembers() if m.isfile()]
+    return [archive_name + ARCHIVE_MEMBER_SEPARATOR + m for m in member_names]
+
+
+def get_archive_member_index(archive_name):
+    """
+    Get the archive-qualified paths of the regular files in an archive indexed by their directory
+    and file name stem (the file name up to the first "."), used to find the data files of split
+    header formats. The index is built once and cached along with the open archive.
+
+    Parameters
+    ----------
+    archive_name (str): Path to a zip or tar archive.
+
+    Returns
+    -------
+    dict((str, str), list(str)): Archive-qualified paths of the members for each (directory, stem).
+    """
+    open_archive(archive_name)
+    member_indexes = _open_archives.member_indexes
+    if archive_name not in member_indexes:
+        member_index = defaultdict(list)
+        for name in get_archive_member_names(archive_name):
+            member_dir, member_base_name = posixpath.split(
+                split_archive_member_path(name)[1]
+            )
+            member_index[(member_dir, member_base_name.split(".")[0])].append(name)
+        member_indexes[archive_name] = member_index
+    return member_indexes[archive_name]
+
+
+def extract_archive_member(file_name, output_file_name):
+    """
+    Write the contents of an archive member to a file.
+
+    Parameters
+    ----------
+    file_name (str): Archive-qualified path.
+    output_file_name (str): Path of the output file.
+    """
+    archive_name, member_name = split_archive_member_path(file_name)
+    archive = open_archive(archive_name)
+    if isinstance(archive, zipfile.ZipFile):
+        member_fp = archive.open(member_name)
+    else:
+        member_fp = archive.extractfile(member_name)
+    with member_fp, open(output_file_name, "wb") as fp:
+        shutil.copyfileobj(member_fp, fp, 1 << 20)
+
+
+@contextlib.contextmanager
+def local_file(file_name, header_only=False):
+    """
+    Context manager providing a local file system path for reading the given file. For regular files
+    this is the file itself. For files in remote storage (URL) this is a file in the local
+    read-through cache (see cached_object). For archive members, the member is extracted to a temporary directory,
+    on a memory backed file system if available, and removed on exit. For header files of formats with
+    a separate header and data file (mhd, hdr, nhdr), members in the same archive directory with the
+    same name and a different extension (e.g. MetaImage mhd/raw) are also extracted, and objects in
+    the same remote directory are also cached (see cached_split_header_object).
+
+    Parameters
+    ----------
+    file_name (str): File path or URL, possibly archive-qualified.
+    header_only (bool): For files in remote storage, only the beginning of the file is
+                        required (see cached_object).
+
+    Returns
+    -------
+    str: Path of a file with the same content and extension as the original.
+    """
+    archive_name, member_name = split_archive_member_path(file_name)
+    if member_name is None:
+        if not is_url(file_name):
+            yield file_name
+        elif not header_only and file_name.lower().endswith(SPLIT_HEADER_EXTENSIONS):
+            yield cached_split_header_object(file_name)
+        else:
+            yield cached_object(file_name, header_only=header_only)
+        return
+    with tempfile.TemporaryDirectory(dir=TMPFS_DIR) as tmpdirname:
+        member_dir, member_base_name = posixpath.split(member_name)
+        extract_archive_member(file_name, os.path.join(tmpdirname, member_base_name))
+        if member_base_name.lower().endswith(SPLIT_HEADER_EXTENSIONS):
+            stem = member_base_name.split(".")[0]
+            for name in get_archive_member_index(archive_name).get(
+                (member_dir, stem), []
+            ):
+                sibling_base_name = posixpath.basename(name)
+                if sibling_base_name != member_base_name:
+                    extract_archive_member(
+                        name, os.path.join(tmpdirname, sibling_base_name)
+                    )
+        yield os.path.join(tmpdirname, member_base_name)
+
+
+def iter_all_file_names(root_dir, inspect_archives=False):
+    """
+    Iterate over the full path of all files in the directory structure. The directory
+    structure is traversed lazily, one directory at a time, and the files of a directory
+    are yielded consecutively.
+
+    Parameters
+    ----------
+    root_dir (str): Path to the root of the data directory, or an fsspec URL (e.g. s3://bucket/data).
+    inspect_archives (bool): Replace zip and tar archives with the archive-qualified paths of their
+                             members (e.g. /data/study.zip!/series1/image1.dcm).
+
+    Yields
+    ------
+    str: Absolute paths of the files found in the directory structure, or URLs if the
+         root_dir is a URL.
+    """
+    if is_url(root_dir):
+        import fsspec
+
+        fs, root_path = fsspec.core.url_to_fs(root_dir)
+        file_names = (fs.unstrip_protocol(p) for p in fs.find(root_path))
+    else:
+        file_names = (
+            os.path.join(os.path.abspath(dir_name), fname)
+            for dir_name, subdir_names, dir_file_names in os.walk(root_dir)
+            for fname in dir_file_names
+        )
+    for file_name in file_names:
+        if inspect_archives:
+            yield from expand_archives([file_name])
+        else:
+            yield file_name
+
+
+def get_all_file_names(root_dir, inspect_archives=False):
+    """
+    Get the full path of all files in the directory structure.
+
+    Parameters
+    ----------
+    root_dir (str): Path to the root of the data directory, or an fsspec URL (e.g. s3://bucket/data).
+    inspect_archives (bool): Replace zip and tar archives with the archive-qualified paths of their
+                             members (e.g. /data/study.zip!/series1/image1.dcm).
+
+    Returns
+    -------
+    list(str): Absolute paths of all files found in the directory structure, or URLs if the
+               root_dir is a URL.
+    """
+    return list(iter_all_file_names(root_dir, inspect_archives))
+
+
+def expand_archives(file_names):
+    """
+    Replace zip and tar archives in a list of files with the archive-qualified paths of their
+    members. Files with an archive extension that cannot be opened as an archive are kept as is.
+
+    Parameters
+    ----------
+    file_names (list(str)): File paths.
+
+    Returns
+    -------
+    list(str): File paths with archives replaced by their members.
+    """
+    expanded_file_names = []
+    for file_name in file_names:
+        if file_name.lower().endswith(ARCHIVE_EXTENSIONS):
+            try:
+                expanded_file_names += get_archive_member_names(file_name)
+                continue
+            except Exception:
+                pass
+        expanded_file_names.append(file_name)
+    return expanded_file_names
+
+
+def geometry_columns(geometry_layout):
+    """
+    Get the names of the columns describing the image geometry (size, spacing, origin and axis
+    direction) for the given layout.
+
+    Parameters
+    ----------
+    geometry_layout (str): "tuples", each geometry property is stored as a tuple in a single column, or
+                           "columns", each component of a geometry property is stored in its own numeric
+                           column, with 2D images embedded in 3D (see image_geometry_columns).
+
+    Returns
+    -------
+    list(str): The column names.
+    """
+    if geometry_layout == "columns":
+        return (
+            ["image dimension"]
+            + [f"image size {axis}" for axis in ["x", "y", "z"]]
+            + [f"image spacing {axis}" for axis in ["x", "y", "z"]]
+            + [f"image origin {axis}" for axis in ["x", "y", "z"]]
+            + [f"axis direction {i}" for i in range(9)]
+        )
+    return ["image size", "image spacing", "image origin", "axis direction"]
+
+
+def image_geometry_columns(sitk_image):
+    """
+    Get the image geometry as a fixed number of scalar values. 2D images are embedded in 3D, as done
+    by ITK, the z size and spacing are one, the z origin is zero and the axis direction is extended with
+    the z axis. For images with more than three dimensions only the first three are reported.
+
+    Parameters
+    ----------
+    sitk_image (SimpleITK.Image): Input image.
+
+    Returns
+    -------
+    dict: Values of the geometry columns for the "columns" layout, see geometry_columns.
+    """
+    return geometry_column_values(
+        sitk_image.GetSize(),
+        sitk_image.GetSpacing(),
+        sitk_image.GetOrigin(),
+        sitk_image.GetDirection(),
+    )
+
+
+def geometry_column_values(size, spacing, origin, direction):
+    """
+    Get the geometry given by its values as a fixed number of scalar values, see
+    image_geometry_columns.
+
+    Parameters
+    ----------
+    size (tuple(int)): Image size.
+    spacing (tuple(float)): Image spacing.
+    origin (tuple(float)): Image origin.
+    direction (tuple(float)): Image axis directions, flattened row major matrix.
+
+    Returns
+    -------
+    dict: Values of the geometry columns for the "columns" layout, see geometry_columns.
+    """
+    dimension = len(size)
+    padding = max(0, 3 - dimension)
+    size = tuple(size)[:3] + (1,) * padding
+    spacing = tuple(spacing)[:3] + (1.0,) * padding
+    origin = tuple(origin)[:3] + (0.0,) * padding
+    direction_matrix = np.identity(3)
+    direction_matrix[: min(dimension, 3), : min(dimension, 3)] = np.reshape(
+        direction, (dimension, dimension)
+    )[:3, :3]
+    return dict(
+        zip(
+            geometry_columns("columns"),
+            [dimension, *size, *spacing, *origin, *direction_matrix.ravel().tolist()],
+        )
+    )
+
+
+def typed_geometry_columns(df):
+    """
+    Use integer types for the integer valued geometry columns of the "columns" layout. Rows of files
+    that could not be read have missing values, so the nullable integer type is used.
+
+    Parameters
+    ----------
+    df (pandas.DataFrame): Data frame with the inspection results, modified in place.
+
+    Returns
+    -------
+    pandas.DataFrame: The given data frame.
+    """
+    integer_columns = [
+        c
+        for c in ["image dimension", "image size x", "image size y", "image size z"]
+        if c in df.columns
+    ]
+    if integer_columns:
+        df[integer_columns] = df[integer_columns].astype("Int64")
+    return df
+
+
+# Groups of output columns that can be requested (--columns), by default all are reported.
+OUTPUT_COLUMN_GROUPS = ["geometry", "pixel type", "hash", "statistics", "meta data"]
+
+
+# Algorithms used for the intensity hash, the hashlib algorithms are always available, xxh3_128
+# requires the xxhash package and blake3 the blake3 package.
+INTENSITY_HASH_ALGORITHMS = ["md5", "sha1", "sha256", "blake2b", "xxh3_128", "blake3"]
+
+
+def intensity_hasher(algorithm):
+    """
+    Create an incremental hash object for the intensity hash, fed with the pixel data using its
+    update method, possibly one slice at a time.
+
+    Parameters
+    ----------
+    algorithm (str): One of INTENSITY_HASH_ALGORITHMS.
+
+    Returns
+    -------
+    Hash object with the hashlib interface (update, hexdigest).
+    """
+    if algorithm == "xxh3_128":
+        import xxhash
+
+        return xxhash.xxh3_128()
+    if algorithm == "blake3":
+        import blake3
+
+        return blake3.blake3()
+    return hashlib.new(algorithm)
+
+
+def array_intensity_hash(np_arr, algorithm):
+    """
+    Intensity hash of an array, identical to the hash computed one slice at a time (see
+    inspect_series_slices).
+    """
+    hasher = intensity_hasher(algorithm)
+    hasher.update(np_arr)
+    return hasher.hexdigest()
+
+
+def intensity_hash_column(algorithm):
+    """
+    Name of the intensity hash column, which records the algorithm (e.g. "MD5 intensity hash"),
+    hashes computed with different algorithms are never compared.
+    """
+    return f"{algorithm.upper()} intensity hash"
+
+
+def output_columns(
+    columns, geometry_layout, histogram_statistics, intensity_hash="md5"
+):
+    """
+    Get the names of the image information columns reported for the requested column groups, not
+    including the "files" column and the meta-data and external program columns whose names are
+    user defined.
+
+    Parameters
+    ----------
+    columns (list(str)): The requested column groups, see OUTPUT_COLUMN_GROUPS.
+    geometry_layout (str): The layout of the geometry columns, see geometry_columns.
+    histogram_statistics (bool): The intensity histogram statistics are reported, or not.
+    intensity_hash (str): The intensity hash algorithm, see intensity_hash_column.
+
+    Returns
+    -------
+    list(str): The column names.
+    """
+    return (
+        (geometry_columns(geometry_layout) if "geometry" in columns else [])
+        + (["pixel type"] if "pixel type" in columns else [])
+        + ([intensity_hash_column(intensity_hash)] if "hash" in columns else [])
+        + (
+            ["min intensity", "max intensity", "mean intensity", "std intensity"]
+            if "statistics" in columns
+            else []
+        )
+        + (HISTOGRAM_STATISTICS_COLUMNS if histogram_statistics else [])
+    )
+
+
+def requires_pixel_data(columns, thumbnail_settings, histogram_statistics):
+    """
+    Plan the minimal work needed to report the requested information. The image geometry, the
+    pixel type of scalar images and the meta-data are available from the image header, reading
+    the pixel data is only required for the intensity hash, intensity statistics and thumbnail.
+    Distinguishing multi-channel grayscale images from color images also requires the pixel data,
+    this is only known once the header was read (see inspect_single_file).
+
+    Parameters
+    ----------
+    columns (list(str)): The requested column groups, see OUTPUT_COLUMN_GROUPS.
+    thumbnail_settings(dict): The thumbnail settings, empty if no thumbnail is created.
+    histogram_statistics (bool): The intensity histogram statistics are reported, or not.
+
+    Returns
+    -------
+    bool: True if the pixel data has to be read, False if reading the header is sufficient.
+    """
+    return bool(
+        thumbnail_settings
+        or histogram_statistics
+        or "hash" in columns
+        or "statistics" in columns
+    )
+
+
+HISTOGRAM_PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+# Integer images whose intensity range is at most this number of values have an exact
+# histogram, otherwise the histogram has a bounded number of bins.
+MAX_EXACT_HISTOGRAM_BINS = 1 << 20
+APPROXIMATE_HISTOGRAM_BINS = 1 << 16
+HISTOGRAM_STATISTICS_COLUMNS = [f"p{q} intensity" for q in HISTOGRAM_PERCENTILES] + [
+    "intensity entropy",
+    "mode intensity",
+    "zero fraction",
+    "saturated fraction",
+]
+
+
+def intensity_histogram_statistics(np_arr):
+    """
+    Compute statistics describing the intensity distribution from a single histogram of the
+    intensities. For integer images with an intensity range of at most MAX_EXACT_HISTOGRAM_BINS
+    values the statistics are exact (percentiles are identical to those computed by np.percentile).
+    Otherwise, float images or integer images with a larger range, a histogram with
+    APPROXIMATE_HISTOGRAM_BINS bins spanning the finite intensity range is used, percentiles
+    are linearly interpolated inside the bins, the mode is the center of the most populated bin and
+    the entropy is that of the binned intensities.
+
+    Parameters
+    ----------
+    np_arr (numpy.ndarray): Scalar image intensities.
+
+    Returns
+    -------
+    dict: The percentiles ("p1 intensity", ..., "p99 intensity"), "intensity entropy" (bits),
+          "mode intensity", "zero fraction" (fraction of zero valued pixels) and "saturated fraction"
+          (fraction of pixels with the maximal value of the integer pixel type, not defined for
+          float images).
+    """
+    arr = np_arr.ravel()
+    if arr.size == 0:
+        return dict.fromkeys(HISTOGRAM_STATISTICS_COLUMNS, np.nan)
+    is_integer = np.issubdtype(arr.dtype, np.integer)
+    if is_integer:
+        min_value, max_value = int(arr.min()), int(arr.max())
+    if is_integer and max_value - min_value < MAX_EXACT_HISTOGRAM_BINS:
+        counts = np.bincount(
+            arr if min_value == 0 else arr.astype(np.int64) - min_value,
+            minlength=max_value - min_value + 1,
+        )
+        bin_starts = np.arange(min_value, max_value + 1, dtype=np.float64)
+        bin_widths = np.zeros(len(counts))
+    else:
+        finite_arr = arr if is_integer else arr[np.isfinite(arr)]
+        if finite_arr.size == 0:
+            return dict.fromkeys(HISTOGRAM_STATISTICS_COLUMNS, np.nan)
+        counts, edges = np.histogram(finite_arr, bins=APPROXIMATE_HISTOGRAM_BINS)
+        bin_starts = edges[:-1]
+        bin_widths = np.diff(edges)
+    return histogram_counts_statistics(
+        counts,
+        bin_starts,
+        bin_widths,
+        np.count_nonzero(arr == 0) / arr.size,
+        (
+            np.count_nonzero(arr == np.iinfo(arr.dtype).max) / arr.size
+            if is_integer
+            else np.nan
+        ),
+    )
+
+
+def histogram_counts_statistics(
+    counts, bin_starts, bin_widths, zero_fraction, saturated_fraction
+):
+    """
+    Compute the intensity distribution statistics from an intensity histogram, see
+    intensity_histogram_statistics. Bins with a zero width hold a single intensity value.
+
+    Parameters
+    ----------
+    counts (numpy.ndarray): Number of intensities in each bin, the sum is not zero.
+    bin_starts (numpy.ndarray): Lowest intensity of each bin.
+    bin_widths (numpy.ndarray): Width of each bin.
+    zero_fraction (float): Fraction of zero valued pixels.
+    saturated_fraction (float): Fraction of pixels with the maximal value of the integer pixel type,
+                                NaN for float images.
+
+    Returns
+    -------
+    dict: The statistics, see intensity_histogram_statistics.
+    """
+    statistics = dict.fromkeys(HISTOGRAM_STATISTICS_COLUMNS, np.nan)
+    number_of_values = counts.sum()
+    cumulative_counts = np.cumsum(counts)
+
+    def order_statistic(k):
+        # the k-th smallest value (zero based), inside a bin the values are
+        # assumed to be uniformly distributed
+        bin_index = np.searchsorted(cumulative_counts, k, side="right")
+        rank_in_bin = k - (cumulative_counts[bin_index] - counts[bin_index])
+        return (
+            bin_starts[bin_index]
+            + bin_widths[bin_index] * (rank_in_bin + 0.5) / counts[bin_index]
+        )
+
+    # linear interpolation between the order statistics, same as np.percentile
+    for q in HISTOGRAM_PERCENTILES:
+        h = (number_of_values - 1) * q / 100
+        lower = int(np.floor(h))
+        lower_value = order_statistic(lower)
+        upper_value = order_statistic(min(lower + 1, number_of_values - 1))
+        statistics[f"p{q} intensity"] = lower_value + (h - lower) * (
+            upper_value - lower_value
+        )
+    p = counts[counts > 0] / number_of_values
+    statistics["intensity entropy"] = np.sum(p * np.log2(1 / p))
+    mode_index = np.argmax(counts)
+    statistics["mode intensity"] = bin_starts[mode_index] + bin_widths[mode_index] / 2
+    statistics["zero fraction"] = zero_fraction
+    statistics["saturated fraction"] = saturated_fraction
+    return statistics
+
+
+def inspect_grayscale_image(
+    sitk_image,
+    image_info,
+    histogram_statistics=False,
+    columns=OUTPUT_COLUMN_GROUPS,
+    intensity_hash="md5",
+):
+    np_arr_view = sitk.GetArrayViewFromImage(sitk_image)
+    if "hash" in columns:
+        image_info[intensity_hash_column(intensity_hash)] = array_intensity_hash(
+            np_arr_view, intensity_hash
+        )
+    if "statistics" in columns:
+        mmfilter = sitk.MinimumMaximumImageFilter()
+        mmfilter.Execute(sitk_image)
+        image_info["min intensity"] = mmfilter.GetMinimum()
+        image_info["max intensity"] = mmfilter.GetMaximum()
+        image_info["mean intensity"] = np_arr_view.mean()
+        image_info["std intensity"] = np_arr_view.std()
+    # Potentially provide more complete information on intensity distribution:
+    # skew (scipy.stats.skew, asymmetry around mean),
+    # kurtosis (scipy.stats.kurtosis, how heavy are the distribution tails / how many outliers)
+    # percentiles, [10,25,50,75,90] (np.percentile)
+    # For now, not adding the dependency on scipy.stats. Percentiles and other histogram
+    # based statistics are computed on request, see intensity_histogram_statistics.
+    if histogram_statistics:
+        image_info.update(intensity_histogram_statistics(np_arr_view))
+
+
+def image_geometry_information(sitk_image, image_info, geometry_layout="tuples"):
+    """
+    Add the image geometry to the image_info dictionary.
+
+    Parameters
+    ----------
+    sitk_image (SimpleITK.Image or SimpleITK.ImageFileReader): Image, or a reader after
+                                                               ReadImageInformation was called.
+    image_info (dict): Image information is added to this dictionary.
+    geometry_layout (str): Store the image spatial information as tuples ("tuples") or as separate
+                           numeric values ("columns"), see geometry_columns.
+    """
+    geometry_information(
+        image_info,
+        sitk_image.GetSize(),
+        sitk_image.GetSpacing(),
+        sitk_image.GetOrigin(),
+        sitk_image.GetDirection(),
+        geometry_layout,
+    )
+
+
+def geometry_information(
+    image_info, size, spacing, origin, direction, geometry_layout="tuples"
+):
+    """
+    Add the geometry given by its values to the image_info dictionary, see
+    image_geometry_information.
+
+    Parameters
+    ----------
+    image_info (dict): Image information is added to this dictionary.
+    size (tuple(int)): Image size.
+    spacing (tuple(float)): Image spacing.
+    origin (tuple(float)): Image origin.
+    direction (tuple(float)): Image axis directions, flattened row major matrix.
+    geometry_layout (str): Store the image spatial information as tuples ("tuples") or as separate
+                           numeric values ("columns"), see geometry_columns.
+    """
+    if geometry_layout == "columns":
+        image_info.update(geometry_column_values(size, spacing, origin, direction))
+    else:
+        image_info["image size"] = size
+        image_info["image spacing"] = spacing
+        image_info["image origin"] = origin
+        image_info["axis direction"] = direction
+
+
+def image_meta_data_information(sitk_image, image_info, meta_data_info):
+    """
+    Add the values of the meta_data_info tags found in the image to the image_info dictionary.
+
+    Parameters
+    ----------
+    sitk_image (SimpleITK.Image or SimpleITK.ImageFileReader): Image, or a reader after
+                                                               ReadImageInformation was called.
+    image_info (dict): Image information is added to this dictionary.
+    meta_data_info(dict(str:str)): The meta-data information whose values will be reported.
+                                   Dictionary structure is description:meta_data_tag.
+    """
+    img_keys = sitk_image.GetMetaDataKeys()
+    for k, v in meta_data_info.items():
+        if v in img_keys:
+            image_info[k] = sitk_image.GetMetaData(v)
+
+
+def inspect_image_information(
+    reader,
+    image_info,
+    meta_data_info,
+    geometry_layout="tuples",
+    columns=OUTPUT_COLUMN_GROUPS,
+):
+    """
+    Inspect an image using only its header, the reader's ReadImageInformation was called, adding
+    the information that does not require the pixel data to the image_info dictionary, see
+    requires_pixel_data. Matches the information added by inspect_image for scalar images, for
+    multi-channel images the "pixel type" is not added as it requires the pixel data.
+
+    Parameters
+    ----------
+    reader (SimpleITK.ImageFileReader): Reader after ReadImageInformation was called.
+    image_info (dict): Image information is added to this dictionary.
+    meta_data_info(dict(str:str)): The meta-data information whose values will be reported,
+                                   see inspect_image.
+    geometry_layout (str): Store the image spatial information as tuples ("tuples") or as separate numeric
+                           values ("columns"), see geometry_columns.
+    columns (list(str)): Only add the information of these column groups, see OUTPUT_COLUMN_GROUPS.
+    """
+    if "geometry" in columns:
+        image_geometry_information(reader, image_info, geometry_layout)
+        # the header directions may include negative zeros (e.g. NIfTI), which are not
+        # present in the direction of the image read from the file
+        for k in geometry_columns(geometry_layout):
+            if k.startswith("axis direction"):
+                image_info[k] = (
+                    tuple(d + 0.0 for d in image_info[k])
+                    if isinstance(image_info[k], tuple)
+                    else image_info[k] + 0.0
+                )
+    if "pixel type" in columns and reader.GetNumberOfComponents() == 1:
+        image_info["pixel type"] = (
+            sitk.GetPixelIDValueAsString(reader.GetPixelID()) + " gray"
+        )
+    if "meta data" in columns:
+        image_meta_data_information(reader, image_info, meta_data_info)
+
+
+def inspect_image(
+    sitk_image,
+    image_info,
+    meta_data_info,
+    thumbnail_settings,
+    geometry_layout="tuples",
+    histogram_statistics=False,
+    columns=OUTPUT_COLUMN_GROUPS,
+    intensity_hash="md5",
+):
+    """
+    Inspect a SimpleITK image, and update the image_info dictionary with the values associated with the
+    contents of the meta_data_info dictionary. The values of the image meta data dictionary keys are
+    copied into the image_info dictionary (image_info[k] = sitk_image.GetMetaData(meta_data_info[k])).
+
+    Parameters
+    ----------
+    sitk_image (SimpleITK.Image): Input image for inspection, 2D or 3D.
+    image_info (dict): Image information is added to this dictionary (e.g. image_info["image size"] = "(512,512)").
+                       The image_info dict is filled with the following values:
+                           "MD5 intensity hash" - Enable identification of duplicate images in terms of intensity.
+                                                  The column is named after the intensity_hash algorithm.
+                                                  This is different from SimpleITK image equality where the
+                                                  same intensities with different image spacing/origin/direction cosine
+                                                  are considered different images as they occupy a different spatial
+                                                  region.
+                           Image spatial information - "image size", "image spacing", "image origin", "axis direction".
+                           Image intensity information - "pixel type", if scalar or repeated scalar impersonating a
+                                                          multi-channel image:"min", "max", "mean", "std".
+                           metadata values for the values listed in the meta_data_info dictionary (e.g. "radiographic view" : "AP").
+    meta_data_info(dict(str:str)): The meta-data information whose values will be reported.
+                                   Dictionary structure is description:meta_data_tag
+                                   (e.g. {"radiographic view" : "0018|5101", "modality" : "0008|0060",
+                                          "ITK_InputFilterName" : "ITK_InputFilterName"}).
+    thumbnail_settings(dict): Dictionary containing the following keys "thumbnail_sizes", "projection_axis" and
+                              "interpolator" which are used to create a thumbnail representing this image that is
+                              stored in image_info["thumbnail"].
+    geometry_layout (str): Store the image spatial information as tuples ("tuples") or as separate numeric
+                           values ("columns"), see geometry_columns.
+    histogram_statistics (bool): Add the intensity distribution statistics computed from the intensity
+                                 histogram of scalar images, see intensity_histogram_statistics.
+    columns (list(str)): Only add the information of these column groups, see OUTPUT_COLUMN_GROUPS.
+    intensity_hash (str): The intensity hash algorithm, see INTENSITY_HASH_ALGORITHMS.
+    """
+    np_arr_view = sitk.GetArrayViewFromImage(sitk_image)
+    if "geometry" in columns:
+        image_geometry_information(sitk_image, image_info, geometry_layout)
+
+    if (
+        sitk_image.GetNumberOfComponentsPerPixel() == 1
+    ):  # grayscale image, get measures of intensity location and spread the min/max pixel values
+        if "pixel type" in columns:
+            image_info["pixel type"] = sitk_image.GetPixelIDTypeAsString() + " gray"
+        inspect_grayscale_image(
+            sitk_image, image_info, histogram_statistics, columns, intensity_hash
+        )
+    elif histogram_statistics or {"pixel type", "hash", "statistics"} & set(
+        columns
+    ):  # either a color image or a grayscale image masquerading as a color one
+        pixel_type = sitk_image.GetPixelIDTypeAsString()
+        channels = [
+            sitk.VectorIndexSelectionCast(sitk_image, i)
+            for i in range(sitk_image.GetNumberOfComponentsPerPixel())
+        ]
+        # if this multi-channel is actually a grayscale image, treat
+        # it as such, call inspect_grayscale_image on the first channel
+        # this will compute the intensity statistics and the intensity hash on
+        # the actual grayscale information
+        if np.array_equal(
+            sitk.GetArrayViewFromImage(channels[0]),
+            sitk.GetArrayViewFromImage(channels[1]),
+        ) and np.array_equal(
+            sitk.GetArrayViewFromImage(channels[0]),
+            sitk.GetArrayViewFromImage(channels[2]),
+        ):
+            pixel_type = (
+                pixel_type
+                + f" {sitk_image.GetNumberOfComponentsPerPixel()} channels gray"
+            )
+            inspect_grayscale_image(
+                channels[0], image_info, histogram_statistics, columns, intensity_hash
+            )
+        else:
+            if "hash" in columns:
+                image_info[intensity_hash_column(intensity_hash)] = (
+                    array_intensity_hash(np_arr_view, intensity_hash)
+                )
+            pixel_type = (
+                pixel_type
+                + f" {sitk_image.GetNumberOfComponentsPerPixel()} channels color"
+            )
+        if "pixel type" in columns:
+            image_info["pixel type"] = pixel_type
+    if "meta data" in columns:
+        image_meta_data_information(sitk_image, image_info, meta_data_info)
+    if thumbnail_settings:
+        image_info["thumbnail"] = image_to_thumbnail(sitk_image, **thumbnail_settings)
+
+
+SNIFFED_FORMAT_KEY = "sniffed format"
+
+# Number of bytes read from the beginning of a file to identify its format.
+SNIFF_BYTES = 512
+
+# Signatures identifying the ImageIO of a file, (offset, bytes, ImageIO), the first match is used.
+FORMAT_SIGNATURES = [
+    (128, b"DICM", "GDCMImageIO"),
+    (0, b"NRRD000", "NrrdImageIO"),
+    (0, b"\x89PNG\r\n\x1a\n", "PNGImageIO"),
+    (0, b"\xff\xd8\xff", "JPEGImageIO"),
+    (0, b"\x00\x00\x00\x0cjP  \r\n\x87\n", "JPEG2000ImageIO"),
+    (0, b"\xffO\xffQ", "JPEG2000ImageIO"),
+    (0, b"II*\x00", "TIFFImageIO"),
+    (0, b"MM\x00*", "TIFFImageIO"),
+    (0, b"II+\x00", "TIFFImageIO"),
+    (0, b"MM\x00+", "TIFFImageIO"),
+    (0, b"BM", "BMPImageIO"),
+    (0, b"# vtk DataFile", "VTKImageIO"),
+    # HDF5 is a container format used by both the HDF5ImageIO and MINCImageIO (MINC2), probe
+    (0, b"\x89HDF\r\n\x1a\n", ""),
+    (0, b"IMGF", "GE5ImageIO"),
+    (208, b"MAP ", "MRCImageIO"),
+    (252, b"\xef\xff\xe9\xb0", "GiplImageIO"),
+    (252, b"\x2a\xe3\x89\xb8", "GiplImageIO"),
+    (54, struct.pack("<H", 12345), "BioRadImageIO"),
+    (0, struct.pack("<i", 348), "NiftiImageIO"),
+    (0, struct.pack(">i", 348), "NiftiImageIO"),
+    (0, struct.pack("<i", 540), "NiftiImageIO"),
+    (0, struct.pack(">i", 540), "NiftiImageIO"),
+]
+
+# Keys which start a MetaImage header.
+METAIMAGE_HEADER_KEYS = {"ObjectType", "ObjectSubType", "NDims", "Comment", "Name"}
+
+# Extensions of formats whose files cannot be identified by their content (e.g. Analyze and
+# Stimulate image data), these are read by probing all the ImageIOs.
+UNSNIFFABLE_EXTENSIONS = {".img", ".sdt", ".spr"}
+
+
+def sniff_image_io(file_name):
+    """
+    Identify the ImageIO which reads a file from the first SNIFF_BYTES bytes of the file (magic
+    numbers, DICOM preamble, NRRD and MetaImage headers, NIfTI/Analyze header sizes, gzip
+    compressed NIfTI). DICOM files without a preamble are identified by their first element
+    being in the file meta information or identifying groups. HDF5 files may be HDF5ImageIO or
+    MINC2 images, they are read by probing all the ImageIOs. This is much faster than letting
+    ITK probe every registered ImageIO, particularly for the non image files found in most
+    directory structures. Formats without a magic number, other than those listed in
+    UNSNIFFABLE_EXTENSIONS and Bruker 2dseq files, are not identified (e.g. GE4).
+
+    Parameters
+    ----------
+    file_name (str): Path of a local file.
+
+    Returns
+    -------
+    str or None: The ImageIO name, the empty string if the file may be an image whose format
+                 cannot be identified by its content (probe all the ImageIOs), or None if the file
+                 is not an image in a supported format.
+    """
+    with open(file_name, "rb") as fp:
+        header = fp.read(SNIFF_BYTES)
+    if header.startswith(b"\x1f\x8b"):
+        # gzip compressed, NIfTI is identified from the decompressed beginning of the file
+        try:
+            header = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(header)
+        except zlib.error:
+            return None
+        if header[:4] in [struct.pack(f"{e}i", n) for e in "<>" for n in (348, 540)]:
+            return "NiftiImageIO"
+        return ""
+    for offset, signature, image_io in FORMAT_SIGNATURES:
+        if header[offset : offset + len(signature)] == signature:
+            return image_io
+    first_line = header.split(b"\n", 1)[0].decode("latin-1")
+    if first_line.partition("=")[0].strip() in METAIMAGE_HEADER_KEYS:
+        return "MetaImageIO"
+    # DICOM without preamble, element of group 0002, 0008 (little endian) or 0800 (big endian)
+    if len(header) >= 8 and header[:2] in [b"\x02\x00", b"\x08\x00", b"\x00\x08"]:
+        return "GDCMImageIO"
+    if (
+        os.path.splitext(file_name)[1].lower() in UNSNIFFABLE_EXTENSIONS
+        or os.path.basename(file_name) == "2dseq"
+    ):
+        return ""
+    return None
+
+
+def inspect_single_file(
+    file_name,
+    imageIO="",
+    meta_data_info={},
+    external_programs_info={},
+    thumbnail_settings={},
+    geometry_layout="tuples",
+    histogram_statistics=False,
+    columns=OUTPUT_COLUMN_GROUPS,
+    sniff_formats=False,
+    intensity_hash="md5",
+):
+    """
+    Inspect a file using the specified imageIO, returning a dictionary with the relevant information.
+
+    Parameters
+    ----------
+    file_name (str): Image file name.
+    imageIO (str): Name of image IO to use. To see the list of registered image IOs use the
+                   ImageFileReader::GetRegisteredImageIOs() or print an ImageFileReader.
+                   The empty string indicates to read all file formats supported by SimpleITK.
+    meta_data_info(dict(str:str)): The meta-data information whose values will be reported.
+                                   Dictionary structure is description:meta_data_tag
+                                   (e.g. {"radiographic view" : "0018|5101", "modality" : "0008|0060"}).
+    external_programs_info(dict(str:str)): A dictionary of programs that are run with the file_name as input
+                                  the return value 'succeeded' or 'failed' is recorded. This
+                                  is useful for example if you need to validate conformance
+                                  to a standard such as DICOM. Dictionary format is description:program (e.g.
+                                  {"DICOM compliant" : "path_to_dicom3tools/dciodvfy"}).
+    thumbnail_settings(dict): A dictionary containing the settings required for creating a 2D thumbnail.
+                              from an image. These include thumbnail_sizes (x,y size of thumbnail),
+                              projection axis (maximal intensity project 3D images along this axis and
+                              then create the 2D thumbnail from the projection), interpolator (SimpleITK
+                              interpolator used to resize the 2D image to the thumbnail size).
+    geometry_layout (str): Report the image spatial information as tuples ("tuples") or as separate numeric
+                           values ("columns"), see geometry_columns.
+    histogram_statistics (bool): Report intensity distribution statistics computed from the intensity
+                                 histogram, see intensity_histogram_statistics.
+    columns (list(str)): Only report the information of these column groups, see OUTPUT_COLUMN_GROUPS.
+                         If the pixel data is not required only the image header is read, see
+                         requires_pixel_data, and only the beginning of remote files is transferred.
+    sniff_formats (bool): If the imageIO is not specified, identify it from the beginning of the file
+                          and do not read files which are not images, see sniff_image_io. The result
+                          is reported in the SNIFFED_FORMAT_KEY entry ("probe" for all ImageIOs,
+                          "rejected" for files that were not read).
+    intensity_hash (str): The intensity hash algorithm, see INTENSITY_HASH_ALGORITHMS.
+
+    Returns
+    -------
+     dict with the following entries: files, intensity hash,
+                                       image size, image spacing, image origin, axis direction,
+                                       pixel type, min intensity, max intensity, mean intensity,
+                                       std intensity,
+                                       meta data_1...meta_data_n,
+                                       external_program_res_1...external_program_res_m
+    If the given file is not readable by SimpleITK, the only entry in the dictionary
+    will be the "files" entry.
+    """
+    # Using a list so that returned csv is consistent with the series based analysis (an
+    # image is defined by multiple files).
+    file_info = {}
+    file_info["files"] = [file_name]
+    # for remote files, when the pixel data is not required, first try reading the information
+    # using only the beginning of the file (see cached_object). The whole file is read if the
+    # header is larger, or if the pixel data is required after all (multi-channel images).
+    header_only_reads = (
+        [True, False]
+        if is_url(file_name)
+        and not external_programs_info
+        and not requires_pixel_data(columns, thumbnail_settings, histogram_statistics)
+        else [False]
+    )
+    try:
+        for header_only in header_only_reads:
+            with local_file(file_name, header_only=header_only) as local_file_name:
+                if sniff_formats and not imageIO:
+                    imageIO = sniff_image_io(local_file_name)
+                    file_info[SNIFFED_FORMAT_KEY] = {
+                        None: "rejected",
+                        "": "probe",
+                    }.get(imageIO, imageIO)
+                    if imageIO is None:
+                        return file_info
+                reader = worker_image_file_reader()
+                reader.SetImageIO(imageIO)
+                reader.SetFileName(local_file_name)
+                read_pixel_data = requires_pixel_data(
+                    columns, thumbnail_settings, histogram_statistics
+                )
+                if not read_pixel_data:
+                    try:
+                        reader.ReadImageInformation()
+                    except RuntimeError:
+                        if header_only:
+                            continue
+                        raise
+                    # the pixel type of multi-channel images depends on the pixel data (gray or
+                    # color)
+                    read_pixel_data = (
+                        reader.GetNumberOfComponents() > 1 and "pixel type" in columns
+                    )
+                    if not read_pixel_data:
+                        inspect_image_information(
+                            reader, file_info, meta_data_info, geometry_layout, columns
+                        )
+                if read_pixel_data:
+                    if header_only:
+                        continue
+                    img = reader.Execute()
+                    inspect_image(
+                        img,
+                        file_info,
+                        meta_data_info,
+                        thumbnail_settings,
+                        geometry_layout,
+                        histogram_statistics,
+                        columns,
+                        intensity_hash,
+                    )
+                for k, p in external_programs_info.items():
+                    try:
+                        # run the external programs, check the return value, and capture all output
+                        # so it doesn't appear on screen. The CalledProcessError exception is raised
+                        # if the external program fails (returns non zero value).
+                        subprocess.run(
+                            [p, local_file_name], check=True, capture_output=True
+                        )
+                        file_info[k] = "succeeded"
+                    except Exception:
+                        file_info[k] = "failed"
+            break
+    except Exception:
+        pass
+    return file_info
+
+
+def inspect_files(
+    root_dir,
+    max_processes,
+    disable_tqdm,
+    imageIO="",
+    meta_data_info={},
+    external_programs_info={},
+    thumbnail_settings={},
+    file_names=None,
+    inspect_archives=False,
+    geometry_layout="tuples",
+    histogram_statistics=False,
+    shared_thumbnails=False,
+    metrics_file=None,
+    columns=OUTPUT_COLUMN_GROUPS,
+    backend="process",
+    sniff_formats=False,
+    read_ahead_files=0,
+    read_ahead_bytes=256 << 20,
+    intensity_hash="md5",
+):
+    """
+    Iterate over a directory structure and return a pandas dataframe with the relevant information for the
+    image files. This also includes non image files. The resulting dataframe will only include the file name
+    if that file wasn't successfully read by SimpleITK. The two reasons for failure are: (1) the user specified
+    imageIO isn't compatible with the file format (e.g. user is only interested in reading jpg and the file
+    format is mha) or (2) the file could not be read by the SimpleITK IO (corrupt file or unexpected limitation of
+    SimpleITK).
+
+    Parameters
+    ----------
+    root_dir (str): Path to the root of the data directory. Traverse the directory structure
+                    and inspect every file (also report non image files, in which
+                    case the only valid entry will be the file name).
+    max_processes (int): Maximal number of processes to use in when performing parallel processing.
+                         Only relevant for non-windows systems.
+    disable_tqdm (bool): Display a progress bar, or not.
+    imageIO (str): Name of image IO to use. To see the list of registered image IOs use the
+                   ImageFileReader::GetRegisteredImageIOs() or print an ImageFileReader.
+                   The empty string indicates to read all file formats supported by SimpleITK.
+    meta_data_info(dict(str:str)): The meta-data information whose values will be reported.
+                                   Dictionary structure is description:meta_data_tag
+                                   (e.g. {"radiographic view" : "0018|5101", "modality" : "0008|0060"}).
+    external_programs_info(dict(str:str)): A dictionary of programs that are run with the file_name as input
+                                  the return value 'succeeded' or 'failed' is recorded. This
+                                  is useful for example if you need to validate conformance
+                                  to a standard such as DICOM. Dictionary format is description:program (e.g.
+                                  {"DICOM compliant" : "path_to_dicom3tools/dciodvfy"}).
+    thumbnail_settings(dict): A dictionary containing the settings required for creating a 2D thumbnail.
+                              from an image. These include thumbnail_sizes (x,y size of thumbnail),
+                              projection axis (maximal intensity project 3D images along this axis and
+                              then create the 2D thumbnail from the projection), interpolator (SimpleITK
+                              interpolator used to resize the 2D image to the thumbnail size).
+    file_names (list(str)): If given, only these files are inspected instead of all the files found
+                            under root_dir (e.g. a sample of the files).
+    inspect_archives (bool): Inspect the members of zip and tar archives, the rows for the members
+                             list archive-qualified paths (e.g. /data/study.zip!/series1/image1.dcm).
+    geometry_layout (str): Report the image spatial information as tuples ("tuples") or as separate numeric
+                           values ("columns"), see geometry_columns.
+    histogram_statistics (bool): Report intensity distribution statistics computed from the intensity
+                                 histogram, see intensity_histogram_statistics.
+    shared_thumbnails (bool): Return the thumbnails from the worker processes via shared memory instead
+                              of pickling them, see SharedThumbnailSlots.
+    metrics_file (str): If given, the throughput metrics are periodically written to this file, see
+                        ProgressMetrics.
+    columns (list(str)): Only report the information of these column groups, see OUTPUT_COLUMN_GROUPS.
+    backend (str): Run the inspection tasks in worker processes, threads or serially, see task_executor.
+    sniff_formats (bool): Identify the ImageIO of each file from its content, see sniff_image_io. The
+                          number of files per identified format, and how many of them were read, is
+                          printed at the end.
+    read_ahead_files (int): Number of upcoming files per worker read ahead into the page cache, 0
+                            disables read-ahead, see ReadAheadPrefetcher.
+    read_ahead_bytes (int): Maximal number of bytes read ahead.
+    intensity_hash (str): The intensity hash algorithm, see INTENSITY_HASH_ALGORITHMS.
+    Returns
+    -------
+    pandas DataFrame: Each row in the data frame corresponds to a single file.
+    """
+    import pandas as pd
+
+    all_file_names = (
+        get_all_file_names(root_dir, inspect_archives)
+        if file_names is None
+        else (expand_archives(file_names) if inspect_archives else list(file_names))
+    )
+
+    # Get list of dictionaries describing the results and then combine into a dataframe, faster
+    # than appending to the dataframe one by one. Use parallel processing to speed things up.
+    res = []
+    metrics = progress_metrics(metrics_file, "file inspection", len(all_file_names))
+    with shared_thumbnail_slots(
+        shared_thumbnails, thumbnail_settings, max_processes, backend
+    ) as thumbnail_slots, task_executor(
+        backend, max_processes
+    ) as executor, read_ahead_prefetcher(
+        all_file_names, max_processes, read_ahead_files, read_ahead_bytes
+    ) as prefetcher:
+        futures = completed_futures(
+            executor,
+            partial(
+                inspect_single_file,
+                imageIO=imageIO,
+                meta_data_info=meta_data_info,
+                external_programs_info=external_programs_info,
+                thumbnail_settings=thumbnail_settings,
+                geometry_layout=geometry_layout,
+                histogram_statistics=histogram_statistics,
+                columns=columns,
+                sniff_formats=sniff_formats,
+                intensity_hash=intensity_hash,
+            ),
+            all_file_names,
+            thumbnail_slots,
+            metrics,
+            prefetcher,
+        )
+        # tqdm configuration, the progress bar is updated at most once per second (mininterval), checking the
+        # time on every iteration (miniters), so it is updated regularly no matter how many items there are.
+        # Additionally, the whole progress bar is disabled if disable_tqdm is True, for example when scheduling a
+        # job on a cluster in which case there is no person looking at the progress, see the metrics_file for
+        # monitoring such runs.
+        tqdm_total = len(all_file_names)
+        for file_name, future in tqdm(
+            futures,
+            total=tqdm_total,
+            mininterval=1,
+            miniters=1,
+            disable=disable_tqdm,
+            file=sys.stdout,
+        ):
+            try:
+                result = future.result()
+                res.append(result)
+            except Exception as e:
+                print(f"Failed process for {file_name}", file=sys.stderr)
+        if prefetcher is not None:
+            print(prefetcher.summary())
+    if metrics is not None:
+        metrics.write()
+    df = pd.DataFrame.from_dict(res).drop(columns=WORKER_TIME_KEY, errors="ignore")
+    if SNIFFED_FORMAT_KEY in df.columns:
+        sniffed_formats = df.pop(SNIFFED_FORMAT_KEY)
+        read = df.drop(columns="files").notna().any(axis=1)
+        print("Sniffed formats (files, read):")
+        for image_io, count in sniffed_formats.value_counts().sort_index().items():
+            print(f"  {image_io}: {count}, {read[sniffed_formats == image_io].sum()}")
+    return typed_geometry_columns(df)
+
+
+def inspect_series_slices(
+    file_names,
+    series_info,
+    meta_data_info={},
+    thumbnail_settings={},
+    geometry_layout="tuples",
+    histogram_statistics=False,
+    columns=OUTPUT_COLUMN_GROUPS,
+    intensity_hash="md5",
+):
+    """
+    Inspect a series one slice at a time, adding the same information that inspect_image adds for
+    the volume read by the ImageSeriesReader to the series_info dictionary, without reading the
+    volume. Memory is bounded by a few slices: the intensity hash, the intensity statistics and the
+    intensity histogram are updated with every slice and the maximum intensity projection used for
+    the thumbnail is a running maximum. The histogram of float images and of integer images whose
+    intensity range is larger than MAX_EXACT_HISTOGRAM_BINS requires the finite intensity range,
+    the slices are then read a second time. The mean and standard deviation are accumulated in
+    double precision, the last digits may differ from those computed on the volume. The minimum and
+    maximum of float images with NaN values may also differ, those computed on the volume depend on
+    the order in which the pixels are visited, here the NaN values of the slices are ignored.
+
+    The geometry is the one computed by the ImageSeriesReader, the origin and direction are those of
+    the first slice, and the slice spacing is the distance between the origins of the first and last
+    slices divided by the number of slices minus one. Unlike the ImageSeriesReader, non-uniformly
+    spaced slices are not reported in the "ITK_non_uniform_sampling_deviation" meta-data entry.
+
+    Only series of two or more single frame scalar slices are streamed, otherwise the series is not
+    inspected and should be read as a volume.
+
+    Parameters
+    ----------
+    file_names (list(str)): The sorted file names of the series slices.
+    series_info (dict): Series information is added to this dictionary.
+    meta_data_info(dict(str:str)): The meta-data information whose values will be reported, the
+                                   values are taken from the first slice, see inspect_image.
+    thumbnail_settings(dict): The thumbnail settings, empty if no thumbnail is created, see
+                              inspect_image.
+    geometry_layout (str): Report the image spatial information as tuples ("tuples") or as separate numeric
+                           values ("columns"), see geometry_columns.
+    histogram_statistics (bool): Report intensity distribution statistics computed from the intensity
+                                 histogram, see intensity_histogram_statistics.
+    columns (list(str)): Only report the information of these column groups, see OUTPUT_COLUMN_GROUPS.
+    intensity_hash (str): The intensity hash algorithm, see INTENSITY_HASH_ALGORITHMS.
+
+    Returns
+    -------
+    bool: True if the series was inspected, False if it cannot be streamed, series_info is not
+          modified.
+    """
+    reader = worker_image_slice_reader()
+    reader.SetOutputPixelType(sitk.sitkUnknown)
+    reader.SetFileName(file_names[0])
+    reader.ReadImageInformation()
+    slice_size = reader.GetSize()
+    if (
+        len(file_names) < 2
+        or reader.GetNumberOfComponents() != 1
+        or len(slice_size) != 3
+        or slice_size[2] != 1
+    ):
+        return False
+    pixel_id = reader.GetPixelID()
+    spacing = reader.GetSpacing()
+    origin = reader.GetOrigin()
+    direction = reader.GetDirection()
+    info = {}
+    meta_data = {}
+    if "meta data" in columns:
+        image_meta_data_information(reader, meta_data, meta_data_info)
+    reader.SetFileName(file_names[-1])
+    reader.ReadImageInformation()
+    slice_distance = math.sqrt(
+        sum((last - first) ** 2 for first, last in zip(origin, reader.GetOrigin()))
+    )
+    if slice_distance > 0:
+        spacing = spacing[:2] + (slice_distance / (len(file_names) - 1),)
+    if "geometry" in columns:
+        geometry_information(
+            info,
+            slice_size[:2] + (len(file_names),),
+            spacing,
+            origin,
+            direction,
+            geometry_layout,
+        )
+    if "pixel type" in columns:
+        info["pixel type"] = sitk.GetPixelIDValueAsString(pixel_id) + " gray"
+    if not requires_pixel_data(columns, thumbnail_settings, histogram_statistics):
+        series_info.update(info | meta_data)
+        return True
+
+    def read_slices():
+        reader.SetOutputPixelType(pixel_id)
+        try:
+            for file_name in file_names:
+                reader.SetFileName(file_name)
+                sitk_slice = reader.Execute()
+                if sitk_slice.GetSize() != slice_size:
+                    raise ValueError(
+                        f"slice size differs from the first slice, {file_name}"
+                    )
+                yield sitk_slice
+        finally:
+            reader.SetOutputPixelType(sitk.sitkUnknown)
+
+    hasher = intensity_hasher(intensity_hash)
+    mmfilter = sitk.MinimumMaximumImageFilter()
+    min_value, max_value = np.nan, np.nan
+    number_of_pixels, mean, m2 = 0, 0.0, 0.0
+    # exact histogram, counts[i] is the number of pixels with intensity histogram_offset + i
+    exact_histogram, counts, histogram_offset = True, np.zeros(0, dtype=np.int64), None
+    finite_min, finite_max = None, None
+    zero_count, saturated_count = 0, 0
+    projection_axis = thumbnail_settings.get("projection_axis")
+    mip, mip_rows = None, []
+    for sitk_slice in read_slices():
+        arr = sitk.GetArrayViewFromImage(sitk_slice)[0]
+        is_integer = np.issubdtype(arr.dtype, np.integer)
+        if "hash" in columns:
+            hasher.update(arr)
+        if "statistics" in columns:
+            mmfilter.Execute(sitk_slice)
+            # NaN slice values are ignored
+            min_value = float(np.fmin(min_value, mmfilter.GetMinimum()))
+            max_value = float(np.fmax(max_value, mmfilter.GetMaximum()))
+            # merge the slice mean and sum of squared differences from the mean with
+            # the running values (Chan et al. parallel variance algorithm)
+            slice_mean = arr.mean(dtype=np.float64)
+            delta = slice_mean - mean
+            total = number_of_pixels + arr.size
+            mean += delta * arr.size / total
+            m2 += (
+                arr.var(dtype=np.float64) * arr.size
+                + delta**2 * number_of_pixels * arr.size / total
+            )
+            number_of_pixels = total
+        if histogram_statistics:
+            finite_arr = arr if is_integer else arr[np.isfinite(arr)]
+            if finite_arr.size > 0:
+                slice_min, slice_max = finite_arr.min(), finite_arr.max()
+                finite_min = (
+                    slice_min if finite_min is None else min(finite_min, slice_min)
+                )
+                finite_max = (
+                    slice_max if finite_max is None else max(finite_max, slice_max)
+                )
+            if is_integer and exact_histogram:
+                offset = int(finite_min)
+                length = int(finite_max) - offset + 1
+                if length > MAX_EXACT_HISTOGRAM_BINS:
+                    exact_histogram = False
+                else:
+                    # extend the histogram to the current intensity range
+                    before = (
+                        0 if histogram_offset is None else histogram_offset - offset
+                    )
+                    counts = np.pad(counts, (before, length - len(counts) - before))
+                    counts += np.bincount(
+                        arr.ravel().astype(np.int64) - offset, minlength=length
+                    )
+                    histogram_offset = offset
+            zero_count += np.count_nonzero(arr == 0)
+            if is_integer:
+                saturated_count += np.count_nonzero(arr == np.iinfo(arr.dtype).max)
+        if thumbnail_settings:
+            # the MaximumProjection filter starts from the lowest value of the pixel type
+            # and ignores NaN values
+            lowest = np.iinfo(arr.dtype).min if is_integer else np.finfo(arr.dtype).min
+            if projection_axis == 2:
+                mip = (
+                    np.fmax(arr, lowest) if mip is None else np.fmax(mip, arr, out=mip)
+                )
+            else:
+                mip_rows.append(
+                    np.fmax.reduce(arr, axis=1 - projection_axis, initial=lowest)
+                )
+    if "hash" in columns:
+        info[intensity_hash_column(intensity_hash)] = hasher.hexdigest()
+    if "statistics" in columns:
+        # numpy reports the mean and std of float images using their pixel type
+        statistics_type = arr.dtype.type if not is_integer else np.float64
+        info["min intensity"] = min_value
+        info["max intensity"] = max_value
+        info["mean intensity"] = statistics_type(mean)
+        info["std intensity"] = statistics_type(math.sqrt(m2 / number_of_pixels))
+    if histogram_statistics:
+        number_of_pixels = arr.size * len(file_names)
+        if is_integer and exact_histogram:
+            bin_starts = np.arange(
+                histogram_offset, histogram_offset + len(counts), dtype=np.float64
+            )
+            bin_widths = np.zeros(len(counts))
+        elif finite_min is not None:
+            # second pass, the histogram bins span the finite intensity range
+            counts = np.zeros(APPROXIMATE_HISTOGRAM_BINS, dtype=np.int64)
+            for sitk_slice in read_slices():
+                arr = sitk.GetArrayViewFromImage(sitk_slice)[0]
+                slice_counts, edges = np.histogram(
+                    arr if is_integer else arr[np.isfinite(arr)],
+                    bins=APPROXIMATE_HISTOGRAM_BINS,
+                    range=(finite_min, finite_max),
+                )
+                counts += slice_counts
+            bin_starts = edges[:-1]
+            bin_widths = np.diff(edges)
+        if finite_min is None:
+            info.update(dict.fromkeys(HISTOGRAM_STATISTICS_COLUMNS, np.nan))
+        else:
+            info.update(
+                histogram_counts_statistics(
+                    counts,
+                    bin_starts,
+                    bin_widths,
+                    zero_count / number_of_pixels,
+                    saturated_count / number_of_pixels if is_integer else np.nan,
+                )
+            )
+    info.update(meta_data)
+    if thumbnail_settings:
+        # the 2D projection has the spacing and origin of the remaining axes, as
+        # extracted from the volume's projection by image_to_thumbnail
+        projection = sitk.GetImageFromArray(
+            mip if projection_axis == 2 else np.stack(mip_rows)
+        )
+        axes = [i for i in range(3) if i != projection_axis]
+        projection.SetSpacing([spacing[i] for i in axes])
+        projection.SetOrigin([origin[i] for i in axes])
+        info["thumbnail"] = image_to_thumbnail(projection, **thumbnail_settings)
+    series_info.update(info)
+    return True
+
+
+def inspect_single_series(
+    series_data,
+    meta_data_info={},
+    thumbnail_settings={},
+    geometry_layout="tuples",
+    histogram_statistics=False,
+    columns=OUTPUT_COLUMN_GROUPS,
+    stream=False,
+    intensity_hash="md5",
+):
+    """
+    Inspect a single DICOM series (DICOM hierarchy of patient-study-series-image).
+    This can be a single file, or multiple files such as a CT or MR volume.
+
+    Parameters
+    ----------
+    series_data (two entry tuple): First entry is series:study...(DICOM tag values uniquely identifying series),
+                                   second entry is the list of files comprising this series.
+    meta_data_info(dict(str:str)): The meta-data information whose values will be reported.
+                                   Dictionary structure is description:meta_data_tag
+                                   (e.g. {"radiographic view" : "0018|5101", "modality" : "0008|0060"}).
+    geometry_layout (str): Report the image spatial information as tuples ("tuples") or as separate numeric
+                           values ("columns"), see geometry_columns.
+    histogram_statistics (bool): Report intensity distribution statistics computed from the intensity
+                                 histogram, see intensity_histogram_statistics.
+    columns (list(str)): Only report the information of these column groups, see OUTPUT_COLUMN_GROUPS.
+                         The series is always read, as its geometry depends on all of its files.
+    stream (bool): Inspect the series one slice at a time instead of reading the volume, bounding the
+                   memory used by large series, see inspect_series_slices. Series that cannot be
+                   streamed are read as a volume.
+    intensity_hash (str): The intensity hash algorithm, see INTENSITY_HASH_ALGORITHMS.
+    Returns
+    -------
+     dictionary containing all of the information about the series.
+    """
+    series_info = {}
+    series_info["files"] = series_data[1]
+    try:
+        reader = worker_image_series_reader()
+        # split list of tag values, sid is first entry (see inspect_series)
+        sid = series_data[0].split(":")[0]
+        file_names = series_info["files"]
+        # As the files comprising a series can reside in separate directories
+        # and may have identical file names (e.g. 1/Z0.dcm, 2/Z0.dcm)
+        # we use a tempdir and symbolic links to enable SimpleITK to read the series as
+        # a single image (ImageSeriesReader_GetGDCMSeriesFileNames expects all files to
+        # be in a single directory).
+        # On Windows we need to copy the files to the tempdir as the os.symlink documentation says that
+        # "On newer versions of Windows 10, unprivileged accounts can create symlinks
+        # if Developer Mode is enabled. When Developer Mode is not available/enabled,
+        # the SeCreateSymbolicLinkPrivilege privilege is required, or the process must be
+        # run as an administrator."
+        # To turn Developer Mode on in Windows 11:
+        # Settings->System->For Developers and turn Developer Mode on.
+        # We could then use the os.symlink function instead of the indirect usage of a
+        # copy_link_function below.
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            copy_link_function = (
+                shutil.copy if platform.system() == "Windows" else os.symlink
+            )
+            new_orig_file_name_dict = {}
+            for i, fname in enumerate(file_names):
+                new_fname = os.path.join(tmpdirname, str(i))
+                new_orig_file_name_dict[new_fname] = fname
+                # archive members are extracted, they cannot be linked, and remote files
+                # are linked from the local cache
+                if split_archive_member_path(fname)[1] is not None:
+                    extract_archive_member(fname, new_fname)
+                elif is_url(fname):
+                    copy_link_function(cached_object(fname), new_fname)
+                else:
+                    copy_link_function(fname, new_fname)
+            # On windows the returned full paths use backslash
+            # for all directories except the last one which has a slash. This does not
+            # match the contents of the new_orig_file_name_dict which has a backslash
+            # for the last entry too, as expected on windows. This is an issue with GDCM
+            # and we reported it on its bug tracker. In the code below we call os.path.normpath to
+            # resolve this issue.
+            sorted_new_file_names = sitk.ImageSeriesReader_GetGDCMSeriesFileNames(
+                tmpdirname, sid
+            )
+            # store the file names in a sorted order so that they are saved in this
+            # manner. This is useful for reading from the saved csv file
+            # using the SeriesImageReader or ImageRead which expect ordered file names.
+            # If none of the files were read as part of the series (files listed in
+            # a DICOMDIR that GDCM cannot read) the original list is retained.
+            if sorted_new_file_names:
+                series_info["files"] = [
+                    new_orig_file_name_dict[os.path.normpath(new_fname)]
+                    for new_fname in sorted_new_file_names
+                ]
+            if (
+                stream
+                and sorted_new_file_names
+                and inspect_series_slices(
+                    sorted_new_file_names,
+                    series_info,
+                    meta_data_info,
+                    thumbnail_settings,
+                    geometry_layout,
+                    histogram_statistics,
+                    columns,
+                    intensity_hash,
+                )
+            ):
+                return series_info
+            reader.SetFileNames(sorted_new_file_names)
+            img = reader.Execute()
+            if "meta data" in columns:
+                for k in meta_data_info.values():
+                    if reader.HasMetaDataKey(0, k):
+                        img.SetMetaData(k, reader.GetMetaData(0, k))
+            inspect_image(
+                img,
+                series_info,
+                meta_data_info,
+                thumbnail_settings,
+                geometry_layout,
+                histogram_statistics,
+                columns,
+                intensity_hash,
+            )
+    except Exception:
+        pass
+    return series_info
+
+
+def get_series_key_fname(file_name, additional_series_tags):
+    """
+    If a DICOM file, create a unique string identifier representing its series. This is
+    a combination of the series UID, study UID and the values of the additional series
+    tags. For non DICOM files or files that GDCM cannot read this function will raise
+    an exception.
+
+    Parameters
+    ----------
+    file_name (Union[str,Path]): Name of file.
+    additional_series_tags (list(str)): List of DICOM tags that together with
+    series and study UID serve to uniquely identify files belonging to the same
+    series.
+
+    Returns
+    -------
+    A tuple (key, file_name) where key is a unique identifier string
+    comprised of series UID:study UID:values from additional series tags. This
+    will succeed if the given file_name is a DICOM file that GDCM can read,
+    if not an exception is raised by the ImageFileReader.
+    """
+    reader = worker_image_file_reader()
+    # explicitly set ImageIO to GDCMImageIO so that non DICOM files that
     # contain DICOM tags (file converted from original DICOM) will be
     # ignored.
     reader.SetImageIO("GDCMImageIO")
-    reader.SetFileName(file_name)
-    reader.ReadImageInformation()
+    # for remote files, first try reading the information using only the beginning of the
+    # file, if the DICOM header is larger, read the whole file.
+    try:
+        with local_file(file_name, header_only=True) as local_file_name:
+            reader.SetFileName(local_file_name)
+            reader.ReadImageInformation()
+    except RuntimeError:
+        if not is_url(file_name):
+            raise
+        with local_file(file_name) as local_file_name:
+            reader.SetFileName(local_file_name)
+            reader.ReadImageInformation()
     sid = reader.GetMetaData("0020|000e")
     study = reader.GetMetaData("0020|000d")
     key = f"{sid}:{study}"
@@ -492,6 +2692,269 @@ def get_series_key_fname(file_name, additional_series_tags):
     return (key, file_name)
 
 
+DICOM_UNDEFINED_LENGTH = 0xFFFFFFFF
+# explicit VR little endian value representations with a 4 byte value length
+DICOM_LONG_VRS = {
+    b"OB",
+    b"OD",
+    b"OF",
+    b"OL",
+    b"OV",
+    b"OW",
+    b"SQ",
+    b"SV",
+    b"UC",
+    b"UN",
+    b"UR",
+    b"UT",
+    b"UV",
+}
+# binary value representations, converted to strings the same way GDCM does
+DICOM_BINARY_VRS = {
+    b"US": "H",
+    b"SS": "h",
+    b"UL": "I",
+    b"SL": "i",
+    b"FL": "f",
+    b"FD": "d",
+}
+
+
+def read_dicom_elements(data, pos, end):
+    """
+    Read explicit VR little endian DICOM data elements from a buffer. Reading stops at
+    the end position or at an item delimitation item.
+
+    Parameters
+    ----------
+    data (bytes): Buffer containing the encoded data elements.
+    pos (int): Position of the first data element in the buffer.
+    end (int): Position following the last data element in the buffer.
+
+    Returns
+    -------
+    A tuple (elements, pos) where elements is a dictionary (group, element):(vr, value), with
+    the value being bytes, or a list of (item offset, elements) tuples for sequences, and pos is
+    the position following the data elements (and item delimitation item).
+    """
+    elements = {}
+    while pos < end:
+        group, element = struct.unpack_from("<HH", data, pos)
+        if (group, element) == (0xFFFE, 0xE00D):
+            return elements, pos + 8
+        vr = data[pos + 4 : pos + 6]
+        if vr in DICOM_LONG_VRS:
+            (length,) = struct.unpack_from("<I", data, pos + 8)
+            pos += 12
+        else:
+            (length,) = struct.unpack_from("<H", data, pos + 6)
+            pos += 8
+        if vr == b"SQ":
+            value, pos = read_dicom_sequence_items(data, pos, length)
+        elif length == DICOM_UNDEFINED_LENGTH:
+            raise ValueError(
+                f"Undefined length ({group:04x},{element:04x}) {vr} element not supported"
+            )
+        else:
+            value = data[pos : pos + length]
+            pos += length
+        elements[(group, element)] = (vr, value)
+    return elements, pos
+
+
+def read_dicom_sequence_items(data, pos, length):
+    """
+    Read the items of an explicit VR little endian DICOM sequence from a buffer.
+
+    Parameters
+    ----------
+    data (bytes): Buffer containing the encoded sequence.
+    pos (int): Position of the first item in the buffer.
+    length (int): Length of the sequence value, possibly undefined (0xFFFFFFFF).
+
+    Returns
+    -------
+    A tuple (items, pos) where items is a list of (item offset, elements) tuples, see
+    read_dicom_elements, and pos is the position following the sequence.
+    """
+    items = []
+    end = len(data) if length == DICOM_UNDEFINED_LENGTH else pos + length
+    while pos < end:
+        group, element, item_length = struct.unpack_from("<HHI", data, pos)
+        if (group, element) == (0xFFFE, 0xE0DD):
+            return items, pos + 8
+        if (group, element) != (0xFFFE, 0xE000):
+            raise ValueError(f"Expected sequence item at offset {pos}")
+        item_offset = pos
+        pos += 8
+        if item_length == DICOM_UNDEFINED_LENGTH:
+            item, pos = read_dicom_elements(data, pos, len(data))
+        else:
+            item, _ = read_dicom_elements(data, pos, pos + item_length)
+            pos += item_length
+        items.append((item_offset, item))
+    return items, pos
+
+
+def dicom_element_to_string(vr, value):
+    """
+    Convert the value of a DICOM data element to the string SimpleITK/GDCM report
+    for it. Trailing space padding is retained, binary values are converted to backslash
+    separated decimal strings and trailing null padding is removed from UIDs.
+
+    Parameters
+    ----------
+    vr (bytes): The value representation of the data element.
+    value (bytes): The value of the data element.
+
+    Returns
+    -------
+    str: The value as a string.
+    """
+    if vr in DICOM_BINARY_VRS:
+        fmt = DICOM_BINARY_VRS[vr]
+        return "\\".join(
+            str(v)
+            for v in struct.unpack(
+                f"<{len(value) // struct.calcsize(fmt)}{fmt}",
+                value[: len(value) - len(value) % struct.calcsize(fmt)],
+            )
+        )
+    value = value.decode("latin-1")
+    return value.rstrip("\0 ") if vr == b"UI" else value
+
+
+def read_dicomdir(file_name):
+    """
+    Read the directory records from a DICOMDIR file (DICOM media storage directory). The
+    records are returned in hierarchical order, following the record offsets, with each
+    record combined with the information from its ancestor records
+    (patient-study-series-image). Only the explicit VR little endian transfer syntax, which
+    the DICOM standard requires for DICOMDIR files, is supported.
+
+    Parameters
+    ----------
+    file_name (str): Name of the DICOMDIR file.
+
+    Returns
+    -------
+    list(dict): Each entry corresponds to a single directory record. Dictionary structure is
+                tag:value (e.g. {"0004|1430":"IMAGE", "0020|000e":"1.2.3"}), with tags and
+                values formatted as in SimpleITK. Values of the record take precedence over
+                values of its ancestors.
+
+    Raises
+    ------
+    ValueError: If the file is not a valid DICOMDIR.
+    """
+    with local_file(file_name) as local_file_name:
+        with open(local_file_name, "rb") as fp:
+            data = fp.read()
+    if data[128:132] != b"DICM":
+        raise ValueError(f"{file_name} is not a DICOM file")
+    try:
+        # the file meta information group length is the first data element
+        meta_elements, pos = read_dicom_elements(data, 132, 144)
+        (meta_group_length,) = struct.unpack("<I", meta_elements[(0x0002, 0x0000)][1])
+        meta_elements, pos = read_dicom_elements(data, pos, pos + meta_group_length)
+        transfer_syntax = dicom_element_to_string(*meta_elements[(0x0002, 0x0010)])
+        if transfer_syntax != "1.2.840.10008.1.2.1":
+            raise ValueError(
+                f"{file_name} unsupported transfer syntax {transfer_syntax}"
+            )
+        elements, _ = read_dicom_elements(data, pos, len(data))
+        (offset,) = struct.unpack("<I", elements[(0x0004, 0x1200)][1])
+        records = dict(elements[(0x0004, 0x1220)][1])
+    except (KeyError, struct.error) as e:
+        raise ValueError(f"{file_name} is not a valid DICOMDIR ({e})") from e
+    # traverse the record hierarchy, depth first, using the next record
+    # (0004|1400) and lower level record (0004|1420) offsets
+    res = []
+    visited = set()
+    stack = [(offset, {})]
+    while stack:
+        offset, ancestor_info = stack.pop()
+        if offset == 0:
+            continue
+        if offset not in records or offset in visited:
+            raise ValueError(f"{file_name} invalid directory record offset {offset}")
+        visited.add(offset)
+        record = records[offset]
+        record_info = ancestor_info | {
+            f"{group:04x}|{element:04x}": dicom_element_to_string(vr, value)
+            for (group, element), (vr, value) in record.items()
+            if vr != b"SQ"
+        }
+        res.append(record_info)
+        next_offset, lower_offset = [
+            struct.unpack("<I", record[k][1])[0] if k in record else 0
+            for k in [(0x0004, 0x1400), (0x0004, 0x1420)]
+        ]
+        stack.append((next_offset, ancestor_info))
+        stack.append((lower_offset, record_info))
+    return res
+
+
+def get_dicomdir_series_files(dicomdir_file_name, file_names, additional_series_tags):
+    """
+    Use a DICOMDIR index to identify the series of the image files it references, without
+    reading the image files. The series keys are identical to those created by
+    get_series_key_fname. Values of the additional series tags are taken from the image
+    record or its ancestor records, tags that do not appear in the DICOMDIR are treated as
+    missing from the image files.
+
+    Parameters
+    ----------
+    dicomdir_file_name (str): Name of the DICOMDIR file.
+    file_names (dict(str:str)): Available files, dictionary structure is lowercase file
+                                name:file name (DICOMDIR referenced file IDs are uppercase,
+                                while the file names may not be).
+    additional_series_tags (list(str)): List of DICOM tags that together with
+    series and study UID serve to uniquely identify files belonging to the same
+    series.
+
+    Returns
+    -------
+    dict(str:list(str)): The series keys and the available files belonging to each series.
+
+    Raises
+    ------
+    ValueError: If the DICOMDIR is invalid or inconsistent with the available files, an
+                image record that does not reference a file, is missing the series or study
+                UIDs, or references a file that is not available.
+    """
+    if is_url(dicomdir_file_name) or ARCHIVE_MEMBER_SEPARATOR in dicomdir_file_name:
+        path_module = posixpath
+    else:
+        path_module = os.path
+    dicomdir_dir = path_module.dirname(dicomdir_file_name)
+    series_files = defaultdict(list)
+    for record_info in read_dicomdir(dicomdir_file_name):
+        if record_info.get("0004|1430", "").strip() != "IMAGE":
+            continue
+        try:
+            file_id = record_info["0004|1500"].strip().split("\\")
+            sid = record_info["0020|000e"]
+            study = record_info["0020|000d"]
+        except KeyError as e:
+            raise ValueError(
+                f"{dicomdir_file_name} image record missing {e} {record_info}"
+            ) from e
+        referenced_file_name = path_module.join(dicomdir_dir, *file_id)
+        file_name = file_names.get(referenced_file_name.lower())
+        if file_name is None:
+            # the file exists but is not one of the files we were asked to inspect
+            if path_module is os.path and os.path.isfile(referenced_file_name):
+                continue
+            raise ValueError(
+                f"{dicomdir_file_name} referenced file {referenced_file_name} not found"
+            )
+        key = f"{sid}:{study}"
+        key += ":".join([record_info.get(k, " ") for k in additional_series_tags])
+        series_files[key].append(file_name)
+    return series_files
+
+
 def inspect_series(
     root_dir,
     max_processes,
@@ -499,6 +2962,20 @@ def inspect_series(
     additional_series_tags,
     meta_data_info={},
     thumbnail_settings={},
+    file_names=None,
+    inspect_archives=False,
+    use_dicomdir=False,
+    pipeline=False,
+    geometry_layout="tuples",
+    histogram_statistics=False,
+    shared_thumbnails=False,
+    metrics_file=None,
+    columns=OUTPUT_COLUMN_GROUPS,
+    stream=False,
+    backend="process",
+    read_ahead_files=0,
+    read_ahead_bytes=256 << 20,
+    intensity_hash="md5",
 ):
     """
     Inspect all series found in the directory structure. A series does not have to
@@ -525,10 +3002,41 @@ def inspect_series(
                               projection axis (maximal intensity project 3D images along this axis and
                               then create the 2D thumbnail from the projection), interpolator (SimpleITK
                               interpolator used to resize the 2D image to the thumbnail size).
+    file_names (list(str)): If given, only series comprised of these files are inspected instead of
+                            all the files found under root_dir (e.g. a sample of the files).
+    inspect_archives (bool): Inspect the members of zip and tar archives, the series files are
+                             listed using archive-qualified paths (e.g. /data/study.zip!/series1/image1.dcm).
+    use_dicomdir (bool): Use the DICOMDIR files found in the directory structure to identify the series
+                         of the files they reference without reading these files. Only the files that
+                         are not referenced by a valid DICOMDIR are read.
+    pipeline (bool): Inspect the series found in a directory while files in other directories are
+                     still being grouped into series, see inspect_series_pipelined.
+    geometry_layout (str): Report the image spatial information as tuples ("tuples") or as separate numeric
+                           values ("columns"), see geometry_columns.
+    histogram_statistics (bool): Report intensity distribution statistics computed from the intensity
+                                 histogram, see intensity_histogram_statistics.
+    shared_thumbnails (bool): Return the thumbnails from the worker processes via shared memory instead
+                              of pickling them, see SharedThumbnailSlots. Not used by the pipelined
+                              inspection.
+    metrics_file (str): If given, the throughput metrics are periodically written to this file, see
+                        ProgressMetrics. Grouping the files into series and inspecting the series are
+                        reported as separate phases.
+    columns (list(str)): Only report the information of these column groups, see OUTPUT_COLUMN_GROUPS.
+    stream (bool): Inspect each series one slice at a time instead of reading the volume, see
+                   inspect_series_slices.
+    backend (str): Run the grouping and inspection tasks in worker processes, threads or serially,
+                   see task_executor.
+    read_ahead_files (int): Number of upcoming series per worker whose files are read ahead into the
+                            page cache when inspecting the series, 0 disables read-ahead, see
+                            ReadAheadPrefetcher. Not used by the pipelined inspection.
+    read_ahead_bytes (int): Maximal number of bytes read ahead.
+    intensity_hash (str): The intensity hash algorithm, see INTENSITY_HASH_ALGORITHMS.
     Returns
     -------
     pandas DataFrame: Each row in the data frame corresponds to a single series.
     """
+    import pandas as pd
+
     # Identify all files that belong to the same DICOM series. The all_series_files dictionary keys
     # are unique series identifiers and the values are lists of files belonging
     # to the corresponding series.
@@ -539,67 +3047,431 @@ def inspect_series(
     # the series if it is a DICOM file. The key is based on combining the series and study UIDs and
     # the values corresponding to the provided additional_series_tags.
     all_series_files = defaultdict(list)
-    all_file_names = []
-    for dir_name, subdir_names, file_names in os.walk(root_dir):
-        all_file_names += [
-            os.path.join(os.path.abspath(dir_name), fname) for fname in file_names
-        ]
-    with concurrent.futures.ProcessPoolExecutor(max_processes) as executor:
-        futures = (
-            executor.submit(
-                partial(
-                    get_series_key_fname,
-                    additional_series_tags=additional_series_tags,
-                ),
-                file_name,
+    all_file_names = (
+        iter_all_file_names(root_dir, inspect_archives)
+        if file_names is None
+        else (expand_archives(file_names) if inspect_archives else list(file_names))
+    )
+    # The pipelined inspection traverses the directory structure lazily, unless the
+    # DICOMDIR files need to be found first.
+    if not pipeline or use_dicomdir:
+        all_file_names = list(all_file_names)
+    # When a DICOMDIR index is available, the series of the files it references are
+    # obtained from it and only the remaining files are read. If the DICOMDIR is
+    # invalid or inconsistent with the files, it is ignored.
+    if use_dicomdir:
+        lowercase_file_names = {
+            file_name.lower(): file_name for file_name in all_file_names
+        }
+        indexed_file_series = {}
+        for dicomdir_file_name in all_file_names:
+            # DICOMDIR file names may be lowercase on some file systems
+            dicomdir_base_name = posixpath.basename(
+                dicomdir_file_name.replace("\\", "/")
+            )
+            if dicomdir_base_name.upper() != "DICOMDIR":
+                continue
+            try:
+                dicomdir_series_files = get_dicomdir_series_files(
+                    dicomdir_file_name, lowercase_file_names, additional_series_tags
+                )
+            except (ValueError, OSError) as e:
+                print(f"Ignoring DICOMDIR: {e}", file=sys.stderr)
+                continue
+            for key, series_file_names in dicomdir_series_files.items():
+                for file_name in series_file_names:
+                    indexed_file_series.setdefault(file_name, key)
+        # retain the order of the files in the directory structure, GDCM uses it
+        # when the files of a series cannot be sorted by their spatial position
+        remaining_file_names = []
+        for file_name in all_file_names:
+            if file_name in indexed_file_series:
+                all_series_files[indexed_file_series[file_name]].append(file_name)
+            else:
+                remaining_file_names.append(file_name)
+        all_file_names = remaining_file_names
+    if pipeline:
+        return typed_geometry_columns(
+            pd.DataFrame.from_dict(
+                inspect_series_pipelined(
+                    all_file_names,
+                    all_series_files,
+                    max_processes,
+                    disable_tqdm,
+                    additional_series_tags,
+                    meta_data_info,
+                    thumbnail_settings,
+                    geometry_layout,
+                    histogram_statistics,
+                    metrics_file,
+                    columns,
+                    stream,
+                    backend,
+                    intensity_hash,
+                )
+            ).drop(columns=WORKER_TIME_KEY, errors="ignore")
+        )
+    metrics = progress_metrics(
+        metrics_file, "series grouping", len(all_file_names), count_failures=False
+    )
+    with task_executor(backend, max_processes) as executor:
+        futures = completed_futures(
+            executor,
+            partial(
+                get_series_key_fname,
+                additional_series_tags=additional_series_tags,
+            ),
+            all_file_names,
+            metrics=metrics,
+        )
+        for file_name, future in futures:
+            # if an exception was thrown by the process, for example the file is not in DICOM
+            # format then it will be re-raised when attempting to access the future's
+            # result, we can ignore it.
+            try:
+                result = future.result()
+                all_series_files[result[0]].append(result[1])
+            except Exception as e:
+                pass
+    if metrics is not None:
+        metrics.write()
+
+    # Get list of dictionaries describing the results and then combine into a dataframe, faster
+    # than appending to the dataframe one by one.
+    res = []
+    metrics = progress_metrics(metrics_file, "series inspection", len(all_series_files))
+    with shared_thumbnail_slots(
+        shared_thumbnails, thumbnail_settings, max_processes, backend
+    ) as thumbnail_slots, task_executor(
+        backend, max_processes
+    ) as executor, read_ahead_prefetcher(
+        all_series_files.items(), max_processes, read_ahead_files, read_ahead_bytes
+    ) as prefetcher:
+        futures = completed_futures(
+            executor,
+            partial(
+                inspect_single_series,
+                meta_data_info=meta_data_info,
+                thumbnail_settings=thumbnail_settings,
+                geometry_layout=geometry_layout,
+                histogram_statistics=histogram_statistics,
+                columns=columns,
+                stream=stream,
+                intensity_hash=intensity_hash,
+            ),
+            all_series_files.items(),
+            thumbnail_slots,
+            metrics,
+            prefetcher,
+        )
+        # tqdm configuration, the progress bar is updated at most once per second (mininterval), checking the
+        # time on every iteration (miniters), so it is updated regularly no matter how many items there are.
+        # Additionally, the whole progress bar is disabled if disable_tqdm is True, for example when scheduling a
+        # job on a cluster in which case there is no person looking at the progress, see the metrics_file for
+        # monitoring such runs.
+        tqdm_total = len(all_series_files)
+        for (key, file_names), future in tqdm(
+            futures,
+            total=tqdm_total,
+            mininterval=1,
+            miniters=1,
+            disable=disable_tqdm,
+            file=sys.stdout,
+        ):
+            try:
+                result = future.result()
+                res.append(result)
+            except Exception as e:
+                print(f"Failed process for {file_names}", file=sys.stderr)
+        if prefetcher is not None:
+            print(prefetcher.summary())
+    if metrics is not None:
+        metrics.write()
+    return typed_geometry_columns(
+        pd.DataFrame.from_dict(res).drop(columns=WORKER_TIME_KEY, errors="ignore")
+    )
+
+
+def inspect_series_pipelined(
+    file_names,
+    indexed_series_files,
+    max_processes,
+    disable_tqdm,
+    additional_series_tags,
+    meta_data_info={},
+    thumbnail_settings={},
+    geometry_layout="tuples",
+    histogram_statistics=False,
+    metrics_file=None,
+    columns=OUTPUT_COLUMN_GROUPS,
+    stream=False,
+    backend="process",
+    intensity_hash="md5",
+):
+    """
+    Inspect all series comprised of the given files, overlapping the grouping of files into
+    series with the inspection of the series. Files are grouped one directory at a time, and
+    once all files in a directory were grouped, the series whose files were only found in
+    that directory are inspected, while the grouping of files in other directories
+    continues. Series with files in multiple directories are inspected after all files
+    were grouped. If a file belonging to an already inspected series is found later on,
+    the series is inspected again using all of its files, so the results are the same
+    as when grouping all files before inspecting any series.
+
+    Parameters
+    ----------
+    file_names (iterable(str)): The files to group into series, the files in a directory are
+                                expected to be consecutive, otherwise more series are
+                                inspected again (e.g. os.walk order).
+    indexed_series_files (dict(str:list(str))): Series whose files are already known (e.g. from
+                                                 a DICOMDIR), these are inspected immediately.
+    max_processes (int): Maximal number of processes to use in when performing parallel processing.
+                         Only relevant for non-windows systems.
+    disable_tqdm (bool): Display a progress bar, or not.
+    additional_series_tags list(str): List of DICOM tags used to uniquely identify files belonging to the same
+                          series, see inspect_series.
+    meta_data_info(dict(str:str)): The meta-data information whose values will be reported,
+                                   see inspect_series.
+    thumbnail_settings(dict): A dictionary containing the settings required for creating a 2D
+                              thumbnail, see inspect_series.
+    geometry_layout (str): Report the image spatial information as tuples ("tuples") or as separate numeric
+                           values ("columns"), see inspect_series.
+    histogram_statistics (bool): Report intensity distribution statistics computed from the intensity
+                                 histogram, see intensity_histogram_statistics.
+    metrics_file (str): If given, the throughput metrics are periodically written to this file, see
+                        ProgressMetrics. Grouping and inspection are reported as a single phase,
+                        without an ETA as the number of series is not known in advance.
+    columns (list(str)): Only report the information of these column groups, see OUTPUT_COLUMN_GROUPS.
+    stream (bool): Inspect each series one slice at a time instead of reading the volume, see
+                   inspect_series_slices.
+    backend (str): Run the grouping and inspection tasks in worker processes, threads or serially,
+                   see task_executor.
+    intensity_hash (str): The intensity hash algorithm, see INTENSITY_HASH_ALGORITHMS.
+    Returns
+    -------
+    list(dict): Each entry describes a single series, see inspect_single_series.
+    """
+    # Limit the number of grouping tasks waiting in the process pool's queue, so that
+    # series inspection tasks submitted along the way do not wait for all files to be grouped.
+    max_pending = 4 * (max_processes if max_processes else os.cpu_count())
+    all_series_files = defaultdict(list, copy.deepcopy(indexed_series_files))
+    series_directories = defaultdict(set)
+    directory_series = defaultdict(set)
+    directory_pending = defaultdict(int)
+    listed_directories = set()
+    series_futures = {}
+    future_series_files = {}
+    stale_series = set()
+    metrics = progress_metrics(metrics_file, "series grouping and inspection")
+    inspect_function = partial(
+        inspect_single_series,
+        meta_data_info=meta_data_info,
+        thumbnail_settings=thumbnail_settings,
+        geometry_layout=geometry_layout,
+        histogram_statistics=histogram_statistics,
+        columns=columns,
+        stream=stream,
+        intensity_hash=intensity_hash,
+    )
+    if metrics is not None:
+        inspect_function = partial(timed_task, inspect_function)
+    with task_executor(backend, max_processes) as executor:
+
+        def submit_series(key):
+            # a series may be resubmitted before the previous inspection started,
+            # attempt to cancel it, its result is ignored in any case
+            if key in series_futures:
+                series_futures[key].cancel()
+            series_data = (key, list(all_series_files[key]))
+            future = executor.submit(inspect_function, series_data)
+            if metrics is not None:
+                metrics.track(future, series_data)
+            series_futures[key] = future
+            future_series_files[future] = list(all_series_files[key])
+            stale_series.discard(key)
+
+        def directory_grouped(directory):
+            for key in directory_series[directory]:
+                if series_directories[key] == {directory} and (
+                    key not in series_futures or key in stale_series
+                ):
+                    submit_series(key)
+
+        # series whose files are known are not associated with a directory
+        for key in indexed_series_files:
+            series_directories[key].add(None)
+            submit_series(key)
+
+        file_names = iter(file_names)
+        current_directory = None
+        pending = {}
+        listing_done = False
+        while True:
+            while not listing_done and len(pending) < max_pending:
+                file_name = next(file_names, None)
+                directory = None if file_name is None else os.path.dirname(file_name)
+                if directory != current_directory and current_directory is not None:
+                    listed_directories.add(current_directory)
+                    if directory_pending[current_directory] == 0:
+                        directory_grouped(current_directory)
+                current_directory = directory
+                if file_name is None:
+                    listing_done = True
+                    break
+                directory_pending[directory] += 1
+                future = executor.submit(
+                    partial(
+                        get_series_key_fname,
+                        additional_series_tags=additional_series_tags,
+                    ),
+                    file_name,
+                )
+                if metrics is not None:
+                    metrics.track(future, file_name, count_failures=False)
+                pending[future] = file_name
+            if not pending:
+                break
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
             )
-            for file_name in all_file_names
+            for future in done:
+                file_name = pending.pop(future)
+                directory = os.path.dirname(file_name)
+                directory_pending[directory] -= 1
+                # if an exception was thrown by the process, for example the file is not in DICOM
+                # format then it will be re-raised when attempting to access the future's
+                # result, we can ignore it.
+                try:
+                    key = future.result()[0]
+                    all_series_files[key].append(file_name)
+                    series_directories[key].add(directory)
+                    directory_series[directory].add(key)
+                    if key in series_futures:
+                        stale_series.add(key)
+                except Exception as e:
+                    pass
+                if (
+                    directory in listed_directories
+                    and directory_pending[directory] == 0
+                ):
+                    directory_grouped(directory)
+        # Inspect the series with files in multiple directories and the ones that gained
+        # files after they were submitted.
+        for key in all_series_files:
+            if key not in series_futures or key in stale_series:
+                submit_series(key)
+
+        res = []
+        tqdm_total = len(series_futures)
+        for future in tqdm(
+            concurrent.futures.as_completed(series_futures.values()),
+            total=tqdm_total,
+            mininterval=1,
+            miniters=1,
+            disable=disable_tqdm,
+            file=sys.stdout,
+        ):
+            try:
+                result = future.result()
+                res.append(result)
+            except Exception as e:
+                print(
+                    f"Failed process for {future_series_files[future]}",
+                    file=sys.stderr,
+                )
+    if metrics is not None:
+        metrics.write()
+    return res
+
+
+# Rec. 709 luminance weights in fixed point. For 8-bit channels the weighted sum of
+# the per-channel table entries is the exact luminance scaled by 255*sum(weights).
+LUMINANCE_WEIGHTS = (2126, 7152, 722)
+LUMINANCE_TABLES = [np.arange(256, dtype=np.uint32) * w for w in LUMINANCE_WEIGHTS]
+
+
+def srgb_gamma_correction(luminance):
+    """
+    Nonlinear sRGB gamma correction of fixed point luminance values (see
+    LUMINANCE_WEIGHTS), computed in double precision.
+    """
+    I = np.asarray(luminance) / (255.0 * sum(LUMINANCE_WEIGHTS))
+    return np.where(I <= 0.0031308, 12.92 * I, 1.055 * I ** (1 / 2.4)) - 0.055
+
+
+def srgb_to_gray(img):
+    """
+    Convert an sRGB image to grayscale and rescale the results to [0,255]. Only the
+    first three channels are used.
+
+    Images with 8-bit channels are converted using lookup tables, without creating
+    full size floating point images. The luminance is the sum of 256 entry per-channel
+    tables. The gamma correction and rescaling depend on the luminance of all three
+    channels and cannot be split into per-channel tables, but they are monotonic, so
+    the 255 luminance thresholds between gray levels are found by bisection and the
+    mapping is applied using a table indexed by luminance. Results may differ by one
+    gray level from the floating point computation used for other pixel types.
+
+    Parameters
+    ----------
+    img (SimpleITK.Image): A 2D image with three or more channels.
+
+    Returns
+    -------
+    2D SimpleITK image with sitkUInt8 pixel type.
+    """
+    if img.GetPixelID() != sitk.sitkVectorUInt8:
+        channels = [
+            sitk.VectorIndexSelectionCast(img, i, sitk.sitkFloat32) for i in range(3)
+        ]
+        # linear mapping
+        I = (
+            1
+            / 255.0
+            * (0.2126 * channels[0] + 0.7152 * channels[1] + 0.0722 * channels[2])
+        )
+        # nonlinear gamma correction
+        I = (
+            I * sitk.Cast(I <= 0.0031308, sitk.sitkFloat32) * 12.92
+            + I ** (1 / 2.4) * sitk.Cast(I > 0.0031308, sitk.sitkFloat32) * 1.055
+            - 0.055
+        )
+        return sitk.Cast(sitk.RescaleIntensity(I), sitk.sitkUInt8)
+    arr = sitk.GetArrayViewFromImage(img)
+    luminance = LUMINANCE_TABLES[0][arr[..., 0]]
+    luminance += LUMINANCE_TABLES[1][arr[..., 1]]
+    luminance += LUMINANCE_TABLES[2][arr[..., 2]]
+    min_luminance = int(luminance.min())
+    max_luminance = int(luminance.max())
+    if min_luminance == max_luminance:
+        gray = np.zeros(luminance.shape, dtype=np.uint8)
+    else:
+        min_intensity, max_intensity = srgb_gamma_correction(
+            [min_luminance, max_luminance]
         )
-        for future in concurrent.futures.as_completed(futures):
-            # if an exception was thrown by the process, for example the file is not in DICOM
-            # format then it will be re-raised when attempting to access the future's
-            # result, we can ignore it.
-            try:
-                result = future.result()
-                all_series_files[result[0]].append(result[1])
-            except Exception as e:
-                pass
-
-    # Get list of dictionaries describing the results and then combine into a dataframe, faster
-    # than appending to the dataframe one by one.
-    res = []
-    with concurrent.futures.ProcessPoolExecutor(max_processes) as executor:
-        futures = (
-            executor.submit(
-                partial(
-                    inspect_single_series,
-                    meta_data_info=meta_data_info,
-                    thumbnail_settings=thumbnail_settings,
-                ),
-                series_data,
+        scale = 255.0 / (max_intensity - min_intensity)
+        # Smallest luminance mapped to each of the gray levels 1-255, the maximal
+        # luminance is always mapped to 255.
+        levels = np.arange(1, 256)
+        low = np.full(levels.shape, min_luminance)
+        high = np.full(levels.shape, max_luminance)
+        while np.any(low < high):
+            middle = (low + high) // 2
+            above = (
+                np.floor((srgb_gamma_correction(middle) - min_intensity) * scale)
+                >= levels
             )
-            for series_data in all_series_files.items()
+            high = np.where(above, middle, high)
+            low = np.where(above | (low >= high), low, middle + 1)
+        table = np.repeat(
+            np.arange(256, dtype=np.uint8),
+            np.diff(np.concatenate(([min_luminance], low, [max_luminance + 1]))),
         )
-        # tqdm configuration, set miniters (minimal number of iterations before updating the progress bar) to
-        # be about ~10% of data in combination with maxinterval of 60sec. If the 10% interval takes more
-        # than 60sec then tqdm automatically changes it to match the maxinterval. Additionally, the whole progress
-        # bar is disabled if disable_tqdm is True, for example when scheduling a job on a cluster in which case there
-        # is no person looking at the progress.
-        tqdm_total = len(all_series_files)
-        for file_names, future in tqdm(
-            zip(all_series_files.values(), concurrent.futures.as_completed(futures)),
-            total=tqdm_total,
-            maxinterval=60,
-            miniters=tqdm_total // 10,
-            disable=disable_tqdm,
-            file=sys.stdout,
-        ):
-            try:
-                result = future.result()
-                res.append(result)
-            except Exception as e:
-                print(f"Failed process for {file_names}", file=sys.stderr)
-    return pd.DataFrame.from_dict(res)
+        luminance -= min_luminance
+        gray = table[luminance]
+    res = sitk.GetImageFromArray(gray)
+    res.CopyInformation(img)
+    return res
 
 
 def image_to_thumbnail(img, thumbnail_sizes, interpolator, projection_axis):
@@ -638,22 +3510,7 @@ def image_to_thumbnail(img, thumbnail_sizes, interpolator, projection_axis):
     # if the 4 channel image is sRGBA and A is 255, so selecting the last channel is just a "white" image.
     if img.GetNumberOfComponentsPerPixel() >= 3:
         # Convert image to gray scale and rescale results to [0,255]
-        channels = [
-            sitk.VectorIndexSelectionCast(img, i, sitk.sitkFloat32) for i in range(3)
-        ]
-        # linear mapping
-        I = (
-            1
-            / 255.0
-            * (0.2126 * channels[0] + 0.7152 * channels[1] + 0.0722 * channels[2])
-        )
-        # nonlinear gamma correction
-        I = (
-            I * sitk.Cast(I <= 0.0031308, sitk.sitkFloat32) * 12.92
-            + I ** (1 / 2.4) * sitk.Cast(I > 0.0031308, sitk.sitkFloat32) * 1.055
-            - 0.055
-        )
-        img = sitk.Cast(sitk.RescaleIntensity(I), sitk.sitkUInt8)
+        img = srgb_to_gray(img)
     else:
         if img.GetPixelID() != sitk.sitkUInt8:
             # To deal with high dynamic range images that also contain outlier intensities
@@ -698,30 +3555,980 @@ def image_to_thumbnail(img, thumbnail_sizes, interpolator, projection_axis):
     center = img.TransformContinuousIndexToPhysicalPoint(
         [sz / 2.0 for sz in img.GetSize()]
     )
-    new_origin = [
-        c - c_index * nspc
-        for c, c_index, nspc in zip(
-            center, [sz / 2.0 for sz in thumbnail_sizes], new_spacing
-        )
-    ]
-    # Usually, the defaultPixelValue is set to zero, but when this value
-    # pads the image it is hard to separate the image from a viewer's
-    # background which is usually also set to zero. We therefor set it to
-    # 127, middle of the intensity range used for the thumbnail creation.
-    res = sitk.Resample(
-        img,
-        size=thumbnail_sizes,
-        transform=sitk.Transform(),
-        interpolator=interpolator,
-        outputOrigin=new_origin,
-        outputSpacing=new_spacing,
-        outputDirection=img.GetDirection(),
-        defaultPixelValue=127,
-        outputPixelType=img.GetPixelID(),
+    new_origin = [
+        c - c_index * nspc
+        for c, c_index, nspc in zip(
+            center, [sz / 2.0 for sz in thumbnail_sizes], new_spacing
+        )
+    ]
+    # Usually, the defaultPixelValue is set to zero, but when this value
+    # pads the image it is hard to separate the image from a viewer's
+    # background which is usually also set to zero. We therefor set it to
+    # 127, middle of the intensity range used for the thumbnail creation.
+    res = sitk.Resample(
+        img,
+        size=thumbnail_sizes,
+        transform=sitk.Transform(),
+        interpolator=interpolator,
+        outputOrigin=new_origin,
+        outputSpacing=new_spacing,
+        outputDirection=img.GetDirection(),
+        defaultPixelValue=127,
+        outputPixelType=img.GetPixelID(),
+    )
+    res.SetSpacing([1, 1])
+    res.SetOrigin([0, 0])
+    return res
+
+
+def perceptual_hash(thumbnail):
+    """
+    Compute a 64 bit perceptual hash (difference hash, dHash) from a 2D grayscale thumbnail. The
+    thumbnail is divided into a grid of 8x9 blocks and each bit of the hash records whether the mean
+    intensity of a block is larger than that of its left neighbor. Visually similar images, such as
+    re-encoded or slightly modified copies, have hashes with a small Hamming distance.
+
+    Parameters
+    ----------
+    thumbnail (SimpleITK.Image): 2D grayscale image with at least 9x8 pixels (output of image_to_thumbnail).
+
+    Returns
+    -------
+    str: The 64 bit hash as a 16 character hexadecimal string.
+    """
+    arr = sitk.GetArrayViewFromImage(thumbnail).astype(np.float64)
+    row_edges = np.linspace(0, arr.shape[0], 9, dtype=int)[:-1]
+    col_edges = np.linspace(0, arr.shape[1], 10, dtype=int)[:-1]
+    block_sums = np.add.reduceat(
+        np.add.reduceat(arr, row_edges, axis=0), col_edges, axis=1
+    )
+    block_counts = np.outer(
+        np.diff(np.append(row_edges, arr.shape[0])),
+        np.diff(np.append(col_edges, arr.shape[1])),
+    )
+    block_means = block_sums / block_counts
+    bits = (block_means[:, 1:] > block_means[:, :-1]).ravel()
+    return np.packbits(bits).tobytes().hex()
+
+
+# The maximal Hamming distance for near duplicates, the 64 bit hashes are split into
+# max_distance+1 bands so that bands are at least 8 bits wide.
+MAX_NEAR_DUPLICATE_DISTANCE = 7
+# Buckets of the near duplicate index with more hashes are split further, if splitting sufficiently
+# reduces the number of compared pairs.
+NEAR_DUPLICATE_BUCKET_SIZE = 256
+# Maximal number of hash pairs compared in one vectorized step, bounds the memory footprint.
+NEAR_DUPLICATE_BLOCK_SIZE = 2**22
+
+
+def near_duplicate_groups(perceptual_hashes, max_distance):
+    """
+    Group perceptual hashes that are within a given Hamming distance of each other. Candidate pairs
+    are found using a multi-index hashing approach, so that the number of comparisons is not
+    quadratic in the number of hashes. The 64 bit hashes are split into max_distance+1 bands and each
+    band value is used as a bucket key. Based on the pigeonhole principle, two hashes that differ in at
+    most max_distance bits have at least one identical band, so all near duplicates are found. Only
+    hashes sharing a bucket are compared, and identical hashes are collapsed before indexing.
+    Bits that are identical for all hashes in a bucket are ignored, and the remaining bits are dealt
+    to the bands from the most to the least evenly splitting bit. Buckets with more than
+    NEAR_DUPLICATE_BUCKET_SIZE hashes are indexed again using their own bands, as long as this
+    reduces the number of compared pairs by a large enough factor to pay for copying the hashes into
+    max_distance+1 sets of buckets. Otherwise, such as for dense clusters of near duplicates, the
+    hashes of the bucket are compared in vectorized blocks. When at most max_distance bits vary
+    within a bucket, all of its hashes are near duplicates of each other and no comparisons are needed.
+    Groups are the connected components of the "within max_distance" relation, so a group may contain
+    members whose distance from each other is larger than max_distance (A~B, B~C, but not A~C). As only
+    the components matter, pairs that are already in the same component are not compared: buckets
+    whose hashes are all in one component are skipped, and block comparisons skip pairs within the
+    largest component of the bucket. This also limits the repeated work for pairs that share more
+    than one band.
+
+    Parameters
+    ----------
+    perceptual_hashes (list(str)): Hexadecimal 64 bit hashes (output of perceptual_hash).
+    max_distance (int in [0,MAX_NEAR_DUPLICATE_DISTANCE]): Maximal Hamming distance between hashes
+                                                          of near duplicates.
+
+    Returns
+    -------
+    list(list(int)): Groups of indexes into perceptual_hashes, only groups with more than one entry are
+                     returned.
+    """
+    # collapse identical hashes, the index only contains the unique values
+    hash_indexes = defaultdict(list)
+    for i, h in enumerate(perceptual_hashes):
+        hash_indexes[int(h, 16)].append(i)
+    unique_hashes = list(hash_indexes.keys())
+    values = np.array(unique_hashes, dtype=np.uint64)
+
+    # union-find over the unique hashes, with path halving
+    parents = np.arange(len(unique_hashes))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    def union(i, j):
+        r1 = find(i)
+        r2 = find(j)
+        if r1 != r2:
+            parents[r2] = r1
+
+    def roots(members):
+        # vectorized find, the paths of the members are compressed
+        member_roots = parents[members]
+        while True:
+            next_roots = parents[member_roots]
+            if np.array_equal(next_roots, member_roots):
+                break
+            member_roots = next_roots
+        parents[members] = member_roots
+        return member_roots
+
+    if hasattr(np, "bitwise_count"):
+        bit_count = np.bitwise_count
+    else:
+        # number of set bits of each byte value, for numpy versions without bitwise_count
+        byte_bit_counts = np.array(
+            [bin(i).count("1") for i in range(256)], dtype=np.uint8
+        )
+
+        def bit_count(x):
+            return (
+                byte_bit_counts[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1)
+            )
+
+    def merge(first_roots, second_roots):
+        # union each pair of distinct components once
+        pairs = first_roots != second_roots
+        for root_pair in set(
+            zip(first_roots[pairs].tolist(), second_roots[pairs].tolist())
+        ):
+            union(*root_pair)
+
+    def link(first, second):
+        close = bit_count(values[first] ^ values[second]) <= max_distance
+        merge(roots(first[close]), roots(second[close]))
+
+    def compare(members):
+        member_values = values[members]
+        # small first blocks, so that comparisons of dense clusters stop early
+        block_rows = max(8, 2**16 // len(members))
+        start = 0
+        while start < len(members) - 1:
+            member_roots = roots(members)
+            component_roots, component_sizes = np.unique(
+                member_roots, return_counts=True
+            )
+            if len(component_roots) == 1:
+                break
+            # pairs within the largest component cannot merge components, they are not compared
+            outside = member_roots != component_roots[np.argmax(component_sizes)]
+            # compare a block of members to the members which follow them
+            stop = min(start + block_rows, len(members) - 1)
+            rows = np.arange(start, stop)
+            later = np.arange(start + 1, len(members))
+            compared = 0
+            for block, columns in (
+                (rows[outside[rows]], later),
+                (rows[~outside[rows]], later[outside[later]]),
+            ):
+                distances = bit_count(
+                    member_values[block, np.newaxis]
+                    ^ member_values[np.newaxis, columns]
+                )
+                compared += distances.size
+                i, j = np.nonzero(distances <= max_distance)
+                i = block[i]
+                j = columns[j]
+                pairs = j > i
+                merge(member_roots[i[pairs]], member_roots[j[pairs]])
+            start = stop
+            block_rows = max(
+                1,
+                min(
+                    2 * block_rows,
+                    block_rows * NEAR_DUPLICATE_BLOCK_SIZE // max(compared, 1),
+                ),
+            )
+
+    buckets = [np.arange(len(unique_hashes))] if len(unique_hashes) > 1 else []
+    while buckets:
+        members = buckets.pop()
+        member_roots = roots(members)
+        if np.all(member_roots == member_roots[0]):
+            continue
+        member_values = values[members]
+        # Bits that are identical in all members do not separate them. The others are ordered by
+        # how evenly they split the members and dealt to the bands in turn, so that bits which only
+        # vary for a few outliers do not end up in the same band.
+        ones = np.unpackbits(
+            member_values.astype("<u8").view(np.uint8).reshape(-1, 8),
+            axis=1,
+            bitorder="little",
+        ).sum(axis=0, dtype=np.int64)
+        balance = np.minimum(ones, len(members) - ones)
+        bits = [b for b in np.argsort(-balance, kind="stable") if balance[b] > 0]
+        if len(bits) <= max_distance:
+            # all members are within max_distance of each other
+            for r in np.unique(member_roots[1:]):
+                union(member_roots[0], r)
+            continue
+        if len(members) > NEAR_DUPLICATE_BUCKET_SIZE:
+            bands = []
+            for i in range(max_distance + 1):
+                band_mask = sum(1 << int(b) for b in bits[i :: max_distance + 1])
+                keys = member_values & np.uint64(band_mask)
+                order = np.argsort(keys, kind="stable")
+                sorted_keys = keys[order]
+                group_starts = np.flatnonzero(
+                    np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+                )
+                group_sizes = np.diff(group_starts, append=len(members))
+                bands.append((members[order], group_starts, group_sizes))
+            # Splitting is only useful if the buckets shrink enough to offset the replication and
+            # the higher overhead of comparing many buckets.
+            if (
+                4 * sum((group_sizes**2).sum() for _, _, group_sizes in bands)
+                < len(members) ** 2
+            ):
+                for band_members, group_starts, group_sizes in bands:
+                    large = group_sizes > NEAR_DUPLICATE_BUCKET_SIZE
+                    buckets.extend(
+                        band_members[group_start : group_start + group_size]
+                        for group_start, group_size in zip(
+                            group_starts[large], group_sizes[large]
+                        )
+                    )
+                    # The small buckets are compared together, pairing each member with the
+                    # member offset positions after it in the same bucket.
+                    group_ends = np.repeat(
+                        np.where(large, 0, group_starts + group_sizes), group_sizes
+                    )
+                    positions = np.arange(len(members))
+                    for offset in range(1, group_sizes[~large].max(initial=1)):
+                        positions = positions[
+                            positions + offset < group_ends[positions]
+                        ]
+                        link(band_members[positions], band_members[positions + offset])
+                continue
+        compare(members)
+
+    groups = defaultdict(list)
+    for i, h in enumerate(unique_hashes):
+        groups[find(i)].extend(hash_indexes[h])
+    return [sorted(g) for g in groups.values() if len(g) > 1]
+
+
+def stratified_sample(file_names, analysis_type, sample_size, rng):
+    """
+    Select a stratified random sample from the files found in a directory structure. In per_file
+    analysis the sampling unit is a file and the strata are defined by the file's directory and
+    extension. In per_series analysis the sampling unit is a directory (all files in the directory
+    are inspected) and the strata are defined by the parent directory. When there are too many strata
+    for the sample size, the strata are coarsened (per_file: extension only, then no stratification,
+    per_series: no stratification). Each stratum contributes at least two units, or all of its units
+    if it has fewer, and the remaining sample size is allocated proportionally to the stratum sizes.
+
+    The file names are consumed in a single pass, so that the sample is selected while the directory
+    structure is traversed (see iter_all_file_names). Every stratum, at every level of coarsening,
+    keeps a uniform random sample of at most sample_size of its units (reservoir sampling), so the
+    memory used is bounded by the sample size and the number of strata, not by the number of files.
+    The traversal itself is still linear in the number of files.
+
+    Parameters
+    ----------
+    file_names (iterable(str)): Absolute paths of all the files in the directory structure.
+    analysis_type (str): "per_file" or "per_series".
+    sample_size (int): Number of units (files or directories) to sample.
+    rng (numpy.random.Generator): Random number generator used for sampling.
+
+    Returns
+    -------
+    tuple(list(str), dict): The file names to inspect and a dictionary describing the sampled units,
+                            unit:(stratum, stratum size, stratum sample size).
+    """
+    if analysis_type == "per_file":
+        stratum_keys = [
+            lambda f: (os.path.dirname(f), os.path.splitext(f)[1].lower()),
+            lambda f: os.path.splitext(f)[1].lower(),
+            lambda f: "",
+        ]
+    else:
+        stratum_keys = [lambda d: os.path.dirname(d), lambda d: ""]
+    # per level of coarsening, the number of units in each stratum and a reservoir with a uniform
+    # random sample of its units
+    stratum_sizes = [defaultdict(int) for stratum_key in stratum_keys]
+    reservoirs = [defaultdict(list) for stratum_key in stratum_keys]
+    # per_series, directories that were seen and the files of those that entered a reservoir
+    # (the files of a directory are usually listed consecutively, but not necessarily)
+    seen_dirs = set()
+    unit_files = {}
+    for file_name in file_names:
+        if analysis_type == "per_file":
+            unit = file_name
+        else:
+            unit = os.path.dirname(file_name)
+            if unit in seen_dirs:
+                if unit in unit_files:
+                    unit_files[unit].append(file_name)
+                continue
+            seen_dirs.add(unit)
+        selected = False
+        for stratum_key, sizes, stratum_reservoirs in zip(
+            stratum_keys, stratum_sizes, reservoirs
+        ):
+            k = stratum_key(unit)
+            sizes[k] += 1
+            reservoir = stratum_reservoirs[k]
+            if len(reservoir) < sample_size:
+                reservoir.append(unit)
+                selected = True
+            else:
+                j = rng.integers(sizes[k])
+                if j < sample_size:
+                    reservoir[j] = unit
+                    selected = True
+        if analysis_type == "per_series" and selected:
+            unit_files[unit] = [file_name]
+    # use the finest stratification for which we can sample two units per stratum
+    for sizes, stratum_reservoirs in zip(stratum_sizes, reservoirs):
+        if 2 * len(sizes) <= sample_size:
+            break
+    # proportional allocation, rounded using the largest remainder method, with a minimum of two
+    # units per stratum and no more than the number of units in the stratum.
+    population_size = sum(sizes.values())
+    if population_size == 0:
+        return [], {}
+    sample_size = min(sample_size, population_size)
+    min_units = min(2, sample_size)
+    quotas = {k: sample_size * n / population_size for k, n in sizes.items()}
+    sample_sizes = {k: min(sizes[k], max(min_units, int(q))) for k, q in quotas.items()}
+    difference = sample_size - sum(sample_sizes.values())
+    while difference != 0:
+        if difference > 0:
+            candidates = sorted(
+                [k for k in sizes if sample_sizes[k] < sizes[k]],
+                key=lambda k: quotas[k] - sample_sizes[k],
+                reverse=True,
+            )
+        else:
+            candidates = sorted(
+                [k for k in sizes if sample_sizes[k] > min_units],
+                key=lambda k: quotas[k] - sample_sizes[k],
+            )
+        for k in candidates[: abs(difference)]:
+            sample_sizes[k] += int(np.sign(difference))
+        difference = sample_size - sum(sample_sizes.values())
+
+    # a uniform random sample of the reservoir is a uniform random sample of the stratum, the
+    # reservoir holds all the units of the stratum or sample_size of them
+    sample_info = {}
+    for k, reservoir in stratum_reservoirs.items():
+        for u in rng.choice(reservoir, size=sample_sizes[k], replace=False):
+            sample_info[str(u)] = (k, sizes[k], sample_sizes[k])
+    if analysis_type == "per_file":
+        return sorted(sample_info.keys()), sample_info
+    return [f for d in sorted(sample_info) for f in unit_files[d]], sample_info
+
+
+def sampled_files_size(file_names):
+    """
+    Total size in bytes of the files comprising an image, used for estimating the mean file size
+    from a sample.
+
+    Parameters
+    ----------
+    file_names (list(str)): File paths or URLs, possibly archive-qualified.
+
+    Returns
+    -------
+    int or numpy.nan: The size, or NaN if the size is not known. Images in archives are left out of
+                      the file size estimate, the size of the member is not the size of the
+                      (compressed) data stored in the archive. The size of remote files is the
+                      object size reported by the storage.
+    """
+    if any(split_archive_member_path(f)[1] is not None for f in file_names):
+        return np.nan
+    size = 0
+    try:
+        for file_name in file_names:
+            if is_url(file_name):
+                import fsspec
+
+                fs, path = fsspec.core.url_to_fs(file_name)
+                size += fs.info(path)["size"]
+            else:
+                size += os.path.getsize(file_name)
+    except OSError:  # file removed
+        return np.nan
+    return size
+
+
+def sample_estimates(df, sample_info, unit_key, categorical_columns):
+    """
+    Estimate dataset characteristics from a stratified sample, with 95% confidence intervals (normal
+    approximation). Estimates include the fraction of units that could be read, the distribution of
+    categorical values (e.g. pixel type, modality), the mean image size, spacing and file size of the
+    images, and the projected number of images. The means are estimated per stratum using only the images
+    that were read, and are combined using the estimated number of images in each stratum.
+
+    Parameters
+    ----------
+    df (pandas.DataFrame): The characterization results for the sample, one row per image.
+    sample_info (dict): The sampled units, unit:(stratum, stratum size, stratum sample size), as
+                        returned by stratified_sample.
+    unit_key (callable): Maps a row of df to its sampling unit (file or directory).
+    categorical_columns (list(str)): Columns whose value distribution is estimated.
+
+    Returns
+    -------
+    pandas.DataFrame: With columns "quantity", "estimate", "95% CI lower", "95% CI upper".
+    """
+    import pandas as pd
+
+    z = 1.96
+    strata = {}
+    for stratum, stratum_size, stratum_sample_size in sample_info.values():
+        strata[stratum] = (stratum_size, stratum_sample_size)
+    population_size = sum(N for N, n in strata.values())
+    units = df.apply(unit_key, axis=1)
+    # images that were read have values besides the file names, and the pixel type unless
+    # only some of the columns were requested
+    rows = df.assign(
+        stratum=units.map(lambda u: sample_info[u][0]),
+        read=(
+            df["pixel type"].notna()
+            if "pixel type" in df.columns
+            else df.drop(columns=["files", "sample weight"], errors="ignore")
+            .notna()
+            .any(axis=1)
+        ),
+    )
+    rows["file size"] = df["files"].apply(sampled_files_size)
+    # in the "columns" layout the per axis values are already available, 2D images are
+    # embedded in 3D so their z spacing is not a measured spacing.
+    if "image dimension" in rows.columns:
+        rows["image spacing z"] = rows["image spacing z"].where(
+            rows["image dimension"] != 2
+        )
+    for i, axis in enumerate(["x", "y", "z"] if "image size" in rows.columns else []):
+        rows[f"image size {axis}"] = rows["image size"].apply(
+            lambda x: np.nan if not isinstance(x, tuple) else (list(x) + [1])[i]
+        )
+        rows[f"image spacing {axis}"] = rows["image spacing"].apply(
+            lambda x: np.nan if not isinstance(x, tuple) or len(x) <= i else x[i]
+        )
+    groups = dict(list(rows.groupby("stratum")))
+
+    def proportion(indicator):
+        # stratified estimate of a proportion per sampling unit, indicator is computed per row
+        # and aggregated per unit (series in the same directory share the directory's unit).
+        estimate = 0.0
+        variance = 0.0
+        for stratum, (N, n) in strata.items():
+            if stratum not in groups:
+                continue
+            g = groups[stratum]
+            values = indicator(g).groupby(units[g.index]).mean()
+            values = values.reindex(
+                [u for u, info in sample_info.items() if info[0] == stratum],
+                fill_value=0.0,
+            )
+            estimate += N / population_size * values.mean()
+            if n > 1:
+                variance += (
+                    (N / population_size) ** 2 * (1 - n / N) * values.var(ddof=1) / n
+                )
+        return estimate, np.sqrt(variance)
+
+    def mean(column):
+        # combine per stratum means of the images that were read, weighted by the estimated number
+        # of images in the stratum.
+        weights = []
+        means = []
+        variances = []
+        for stratum, (N, n) in strata.items():
+            if stratum not in groups:
+                continue
+            values = groups[stratum].loc[groups[stratum]["read"], column].dropna()
+            if values.empty:
+                continue
+            weights.append(N / n * len(values))
+            means.append(values.mean())
+            variances.append(
+                (1 - n / N) * values.var(ddof=1) / len(values) if len(values) > 1 else 0
+            )
+        if not weights:
+            return np.nan, np.nan
+        weights = np.array(weights) / np.sum(weights)
+        return np.dot(weights, means), np.sqrt(np.dot(weights**2, variances))
+
+    estimates = []
+    read_fraction, read_se = proportion(lambda g: g["read"].astype(float))
+    estimates.append(("fraction of units with images read", read_fraction, read_se))
+    for column in categorical_columns:
+        if column not in rows.columns:
+            continue
+        for value in sorted(rows[column].dropna().unique(), key=str):
+            p, se = proportion(lambda g: (g[column] == value).astype(float))
+            estimates.append((f"{column} = {value}", p, se))
+    for column in [
+        "image size x",
+        "image size y",
+        "image size z",
+        "image spacing x",
+        "image spacing y",
+        "image spacing z",
+        "file size",
+    ]:
+        if column not in rows.columns:
+            continue
+        m, se = mean(column)
+        estimates.append((f"mean {column}", m, se))
+    # projected number of images, in per_series analysis a unit may contain multiple series so we use
+    # the average number of images read per unit.
+    images = 0.0
+    images_variance = 0.0
+    for stratum, (N, n) in strata.items():
+        if stratum not in groups:
+            continue
+        counts = (
+            groups[stratum]["read"]
+            .astype(float)
+            .groupby(units[groups[stratum].index])
+            .sum()
+        )
+        counts = counts.reindex(
+            [u for u, info in sample_info.items() if info[0] == stratum],
+            fill_value=0.0,
+        )
+        images += N * counts.mean()
+        if n > 1:
+            images_variance += N**2 * (1 - n / N) * counts.var(ddof=1) / n
+    estimates.append(("number of images", images, np.sqrt(images_variance)))
+    estimates = pd.DataFrame(
+        [(q, e, e - z * se, e + z * se) for q, e, se in estimates],
+        columns=["quantity", "estimate", "95% CI lower", "95% CI upper"],
+    )
+    # confidence intervals of proportions are clipped to [0,1] and of other quantities to [0,inf)
+    proportions = estimates["quantity"].str.contains(" = ") | estimates[
+        "quantity"
+    ].str.startswith("fraction")
+    estimates[["95% CI lower", "95% CI upper"]] = estimates[
+        ["95% CI lower", "95% CI upper"]
+    ].clip(lower=0)
+    estimates.loc[proportions, ["95% CI lower", "95% CI upper"]] = estimates.loc[
+        proportions, ["95% CI lower", "95% CI upper"]
+    ].clip(upper=1)
+    return estimates
+
+
+PLAN_HEADER_SAMPLES = 20
+PLAN_DECODE_SAMPLES = 3
+PLAN_MEMORY_FRACTION = 0.8
+
+
+def file_size(file_name):
+    """
+    Size of a local file in bytes, zero for files inside archives and remote objects whose size
+    is not known without reading them.
+    """
+    try:
+        return os.path.getsize(file_name)
+    except OSError:
+        return 0
+
+
+def peak_memory():
+    """
+    Peak resident set size of the current process in bytes, None if not available (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else 1024 * peak
+
+
+def physical_memory():
+    """
+    Physical memory of the system in bytes, None if not available (Windows).
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def measured_task(function, *args):
+    """
+    Run a task and report its duration and the peak memory of the process running it. Exceptions
+    are returned and not raised, the time it takes to fail reading a file is part of the run time.
+
+    Returns
+    -------
+    tuple(result or Exception, float, int): The task result, its duration in seconds and the peak
+                                            resident set size of the process in bytes (None if not
+                                            available).
+    """
+    start_time = time.perf_counter()
+    try:
+        result = function(*args)
+    except Exception as e:
+        result = e
+    return result, time.perf_counter() - start_time, peak_memory()
+
+
+def fresh_worker_task(function, *args):
+    """
+    Run a measured_task in a newly started worker process, so that the reported peak memory is
+    that of a worker which only ran this task.
+    """
+    with process_pool_executor(1) as executor:
+        return executor.submit(measured_task, function, *args).result()
+
+
+def plan_characterization(
+    file_names,
+    analysis_type,
+    max_processes,
+    header_function,
+    inspect_function,
+    rng,
+    backend="process",
+    thumbnail_settings={},
+    tile_sizes=None,
+):
+    """
+    Predict the resources required to characterize the data without characterizing it. The files
+    are grouped by format (file extension) and for each format a random sample of file headers is
+    read, giving the fraction of readable files and the time it takes to read a header. A few units
+    are then fully inspected, each in a newly started worker process, the largest unit (file or
+    directory) and randomly selected readable ones. In per_series analysis the files of the sampled
+    directories are grouped into series and the largest series in each directory is inspected.
+    The predictions are:
+    1. Wall time, the sum of the estimated per unit inspection times divided by the number of
+       workers, limited by the number of processors and units, plus the worker start up time.
+    2. Peak memory per worker, the peak resident set size of the worker which inspected the
+       largest unit.
+    3. Output sizes, the csv file size from the sizes of the sampled rows and the uncompressed
+       summary image size from the predicted number of thumbnails.
+    4. Recommended number of processes, limited by the number of processors, units and the
+       physical memory (PLAN_MEMORY_FRACTION of it is used), and the memory budget of a run
+       with that number of processes.
+    Sizes of remote objects and files inside archives are not known, so these do not contribute
+    to the selection of the largest unit. Peak memory is only reported on Linux and macOS.
+
+    Parameters
+    ----------
+    file_names (list(str)): All the files in the directory structure, see get_all_file_names.
+    analysis_type (str): "per_file" or "per_series".
+    max_processes (int): Number of workers for which the wall time is predicted, if None the number
+                         of processors.
+    header_function (callable): Reads the header of a file, inspect_single_file reading only
+                                image information (per_file) or get_series_key_fname (per_series).
+    inspect_function (callable): Inspects a unit, inspect_single_file or inspect_single_series
+                                 with the same settings as the characterization.
+    rng (numpy.random.Generator): Random number generator used for sampling.
+    backend (str): The execution backend of the characterization, see resolve_backend. Affects the
+                   worker start up time and the memory budget, threads share the base memory.
+    thumbnail_settings (dict): Thumbnail settings, see inspect_image.
+    tile_sizes (list(int)): Tile sizes of the summary image, None if it is not created.
+
+    Returns
+    -------
+    dict: The measurements and predictions, sizes in bytes and times in seconds.
+    """
+    import pandas as pd
+
+    def readable(result):
+        # unreadable files return only the file name and sniffed format (per_file) or raise
+        # (per_series)
+        if isinstance(result, dict):
+            return len(set(result) - {"files", SNIFFED_FORMAT_KEY}) > 0
+        return not isinstance(result, Exception)
+
+    def mean(values, default=0.0):
+        return float(np.mean(values)) if len(values) > 0 else default
+
+    def row_bytes(results):
+        df = pd.DataFrame.from_dict(results).drop(
+            columns=["thumbnail", WORKER_TIME_KEY, SNIFFED_FORMAT_KEY], errors="ignore"
+        )
+        return len(df.to_csv(index=False, header=False)) / len(df), df.columns
+
+    start_time = time.perf_counter()
+    backend = resolve_backend(backend, max_processes)
+    sizes = {f: file_size(f) for f in file_names}
+    formats = defaultdict(list)
+    for f in file_names:
+        formats[os.path.splitext(f)[1].lower()].append(f)
+    directories = defaultdict(list)
+    for f in file_names:
+        directories[os.path.dirname(f)].append(f)
+    units = file_names if analysis_type == "per_file" else list(directories)
+
+    def unit_bytes(u):
+        if analysis_type == "per_file":
+            return sizes[u]
+        return sum(sizes[f] for f in directories[u])
+
+    largest_unit = max(units, key=unit_bytes)
+
+    # a worker which only ran a trivial task provides the base memory and start up time
+    worker_start_time = time.perf_counter()
+    _, seconds, base_memory = fresh_worker_task(int)
+    worker_start_seconds = time.perf_counter() - worker_start_time - seconds
+
+    # header samples, all read by the same worker
+    header_samples = {
+        k: [str(f) for f in rng.choice(v, min(len(v), PLAN_HEADER_SAMPLES), False)]
+        for k, v in formats.items()
+    }
+    if analysis_type == "per_series":
+        decode_directories = [largest_unit] + [
+            str(d)
+            for d in rng.choice(
+                [d for d in directories if d != largest_unit],
+                min(len(directories) - 1, PLAN_DECODE_SAMPLES - 1),
+                False,
+            )
+        ]
+        grouped_files = [f for d in decode_directories for f in directories[d]]
+    else:
+        grouped_files = []
+    with process_pool_executor(1) as executor:
+        header_futures = {
+            k: [executor.submit(measured_task, header_function, f) for f in v]
+            for k, v in header_samples.items()
+        }
+        grouping_futures = [
+            executor.submit(measured_task, header_function, f) for f in grouped_files
+        ]
+        header_results = {
+            k: [future.result() for future in v] for k, v in header_futures.items()
+        }
+        grouping_results = [future.result() for future in grouping_futures]
+
+    format_info = {}
+    for k, v in header_results.items():
+        format_info[k] = {
+            "files": len(formats[k]),
+            "bytes": sum(sizes[f] for f in formats[k]),
+            "header samples": len(v),
+            "readable fraction": mean([readable(r) for r, _, _ in v]),
+            "header seconds": mean([s for _, s, _ in v]),
+        }
+
+    # full inspection samples, each in a new worker, (format, largest, unit, unit bytes, result,
+    # seconds, peak memory)
+    decode_results = []
+    if analysis_type == "per_file":
+        for k, v in header_results.items():
+            if not any(readable(r) for r, _, _ in v):
+                continue
+            largest_file = max(formats[k], key=unit_bytes)
+            candidates = [
+                f
+                for f, (r, _, _) in zip(header_samples[k], v)
+                if readable(r) and f != largest_file
+            ]
+            samples = [largest_file] + [
+                str(f)
+                for f in rng.choice(
+                    candidates, min(len(candidates), PLAN_DECODE_SAMPLES - 1), False
+                )
+            ]
+            for i, f in enumerate(samples):
+                decode_results.append(
+                    (k, i == 0, f, unit_bytes(f))
+                    + fresh_worker_task(inspect_function, f)
+                )
+    else:
+        series_per_directory = []
+        for i, d in enumerate(decode_directories):
+            series = defaultdict(list)
+            for f, (r, _, _) in zip(grouped_files, grouping_results):
+                if os.path.dirname(f) == d and readable(r):
+                    series[r[0]].append(f)
+            series_per_directory.append(len(series))
+            if series:
+                series_data = max(series.items(), key=lambda s: len(s[1]))
+                decode_results.append(
+                    (None, i == 0, d, sum(sizes[f] for f in series_data[1]))
+                    + fresh_worker_task(inspect_function, series_data)
+                )
+
+    def inspection_seconds(k):
+        # the largest unit is not representative, the inspection time is estimated from the
+        # randomly selected units if there are any
+        seconds = [r[5] for r in decode_results if r[0] == k and not r[1]]
+        return mean(seconds or [r[5] for r in decode_results if r[0] == k])
+
+    if analysis_type == "per_file":
+        for k, info in format_info.items():
+            info["inspection seconds"] = inspection_seconds(k)
+        # readable files are inspected, for the others inspection fails when reading the header
+        work = sum(
+            info["files"]
+            * (
+                info["readable fraction"] * info["inspection seconds"]
+                + (1 - info["readable fraction"]) * info["header seconds"]
+            )
+            for info in format_info.values()
+        )
+        number_of_images = sum(
+            info["files"] * info["readable fraction"] for info in format_info.values()
+        )
+        unreadable_files = len(file_names) - number_of_images
+    else:
+        # all files are read when grouping them into series, then the series are inspected
+        number_of_images = len(directories) * mean(series_per_directory)
+        work = sum(
+            info["files"] * info["header seconds"] for info in format_info.values()
+        ) + number_of_images * inspection_seconds(None)
+        unreadable_files = sum(
+            info["files"] * (1 - info["readable fraction"])
+            for info in format_info.values()
+        )
+    number_of_units = len(units) if analysis_type == "per_file" else number_of_images
+    workers = max_processes if max_processes else os.cpu_count()
+
+    def wall_time(workers):
+        return work / max(1, min(workers, os.cpu_count(), number_of_units)) + (
+            worker_start_seconds if backend == "process" else 0.0
+        )
+
+    # output sizes, rows of unreadable files only list the file name
+    readable_decodes = [r for r in decode_results if readable(r[4])]
+    csv_bytes = 0.0
+    if readable_decodes:
+        bytes_per_row, columns = row_bytes([r[4] for r in readable_decodes])
+        csv_bytes = len(",".join(columns)) + 1 + number_of_images * bytes_per_row
+        csv_bytes += unreadable_files * (
+            len(columns) + mean([len(str([f])) for f in file_names])
+        )
+    summary_image_bytes = 0
+    if tile_sizes and thumbnail_settings:
+        tiles = tile_sizes[0] * tile_sizes[1]
+        summary_image_bytes = (
+            math.ceil(round(number_of_images) / tiles)
+            * tiles
+            * thumbnail_settings["thumbnail_sizes"][0]
+            * thumbnail_settings["thumbnail_sizes"][1]
+        )
+
+    # memory, the main process holds the results (approximated by the csv size) and thumbnails
+    worker_peak_memory = None
+    recommended_processes = max(1, min(os.cpu_count(), len(units)))
+    memory_budget = None
+    if base_memory is not None:
+        worker_peak_memory = max(
+            [base_memory] + [r[6] for r in decode_results if r[6] is not None]
+        )
+        main_memory = peak_memory() + csv_bytes + summary_image_bytes
+        worker_memory = (
+            worker_peak_memory
+            if backend == "process"
+            else worker_peak_memory - base_memory
+        )
+        total_memory = physical_memory()
+        if total_memory is not None:
+            recommended_processes = max(
+                1,
+                min(
+                    recommended_processes,
+                    int(
+                        (PLAN_MEMORY_FRACTION * total_memory - main_memory)
+                        // max(1, worker_memory)
+                    ),
+                ),
+            )
+        workers_memory = (
+            recommended_processes if backend != "serial" else 0
+        ) * worker_memory
+        memory_budget = int(main_memory + workers_memory)
+
+    return {
+        "analysis type": analysis_type,
+        "backend": backend,
+        "files": len(file_names),
+        "bytes": sum(sizes.values()),
+        "largest unit": largest_unit,
+        "largest unit bytes": unit_bytes(largest_unit),
+        "formats": format_info,
+        "inspection samples": [
+            {
+                "unit": u,
+                "bytes": b,
+                "readable": readable(r),
+                "seconds": s,
+                "peak memory": m,
+            }
+            for _, _, u, b, r, s, m in decode_results
+        ],
+        "predicted images": number_of_images,
+        "worker start up seconds": worker_start_seconds,
+        "worker base memory": base_memory,
+        "peak memory per worker": worker_peak_memory,
+        "max processes": workers,
+        "predicted wall time seconds": wall_time(workers),
+        "predicted csv bytes": int(csv_bytes),
+        "predicted summary image bytes": summary_image_bytes,
+        "recommended processes": recommended_processes,
+        "predicted wall time seconds with recommended processes": wall_time(
+            recommended_processes
+        ),
+        "recommended memory budget": memory_budget,
+        "planning seconds": time.perf_counter() - start_time,
+    }
+
+
+def normalized_file_lists(df):
+    """
+    Replace the lists of files in the "files" column by a series id, and move the files to a file
+    table which refers to their directories via a directory dictionary. A large series lists
+    each directory path once instead of once per file, and the tables are read without
+    evaluating the string representation of Python lists.
+
+    Parameters
+    ----------
+    df (pandas.DataFrame): The characterization results with a "files" column.
+
+    Returns
+    -------
+    tuple(pandas.DataFrame, pandas.DataFrame, pandas.DataFrame): The results with a "series id"
+        column instead of the "files" column, the file table with columns "series id", "directory id"
+        and "file name", the files of a series are listed in their original order, and the directory
+        dictionary with columns "directory id" and "directory", sorted by directory.
+    """
+    import pandas as pd
+
+    df = df.reset_index(drop=True)
+    files = df["files"].explode().astype(str)
+    file_directories = files.map(os.path.dirname)
+    directories = sorted(file_directories.unique())
+    directory_ids = {d: i for i, d in enumerate(directories)}
+    file_table = pd.DataFrame(
+        {
+            "series id": files.index,
+            "directory id": file_directories.map(directory_ids).to_numpy(),
+            "file name": files.map(os.path.basename).to_numpy(),
+        }
+    )
+    df.insert(0, "series id", df.index)
+    return (
+        df.drop(columns="files"),
+        file_table,
+        pd.DataFrame(
+            {"directory id": range(len(directories)), "directory": directories}
+        ),
     )
-    res.SetSpacing([1, 1])
-    res.SetOrigin([0, 0])
-    return res
 
 
 def image_list_to_faux_volume(image_list, tile_size):
@@ -759,6 +4566,375 @@ def image_list_to_faux_volume(image_list, tile_size):
     return sitk.JoinSeries(faux_volume_slices)
 
 
+def scan_directory(root_dir):
+    """
+    Get the size and modification time of all files in the directory structure.
+
+    Parameters
+    ----------
+    root_dir (str): Path to the root of the data directory.
+
+    Returns
+    -------
+    dict(str:tuple(int,int)): Absolute file path:(size, modification time in nanoseconds).
+    """
+    file_stats = {}
+    dir_names = [os.path.abspath(root_dir)]
+    while dir_names:
+        dir_name = dir_names.pop()
+        try:
+            with os.scandir(dir_name) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            dir_names.append(entry.path)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            file_stats[entry.path] = (st.st_size, st.st_mtime_ns)
+                    except OSError:  # file removed while scanning
+                        pass
+        except OSError:  # directory removed while scanning
+            pass
+    return file_stats
+
+
+class DirectoryChangeMonitor:
+    """
+    Report the files that were created or modified in a directory structure since the previous call to
+    changed_files. On Linux the inotify API is used (via ctypes, no additional dependencies), so the cost
+    is proportional to the number of changes. On other platforms, or if inotify is not available (e.g.
+    the limit on the number of watches was reached), the directory structure is polled and the
+    file sizes and modification times are compared to those from the previous poll.
+    """
+
+    # inotify event masks, see inotify(7)
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, root_dir):
+        self.root_dir = os.path.abspath(root_dir)
+        self._inotify_fd = None
+        self._watch_dirs = {}
+        self._snapshot = {}
+        self._full_scan = False
+        if platform.system() == "Linux":
+            try:
+                import ctypes
+                import ctypes.util
+
+                self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+                fd = self._libc.inotify_init1(os.O_NONBLOCK)
+                if fd >= 0:
+                    self._inotify_fd = fd
+                    for dir_name, subdir_names, file_names in os.walk(self.root_dir):
+                        self._add_watch(dir_name)
+            except (OSError, AttributeError):
+                self.close()
+        if self._inotify_fd is None:
+            self._snapshot = scan_directory(self.root_dir)
+
+    def _add_watch(self, dir_name):
+        wd = self._libc.inotify_add_watch(
+            self._inotify_fd, os.fsencode(dir_name), self.WATCH_MASK
+        )
+        if wd < 0:
+            raise OSError(f"inotify_add_watch failed for {dir_name}")
+        self._watch_dirs[wd] = dir_name
+
+    def close(self):
+        if self._inotify_fd is not None:
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+
+    def changed_files(self):
+        """
+        Returns
+        -------
+        set(str): Absolute paths of files created or modified since the previous call. The files may have
+                  been removed since.
+        """
+        if self._inotify_fd is None:
+            snapshot = scan_directory(self.root_dir)
+            changed = set(
+                f for f, st in snapshot.items() if self._snapshot.get(f) != st
+            )
+            self._snapshot = snapshot
+            return changed
+        changed = set()
+        new_dirs = []
+        while True:
+            try:
+                data = os.read(self._inotify_fd, 1 << 16)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, name_len = np.frombuffer(
+                    data, dtype=np.uint32, count=4, offset=offset
+                )
+                name = (
+                    data[offset + 16 : offset + 16 + int(name_len)]
+                    .rstrip(b"\0")
+                    .decode(errors="surrogateescape")
+                )
+                offset += 16 + int(name_len)
+                if mask & self.IN_Q_OVERFLOW:
+                    self._full_scan = True
+                elif int(wd) in self._watch_dirs:
+                    path = os.path.join(self._watch_dirs[int(wd)], name)
+                    if mask & self.IN_ISDIR:
+                        new_dirs.append(path)
+                    else:
+                        changed.add(path)
+        # watch new directories and report the files they already contain, they may have been
+        # created before the watch was added (e.g. directory moved into the watched structure).
+        for new_dir in new_dirs:
+            for dir_name, subdir_names, file_names in os.walk(new_dir):
+                try:
+                    self._add_watch(dir_name)
+                except OSError:
+                    self._full_scan = True
+                changed.update([os.path.join(dir_name, f) for f in file_names])
+        # events were lost, report all files
+        if self._full_scan:
+            self._full_scan = False
+            changed.update(scan_directory(self.root_dir).keys())
+        return changed
+
+
+def append_thumbnails_to_summary_image(
+    summary_image_file_name, thumbnails, start_index, tile_size
+):
+    """
+    Add thumbnails to a summary image that is stored on disk as a NRRD file with a detached header
+    (summary_image_file_name.nhdr, summary_image_file_name.raw). The thumbnails are written in place,
+    at the tile locations corresponding to start_index, start_index+1..., so that the summary image is
+    updated incrementally without reading or rewriting the existing content. The layout is the same as
+    the one created by image_list_to_faux_volume.
+
+    Parameters
+    ----------
+    summary_image_file_name (str): File name without extension.
+    thumbnails (list[SimpleITK.Image]): List of 2D sitkUInt8 images all with the same size.
+    start_index (int): Index of the first thumbnail in the summary image.
+    tile_size([int,int]): The number of images in x and y in each summary image slice.
+    """
+    if not thumbnails:
+        return
+    thumbnail_size = thumbnails[0].GetSize()
+    slice_size = [t * s for t, s in zip(thumbnail_size, tile_size)]
+    images_per_slice = tile_size[0] * tile_size[1]
+    raw_file_name = summary_image_file_name + ".raw"
+    number_of_slices = (
+        start_index + len(thumbnails) + images_per_slice - 1
+    ) // images_per_slice
+    with open(raw_file_name, "ab"):  # create the file if it does not exist
+        pass
+    with open(raw_file_name, "r+b") as fp:
+        # extend file with zeros (background) to the required number of slices
+        fp.truncate(number_of_slices * slice_size[0] * slice_size[1])
+        for i, thumbnail in enumerate(thumbnails, start_index):
+            z, index_in_slice = divmod(i, images_per_slice)
+            y, x = divmod(index_in_slice, tile_size[0])
+            arr = sitk.GetArrayViewFromImage(thumbnail)
+            for row in range(arr.shape[0]):
+                fp.seek(
+                    (z * slice_size[1] + y * thumbnail_size[1] + row) * slice_size[0]
+                    + x * thumbnail_size[0]
+                )
+                fp.write(arr[row].tobytes())
+    with open(summary_image_file_name + ".nhdr", "w") as fp:
+        fp.write(
+            "NRRD0004\n"
+            "type: unsigned char\n"
+            "dimension: 3\n"
+            f"sizes: {slice_size[0]} {slice_size[1]} {number_of_slices}\n"
+            "encoding: raw\n"
+            f"data file: {os.path.basename(raw_file_name)}\n"
+        )
+
+
+def watch_directory(
+    root_dir,
+    output_file,
+    analysis_type,
+    inspection_function,
+    columns,
+    polling_interval,
+    quiescence_period,
+    tile_sizes=None,
+    ignore_problems=False,
+    float_format=None,
+    max_polls=None,
+):
+    """
+    Continuously characterize the new and modified files in a directory structure, appending the
+    results to the output csv file and thumbnails to the summary image. A file is characterized
+    once its size and modification time did not change for quiescence_period seconds. In per_series
+    analysis, the unit of change is the directory, a directory is characterized once all of its new or
+    modified files are quiescent, and all series with files in the directory are re-inspected with
+    the new files. A series whose files are spread across multiple directories is only combined into
+    a single image if all of its directories are characterized in the same batch. The latency from the
+    arrival of a file to the corresponding row in the output is bounded by
+    polling_interval + quiescence_period + the inspection time.
+
+    If the output csv file exists, files it lists and which were not modified after it was last
+    written are not characterized again, so that watching can be resumed.
+
+    Parameters
+    ----------
+    root_dir (str): Path to the root of the data directory.
+    output_file (str): Output csv file path, results are appended.
+    analysis_type (str): "per_file" or "per_series".
+    inspection_function (callable): Either inspect_files or inspect_series with all parameters
+                                    set except for file_names.
+    columns (list(str)): Columns of the output csv, used if it does not exist.
+    polling_interval (float): Time in seconds between checks for changes.
+    quiescence_period (float): Time in seconds without changes before a file is characterized.
+    tile_sizes ([int, int]): If given, the thumbnails are added to the summary image
+                             (output_file prefix + "_summary_image.nhdr/raw").
+    ignore_problems (bool): Do not report problematic files/series.
+    float_format (str): Format string for floating point numbers in the output csv.
+    max_polls (int): Stop after this number of polls, if None, run until interrupted.
+    """
+    import pandas as pd
+
+    processed = {}
+    number_of_thumbnails = 0
+    if os.path.exists(output_file):
+        existing_df = pd.read_csv(output_file)
+        columns = existing_df.columns.to_list()
+        output_time = os.stat(output_file).st_mtime_ns
+        for file_names in existing_df["files"]:
+            for f in ast.literal_eval(file_names):
+                f = split_archive_member_path(f)[0]
+                try:
+                    st = os.stat(f)
+                    if st.st_mtime_ns <= output_time:
+                        processed[f] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    pass
+        if tile_sizes and "pixel type" in columns:
+            number_of_thumbnails = int(existing_df["pixel type"].notna().sum())
+    summary_image_file_name = f"{os.path.splitext(output_file)[0]}_summary_image"
+
+    monitor = DirectoryChangeMonitor(root_dir)
+    # all existing files are candidates at startup
+    candidates = set(get_all_file_names(root_dir))
+    pending = {}
+    polls = 0
+    try:
+        while True:
+            now = time.monotonic()
+            for f in candidates | set(pending.keys()):
+                try:
+                    st = os.stat(f)
+                except OSError:  # file removed
+                    pending.pop(f, None)
+                    continue
+                signature = (st.st_size, st.st_mtime_ns)
+                if processed.get(f) == signature:
+                    pending.pop(f, None)
+                elif f not in pending or pending[f][0] != signature:
+                    pending[f] = (signature, now)
+            ready = set(
+                f for f, (s, t) in pending.items() if now - t >= quiescence_period
+            )
+            if analysis_type == "per_series":
+                # a directory is ready when all of its pending files are ready, and all of its
+                # files are re-inspected.
+                not_ready_dirs = set(os.path.dirname(f) for f in pending.keys() - ready)
+                ready_dirs = set(os.path.dirname(f) for f in ready) - not_ready_dirs
+                ready = set(f for f in ready if os.path.dirname(f) in ready_dirs)
+                batch = []
+                for d in sorted(ready_dirs):
+                    try:
+                        dir_file_names = os.listdir(d)
+                    except FileNotFoundError:  # directory removed or moved
+                        continue
+                    batch.extend(
+                        os.path.join(d, f)
+                        for f in dir_file_names
+                        if os.path.isfile(os.path.join(d, f))
+                    )
+            else:
+                batch = sorted(ready)
+            if batch:
+                df = inspection_function(file_names=batch)
+                if analysis_type == "per_series" and not df.empty:
+                    # only report series that include new or modified files
+                    df = df[
+                        df["files"].apply(
+                            lambda x: not ready.isdisjoint(
+                                [split_archive_member_path(f)[0] for f in x]
+                            )
+                        )
+                    ]
+                if ignore_problems and not df.empty:
+                    df = df.dropna(thresh=2)
+                if tile_sizes and "thumbnail" in df.columns:
+                    thumbnails = df["thumbnail"].dropna().to_list()
+                    append_thumbnails_to_summary_image(
+                        summary_image_file_name,
+                        thumbnails,
+                        number_of_thumbnails,
+                        tile_sizes,
+                    )
+                    number_of_thumbnails += len(thumbnails)
+                if not df.empty:
+                    df.reindex(columns=columns).to_csv(
+                        output_file,
+                        mode="a",
+                        header=not os.path.exists(output_file),
+                        index=False,
+                        float_format=float_format,
+                    )
+                for f in ready:
+                    processed[f] = pending.pop(f)[0]
+            polls += 1
+            if max_polls is not None and polls >= max_polls:
+                break
+            time.sleep(polling_interval)
+            candidates = monitor.changed_files()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.close()
+
+
+def save_settings(settings, output_dir):
+    """
+    Save the configuration used in the analysis to a JSON configuration file
+    with date-time prefix. The positional parameters and configuration file
+    are not included. Enables reproducibility and consistent usage of user
+    preferences across script invocations.
+
+    Parameters
+    ----------
+    settings (dict): All parameter settings, as parsed by the argument parser.
+    output_dir (str): Directory in which the JSON file is saved.
+    """
+    settings = dict(settings)
+    with open(
+        os.path.join(
+            output_dir,
+            time.strftime("%d_%m_%Y-%H_%M_%S_") + "characterize_data_settings.json",
+        ),
+        "w",
+    ) as fp:
+        del settings["configuration_file"]
+        del settings["root_of_data_directory"]
+        del settings["output_file"]
+        del settings["analysis_type"]
+        json.dump(settings, fp, indent=2)
+
+
 def characterize_data(argv=None):
     """
     This script inspects/characterizes images in a given directory structure. It
@@ -800,6 +4976,99 @@ def characterize_data(argv=None):
        it is converted to 2D via maximum intensity projection along a user specified axis. To
        retain the original image's aspect ratio it is resized and padded to fit in the user
        specified thumbnail size image.
+    9. A flag indicating whether to detect near duplicate images, and the maximal Hamming distance between
+       the perceptual hashes of near duplicates. The 64 bit perceptual hash is computed from the image
+       thumbnail (see 8) so it is robust to re-encoding, small intensity changes and resizing.
+    10. Sample size for a quick characterization of a stratified random sample of the data instead of
+       the whole dataset, and the seed used for sampling. See the "Sampling" section below.
+    11. A flag indicating that the directory should be watched continuously, and the polling and
+       quiescence intervals. See the "Watch mode" section below.
+    12. A flag indicating that the files inside zip and tar archives should be inspected. Members are
+       read one at a time, extracted to a temporary file on a memory backed file system when available
+       (/dev/shm), and are listed in the csv file using archive-qualified paths, the archive path followed
+       by "!/" and the path inside the archive (e.g. /data/study.zip!/series1/image1.dcm). Reading members
+       of compressed tar archives (e.g. tar.gz) requires decompressing the archive up to the member, so
+       zip or uncompressed tar archives are more efficient.
+    13. A flag indicating that DICOMDIR files (DICOM media storage directory, e.g. CD/DVD exports) should
+       be used in per_series analysis to identify the series of the files they reference, without reading
+       these files. Only files that are not referenced by a DICOMDIR are read to identify their series.
+       DICOMDIR records only include a subset of the DICOM tags, additional series tags (see 3) that
+       are not included in the image record or its ancestor records are treated as missing. A DICOMDIR
+       that is invalid or references missing files is ignored.
+    14. A flag indicating that in per_series analysis the series inspection should be pipelined with the
+       grouping of files into series. By default all files are grouped into series before any series is
+       inspected. When pipelined, the directory structure is traversed one directory at a time and a series
+       whose files were only found in a single directory is inspected as soon as all files in that directory
+       were grouped. Series with files in multiple directories are inspected at the end, and a series that
+       gains files after it was inspected is inspected again, so the results are the same. This reduces the
+       time to the first results and keeps all processes busy on large directory structures.
+    15. The layout of the image geometry columns in the csv file. By default the image size, spacing, origin
+       and axis direction are each reported as a tuple in a single column ("tuples"). With the "columns"
+       layout each component is reported in a separate numeric column ("image size x", ..., "image spacing x",
+       ..., "image origin x", ..., "axis direction 0" to "axis direction 8", the row-major 3x3 direction
+       matrix) and the "image dimension" column. 2D images are embedded in 3D, z size and spacing of one, z
+       origin of zero and a direction matrix with the z axis added. The numeric layout is more compact
+       and easier to analyze (e.g. df["image size x"].describe()) for large datasets.
+    16. A flag indicating that intensity distribution statistics should be reported for scalar images: the
+       1, 5, 25, 50, 75, 95 and 99 percentiles, the entropy (bits), the mode and the fractions of zero valued
+       pixels and of pixels with the maximal value of the pixel type (saturated, integer pixel types only).
+       These are computed from a single intensity histogram, exactly for integer images whose intensity
+       range is at most 2^20 values, otherwise from a histogram with 2^16 bins (e.g. float images).
+    17. A flag indicating that the thumbnails should be returned from the worker processes via shared memory
+       slots instead of being pickled, reducing the work done by the main process when many processes
+       create thumbnails. The number of tasks in flight is limited to four per process. Not used by the
+       pipelined per_series analysis.
+    18. A metrics file for monitoring long running, headless, runs. The file is rewritten atomically every
+       few seconds with the current phase, the number of completed, in flight and failed tasks, the files
+       and bytes per second, the utilization of each worker process and the estimated time to completion.
+       A file with the .prom extension is written in the Prometheus text format (e.g. for the node exporter
+       textfile collector), otherwise in JSON format.
+    19. The groups of columns to report, by default all of them: "geometry" (image size, spacing, origin and
+       axis direction), "pixel type", "hash" (intensity hash), "statistics" (min, max, mean and std
+       intensity) and "meta data" (the values of the metadata_keys). Only the work required for the selected
+       columns is done. In the per_file analysis, when neither the hash nor the statistics are requested and
+       no thumbnails are created, only the image headers are read, which is considerably faster. The
+       duplicate detection requires the hash and the scatterplots require the geometry and statistics, these
+       are skipped when the columns are not reported.
+    20. A flag indicating that in the per_series analysis each series is inspected one slice at a time instead
+       of reading the whole volume, the memory used is bounded by a few slices instead of the volume size
+       (e.g. large CT series inspected by many processes). The intensity statistics, hash and maximum
+       intensity projection are updated with every slice, the histogram statistics of float images and of
+       integer images with a large intensity range require reading the slices twice. The reported values
+       are the same, except for the last digits of the mean and std, and the slice spacing of non-uniformly
+       spaced series is the average spacing, as when reading the volume. Series of multi-frame or
+       multi-channel files are read as a volume.
+    21. The execution backend: worker processes ("process", the default), worker threads ("thread"), serial
+       execution in the main process ("serial", for debugging and profiling) or an automatic choice ("auto").
+       Reading images, ITK filters, hashing and most numpy operations release the GIL, so threads run the
+       inspection concurrently while avoiding the worker start up cost and the pickling of the results,
+       which are significant with the spawn start method (macOS, Windows). The automatic choice runs
+       serially with a single worker, uses processes with the fork start method or shared thumbnails, and
+       threads otherwise.
+    22. A flag indicating that the data is not characterized, instead a plan for characterizing it is created
+       (see Planning below).
+    23. The layout of the file lists in the per_series analysis, "inline" (default) or "normalized". Inline,
+       the "files" column contains the list of files of each series. Normalized, the "files" column is
+       replaced by a "series id" column and the files are listed in a separate csv file (postfix "_files.csv",
+       columns "series id", "directory id", "file name") whose directories are listed once in a directory
+       dictionary (postfix "_directories.csv", columns "directory id", "directory"). The duplicates reports
+       also refer to the series ids.
+    24. A flag indicating that in the per_file analysis, when all the image IOs are used, each file's format is
+       identified from its first bytes (magic numbers, DICOM preamble, NRRD, MetaImage and NIfTI headers) and
+       it is read by the corresponding image IO, instead of ITK probing all the registered image IOs. Files that
+       are not identified as images are not read. The number of files per identified format and how many of
+       them were read are printed at the end. Files in formats without a magic number (e.g. GE4) are not read.
+    25. The number of upcoming files (per_file) or series (per_series) per worker whose data is read ahead into
+       the page cache while the workers inspect the current ones, and the maximal amount of data read ahead.
+       On storage with a high first byte latency (e.g. network file systems) the workers then find the data
+       already cached. The number of files read ahead and the page cache hit rate (fraction of files whose
+       beginning was cached when their inspection started, Linux only) are printed at the end. Only local
+       files are read ahead, and not in the pipelined per_series analysis.
+    26. The algorithm used for the intensity hash, MD5 by default. SHA-1 and SHA-256 are considerably faster on
+       processors with SHA instructions, xxh3_128 (xxhash package) and blake3 (blake3 package) are faster
+       still. The hash column is named after the algorithm (e.g. "SHA256 intensity hash"), so duplicates are
+       identified using the hashes of the same algorithm when combining the results of multiple runs. In the
+       streamed per_series analysis the hash is computed one slice at a time, giving the same value.
 
     Examples:
     --------
@@ -850,6 +5119,10 @@ def characterize_data(argv=None):
            along the z axis is encoded using color.
         4. Possibly a csv file listing exact duplicate images, if any. Images are considered duplicates if
            the intensity values are the same, header and spatial information may be different.
+        5. Possibly a csv file listing near duplicate images, if requested and any were found. Images are
+           near duplicates if the Hamming distance between their perceptual hashes is small. Each group is
+           identified by the "near duplicate group" column. Groups in which all images are exact duplicates
+           are not listed, they are already included in the exact duplicates csv file.
 
     Empty lines in the resulting csv file (file names listed but nothing else in that row)
     occur when SimpleITK cannot read the file or set of files when dealing with a series.
@@ -893,6 +5166,62 @@ def characterize_data(argv=None):
     tile_size =
     print(df["files"].iloc[xyz_to_index(x, y, z, thumbnail_size, tile_size)])
 
+    Sampling:
+    --------
+    When the --sample option is given, only a stratified random sample of the data is characterized,
+    providing a quick estimate before committing resources to a full run. In per_file analysis the sample
+    is of files, stratified by directory and file extension. In per_series analysis the sample is of
+    directories, stratified by parent directory, and all series found in the sampled directories are
+    inspected (a series whose files are spread across multiple directories is only partially inspected,
+    use a larger sample or a full run if this is the common layout). The output csv file includes a
+    "sample weight" column, the number of units in the population represented by the row's unit, and an
+    additional csv file (postfix "_sample_estimates.csv") with the estimated dataset characteristics and their
+    95% confidence intervals: fraction of readable units, distribution of pixel types and metadata values,
+    mean image size, spacing and file size, number of images, and the projected run time of a full run
+    using the same number of processes. The sampling seed is recorded in the settings JSON file so that
+    the sample can be reproduced. The sample is selected while the directory structure is traversed, and
+    the memory used depends on the sample size and number of strata, not on the number of files. Only the
+    selected files are read, but the whole directory structure is still listed, so the time it takes
+    to select a sample grows linearly with the number of files (for object stores, with the number of
+    listing requests).
+
+    Planning:
+    --------
+    When the --plan option is given, the directory structure is enumerated and the resources required to
+    characterize it with the given settings are predicted, without characterizing it. For each format (file
+    extension) a random sample of file headers is read and a few files are fully inspected, the largest one
+    and randomly selected readable ones, each in a newly started worker process (per_series, the largest
+    series in a few directories, including the largest directory). The predictions, predicted wall time
+    for --max_processes, peak memory per worker, csv and uncompressed summary image sizes, and the
+    recommended number of processes (limited by the number of processors and the physical memory) and
+    memory budget, are printed and written to a JSON file (postfix "_plan.json"), together with the
+    per format measurements. The predictions are extrapolated from a small sample, treat them as order
+    of magnitude estimates. Peak memory is only measured on Linux and macOS.
+
+    Watch mode:
+    ----------
+    When the --watch option is given, the script runs until interrupted (Ctrl-C) and characterizes new
+    or modified files as they arrive (e.g. a landing directory for data exported from a PACS). Changes
+    are detected using inotify on Linux and by polling the directory structure on other platforms. A file
+    is characterized once it has not changed for --watch_quiescence seconds, in per_series analysis once all
+    new or modified files in its directory have not changed, and all series in that directory are
+    re-inspected. Results are appended to the output csv file (the most recent row for a file or series
+    supersedes earlier ones), and thumbnails are appended to a summary image stored as a NRRD file with a
+    detached header (postfix "_summary_image.nhdr" and "_summary_image.raw"). Restarting with the same
+    output csv file resumes watching, files already listed in it are not characterized again. The
+    duplicates report and the scatterplots are not created in watch mode, run a regular
+    characterization on the accumulated data for these.
+
+    Object stores:
+    -------------
+    The root of the data directory can be an fsspec URL (https://filesystem-spec.readthedocs.io),
+    for example s3://bucket/data for an S3 compatible object store (requires the fsspec and s3fs
+    packages, credentials and endpoint are configured as usual for s3fs, e.g. environment variables).
+    Objects are copied on demand into a local read-through cache (--cache_directory), using concurrent
+    byte range requests for large objects. When grouping files into series (per_series), only the
+    beginning of each object is read to obtain the DICOM header. The cache is not cleared by the
+    script, objects that were modified in the store are read again.
+
     Caveats:
     --------
     When characterizing a set of DICOM images, start by running the script in per_file
@@ -910,8 +5239,10 @@ def characterize_data(argv=None):
     spreadsheet applications. The limit for Microsoft Excel is 32,767 characters and for
     Google Sheets it is 50,000 characters. When opened with Excel, the contents of the cell are
     truncated and this will corrupt the column layout. The data itself is valid and can be read
-    correctly using Python or R.
+    correctly using Python or R. Use the normalized file list layout (--file_list_layout) to avoid this.
     """
+    import pandas as pd
+
     # Maximal number of points for which scatterplots are saved in pdf format,
     # otherwise png. Threshold was deterimined empirically based on rendering
     # times longer than 10sec on a 2020 MacBook Pro (1.4GHz Quad core Intel i5
@@ -933,7 +5264,7 @@ def characterize_data(argv=None):
         "--max_processes",
         type=positive_int,
         default=2,
-        help="maximal number of parallel processes",
+        help="maximal number of parallel processes, or threads (see --backend)",
     )
     opt_arg_parser.add_argument(
         "--disable_tqdm",
@@ -964,6 +5295,16 @@ def characterize_data(argv=None):
         help="tags used to uniquely identify image files that "
         "belong to the same DICOM series, these are in addition to 0020|000e, series instance UID, and 0020|000d, study Instance UID",
     )
+    opt_arg_parser.add_argument(
+        "--use_dicomdir",
+        action="store_true",
+        help="per_series analysis, identify the series of files referenced by DICOMDIR files without reading the referenced files",
+    )
+    opt_arg_parser.add_argument(
+        "--pipeline_series",
+        action="store_true",
+        help="per_series analysis, inspect the series found in a directory while the files in other directories are still being grouped into series",
+    )
     # query SimpleITK for the list of registered ImageIO types
     opt_arg_parser.add_argument(
         "--imageIO",
@@ -1032,6 +5373,134 @@ def characterize_data(argv=None):
         default="sitkNearestNeighbor",
         help="SimpleITK interpolator used to resize images when creating summary image",
     )
+    opt_arg_parser.add_argument(
+        "--near_duplicates",
+        action="store_true",
+        help="detect near duplicate images using a perceptual hash computed from the image thumbnail",
+    )
+    opt_arg_parser.add_argument(
+        "--near_duplicate_distance",
+        type=int,
+        default=4,
+        help=f"maximal Hamming distance, in [0,{MAX_NEAR_DUPLICATE_DISTANCE}], between the 64 bit perceptual hashes of near duplicate images",
+    )
+    opt_arg_parser.add_argument(
+        "--sample",
+        type=positive_int,
+        default=None,
+        help="characterize a stratified random sample of this many files (per_file) or directories (per_series) and estimate the characteristics of the whole dataset",
+    )
+    opt_arg_parser.add_argument(
+        "--sample_seed",
+        type=int,
+        default=None,
+        help="seed for the random sample, if not given a seed is generated and recorded in the settings JSON file",
+    )
+    opt_arg_parser.add_argument(
+        "--plan",
+        action="store_true",
+        help='do not characterize the data, predict the run time for max_processes, peak memory per worker and output sizes from a sample of headers and full inspections per format, and recommend the number of processes and memory budget (postfix "_plan.json")',
+    )
+    opt_arg_parser.add_argument(
+        "--geometry_layout",
+        choices=["tuples", "columns"],
+        default="tuples",
+        help="report the image size, spacing, origin and axis direction as tuples, or as separate numeric columns (x, y, z components, 2D images are embedded in 3D)",
+    )
+    opt_arg_parser.add_argument(
+        "--backend",
+        choices=EXECUTION_BACKENDS,
+        default="process",
+        help="run the inspection in worker processes, worker threads (image reading and ITK filters release the GIL), serially in the main process for debugging, or choose automatically based on the platform",
+    )
+    opt_arg_parser.add_argument(
+        "--process_start_method",
+        choices=multiprocessing.get_all_start_methods(),
+        default=None,
+        help="method used to start the worker processes, if not given the platform's default method is used",
+    )
+    opt_arg_parser.add_argument(
+        "--shared_thumbnails",
+        action="store_true",
+        help="return the thumbnails from the worker processes via shared memory instead of pickling them",
+    )
+    opt_arg_parser.add_argument(
+        "--columns",
+        nargs="+",
+        choices=OUTPUT_COLUMN_GROUPS,
+        default=OUTPUT_COLUMN_GROUPS,
+        help="report only these groups of columns, doing only the work they require (e.g. only reading the image headers for geometry, pixel type and meta data)",
+    )
+    opt_arg_parser.add_argument(
+        "--intensity_hash",
+        choices=INTENSITY_HASH_ALGORITHMS,
+        default="md5",
+        help="algorithm used for the intensity hash, xxh3_128 and blake3 require the xxhash and blake3 packages",
+    )
+    opt_arg_parser.add_argument(
+        "--read_ahead_files",
+        type=non_negative_int,
+        default=0,
+        help="number of upcoming files (per_file) or series (per_series) per worker read ahead into the page cache, hiding the latency of network storage, 0 disables read-ahead",
+    )
+    opt_arg_parser.add_argument(
+        "--read_ahead_megabytes",
+        type=positive_int,
+        default=256,
+        help="maximal amount of data read ahead and not yet inspected, in megabytes",
+    )
+    opt_arg_parser.add_argument(
+        "--sniff_formats",
+        action="store_true",
+        help="in the per_file analysis with all image IOs (--imageIO All), identify each file's image IO from its first bytes and skip files which are not images without reading them, printing the number of files per format",
+    )
+    opt_arg_parser.add_argument(
+        "--file_list_layout",
+        choices=["inline", "normalized"],
+        default="inline",
+        help='in the per_series analysis, list the files of each series in the "files" column, or in separate file and directory tables referring to a "series id" column',
+    )
+    opt_arg_parser.add_argument(
+        "--stream_series",
+        action="store_true",
+        help="in the per_series analysis, inspect each series one slice at a time instead of reading the whole volume, bounding the memory used by large series",
+    )
+    opt_arg_parser.add_argument(
+        "--metrics_file",
+        help="periodically write throughput, in flight, failure, worker utilization and ETA metrics to this file, Prometheus text format if the extension is .prom, otherwise JSON",
+    )
+    opt_arg_parser.add_argument(
+        "--histogram_statistics",
+        action="store_true",
+        help="report intensity percentiles, entropy, mode and the fractions of zero and saturated pixels for scalar images, computed from a single intensity histogram",
+    )
+    opt_arg_parser.add_argument(
+        "--inspect_archives",
+        action="store_true",
+        help="inspect the files inside zip and tar archives without extracting the archives to disk",
+    )
+    opt_arg_parser.add_argument(
+        "--cache_directory",
+        default=os.path.join(tempfile.gettempdir(), "characterize_data_cache"),
+        help="local read-through cache directory for data read from object stores or other remote storage (URL root directory)",
+    )
+    opt_arg_parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="continuously characterize new and modified files, appending to the output, until interrupted (Ctrl-C)",
+    )
+    opt_arg_parser.add_argument(
+        "--watch_interval",
+        type=positive_float,
+        default=10.0,
+        help="in watch mode, time in seconds between checks for new or modified files",
+    )
+    opt_arg_parser.add_argument(
+        "--watch_quiescence",
+        type=positive_float,
+        default=30.0,
+        help="in watch mode, time in seconds a file must remain unchanged before it is characterized",
+    )
     opt_arg_parser.add_argument(
         "--float_precision",
         type=positive_int,
@@ -1049,8 +5518,8 @@ def characterize_data(argv=None):
     )
     parser.add_argument(
         "root_of_data_directory",
-        type=dir_path,
-        help="path to the topmost directory containing data",
+        type=dir_path_or_url,
+        help="path to the topmost directory containing data, or an fsspec URL (e.g. s3://bucket/data)",
     )
     parser.add_argument("output_file", type=file_path, help="output csv file path")
     parser.add_argument(
@@ -1093,6 +5562,50 @@ def characterize_data(argv=None):
             "Number of metadata keys and their headings do not match.", file=sys.stderr
         )
         return 1
+    if args.watch and args.sample:
+        print("Watch mode and sampling cannot be combined.", file=sys.stderr)
+        return 1
+    if args.watch and args.plan:
+        print("Watch mode and planning cannot be combined.", file=sys.stderr)
+        return 1
+    if args.file_list_layout == "normalized" and (
+        args.watch or args.analysis_type == "per_file"
+    ):
+        print(
+            "The normalized file list layout is only supported in the per_series analysis and not in watch mode.",
+            file=sys.stderr,
+        )
+        return 1
+    try:
+        intensity_hasher(args.intensity_hash)
+    except ImportError as e:
+        print(
+            f"The {args.intensity_hash} intensity hash requires the {e.name} package.",
+            file=sys.stderr,
+        )
+        return 1
+    if args.watch and is_url(args.root_of_data_directory):
+        print("Watch mode is only supported for local directories.", file=sys.stderr)
+        return 1
+    # the cache directory is communicated to the worker processes via the environment
+    os.environ[CACHE_DIRECTORY_ENV] = args.cache_directory
+    if (
+        args.near_duplicates
+        and not 0 <= args.near_duplicate_distance <= MAX_NEAR_DUPLICATE_DISTANCE
+    ):
+        print(
+            f"Near duplicate distance is expected to be in [0,{MAX_NEAR_DUPLICATE_DISTANCE}].",
+            file=sys.stderr,
+        )
+        return 1
+    if args.near_duplicates and (
+        args.thumbnail_sizes[0] < 9 or args.thumbnail_sizes[1] < 8
+    ):
+        print(
+            "Near duplicate detection requires thumbnail sizes of at least 9x8.",
+            file=sys.stderr,
+        )
+        return 1
 
     # This script uses concurrent.futures ProcessPoolExecutor for parallel processing at
     # the process level. ITK filters implement concurrency at the thread level.
@@ -1101,14 +5614,31 @@ def characterize_data(argv=None):
     # system if it has less than NM cores. We therefor configure SimpleITK to work
     # in a single threaded fashion and only use process level parallelization.
     sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(1)
+    # The worker processes are initialized with this configuration, see process_pool_executor,
+    # worker threads share it.
+    if args.process_start_method:
+        multiprocessing.set_start_method(args.process_start_method, force=True)
 
     thumbnail_settings = {}
-    if args.create_summary_image:
+    if args.create_summary_image or args.near_duplicates:
         thumbnail_settings["thumbnail_sizes"] = args.thumbnail_sizes
         thumbnail_settings["projection_axis"] = args.projection_axis
         thumbnail_settings["interpolator"] = args.interpolator
+    file_names = None
+    if args.sample:
+        if args.sample_seed is None:
+            args.sample_seed = np.random.SeedSequence().entropy
+            save_dict["sample_seed"] = args.sample_seed
+        # the sample is selected while the directory structure is traversed
+        file_names, sample_info = stratified_sample(
+            iter_all_file_names(args.root_of_data_directory, args.inspect_archives),
+            args.analysis_type,
+            args.sample,
+            np.random.default_rng(args.sample_seed),
+        )
     if args.analysis_type == "per_file":
-        df = inspect_files(
+        inspection_function = partial(
+            inspect_files,
             args.root_of_data_directory,
             args.max_processes,
             args.disable_tqdm,
@@ -1118,9 +5648,21 @@ def characterize_data(argv=None):
                 zip(args.external_applications_headings, args.external_applications)
             ),
             thumbnail_settings=thumbnail_settings,
+            inspect_archives=args.inspect_archives,
+            geometry_layout=args.geometry_layout,
+            histogram_statistics=args.histogram_statistics,
+            shared_thumbnails=args.shared_thumbnails,
+            metrics_file=args.metrics_file,
+            columns=args.columns,
+            backend=args.backend,
+            sniff_formats=args.sniff_formats,
+            read_ahead_files=args.read_ahead_files,
+            read_ahead_bytes=args.read_ahead_megabytes << 20,
+            intensity_hash=args.intensity_hash,
         )
     elif args.analysis_type == "per_series":
-        df = inspect_series(
+        inspection_function = partial(
+            inspect_series,
             args.root_of_data_directory,
             args.max_processes,
             args.disable_tqdm,
@@ -1135,7 +5677,146 @@ def characterize_data(argv=None):
             ),
             meta_data_info=dict(zip(args.metadata_keys_headings, args.metadata_keys)),
             thumbnail_settings=thumbnail_settings,
+            inspect_archives=args.inspect_archives,
+            use_dicomdir=args.use_dicomdir,
+            pipeline=args.pipeline_series,
+            geometry_layout=args.geometry_layout,
+            histogram_statistics=args.histogram_statistics,
+            shared_thumbnails=args.shared_thumbnails,
+            metrics_file=args.metrics_file,
+            columns=args.columns,
+            stream=args.stream_series,
+            backend=args.backend,
+            read_ahead_files=args.read_ahead_files,
+            read_ahead_bytes=args.read_ahead_megabytes << 20,
+            intensity_hash=args.intensity_hash,
+        )
+    if args.plan:
+        if args.sample_seed is None:
+            args.sample_seed = np.random.SeedSequence().entropy
+        all_file_names = get_all_file_names(
+            args.root_of_data_directory, args.inspect_archives
+        )
+        if not all_file_names:
+            print(
+                f"No plan created, no files found in root directory ({args.root_of_data_directory})"
+            )
+            return 0
+        if args.analysis_type == "per_file":
+            header_function = partial(
+                inspect_single_file,
+                imageIO=args.imageIO,
+                columns=["geometry", "pixel type"],
+                sniff_formats=args.sniff_formats,
+            )
+            inspect_function = partial(
+                inspect_single_file,
+                **{
+                    k: v
+                    for k, v in inspection_function.keywords.items()
+                    if k
+                    in [
+                        "imageIO",
+                        "meta_data_info",
+                        "external_programs_info",
+                        "thumbnail_settings",
+                        "geometry_layout",
+                        "histogram_statistics",
+                        "columns",
+                        "sniff_formats",
+                        "intensity_hash",
+                    ]
+                },
+            )
+        else:
+            header_function = partial(
+                get_series_key_fname,
+                additional_series_tags=inspection_function.keywords[
+                    "additional_series_tags"
+                ],
+            )
+            inspect_function = partial(
+                inspect_single_series,
+                **{
+                    k: v
+                    for k, v in inspection_function.keywords.items()
+                    if k
+                    in [
+                        "meta_data_info",
+                        "thumbnail_settings",
+                        "geometry_layout",
+                        "histogram_statistics",
+                        "columns",
+                        "stream",
+                        "intensity_hash",
+                    ]
+                },
+            )
+        plan = plan_characterization(
+            all_file_names,
+            args.analysis_type,
+            args.max_processes,
+            header_function,
+            inspect_function,
+            np.random.default_rng(args.sample_seed),
+            backend=args.backend,
+            thumbnail_settings=thumbnail_settings,
+            tile_sizes=args.tile_sizes if args.create_summary_image else None,
+        )
+        plan["seed"] = args.sample_seed
+        dirname = os.path.dirname(args.output_file)
+        os.makedirs(dirname if dirname else ".", exist_ok=True)
+        with open(f"{os.path.splitext(args.output_file)[0]}_plan.json", "w") as fp:
+            json.dump(plan, fp, indent=2)
+        for k in [
+            "files",
+            "predicted images",
+            "max processes",
+            "predicted wall time seconds",
+            "peak memory per worker",
+            "predicted csv bytes",
+            "predicted summary image bytes",
+            "recommended processes",
+            "predicted wall time seconds with recommended processes",
+            "recommended memory budget",
+        ]:
+            print(f"{k}: {plan[k]}")
+        return 0
+    if args.watch:
+        dirname = os.path.dirname(args.output_file)
+        os.makedirs(dirname if dirname else ".", exist_ok=True)
+        save_settings(save_dict, dirname if dirname else ".")
+        columns = (
+            ["files"]
+            + output_columns(
+                args.columns,
+                args.geometry_layout,
+                args.histogram_statistics,
+                args.intensity_hash,
+            )
+            + (args.metadata_keys_headings if "meta data" in args.columns else [])
+        )
+        if args.analysis_type == "per_file":
+            columns += args.external_applications_headings
+        watch_directory(
+            args.root_of_data_directory,
+            args.output_file,
+            args.analysis_type,
+            inspection_function,
+            columns,
+            args.watch_interval,
+            args.watch_quiescence,
+            tile_sizes=args.tile_sizes if args.create_summary_image else None,
+            ignore_problems=args.ignore_problems,
+            float_format=(
+                f"%.{args.float_precision}f" if args.float_precision else None
+            ),
         )
+        return 0
+
+    start_time = time.perf_counter()
+    df = inspection_function(file_names=file_names)
+    inspection_time = time.perf_counter() - start_time
     # either no files were found in the root directory structure or no images could be read,
     # so dataframe is either empty or has a single column titled "files" and all the contents
     # are just listing files/series that could not be read.
@@ -1151,23 +5832,40 @@ def characterize_data(argv=None):
         dirname = "."
     os.makedirs(dirname, exist_ok=True)
 
-    # Save the configuration used in the analysis to a JSON configuration file
-    # with date-time prefix. The positional parameters and configuration file
-    # are not included. Enables reproducibility and consistent usage of user
-    # preferences across script invocations.
-    with open(
-        os.path.join(
-            dirname,  # os.path.dirname(os.path.abspath(__file__)),
-            time.strftime("%d_%m_%Y-%H_%M_%S_") + "characterize_data_settings.json",
-        ),
-        "w",
-    ) as fp:
-        del save_dict["configuration_file"]
-        del save_dict["root_of_data_directory"]
-        del save_dict["output_file"]
-        del save_dict["analysis_type"]
-        json.dump(save_dict, fp, indent=2)
+    save_settings(save_dict, dirname)
 
+    # estimate the characteristics of the whole dataset from the sample, before any rows are removed,
+    # and project the run time of a full run from the time it took to inspect the sample.
+    if args.sample:
+        if args.analysis_type == "per_file":
+            unit_key = lambda row: row["files"][0]
+        else:
+            unit_key = lambda row: os.path.dirname(row["files"][0])
+        df["sample weight"] = df.apply(
+            lambda row: sample_info[unit_key(row)][1] / sample_info[unit_key(row)][2],
+            axis=1,
+        )
+        estimates = sample_estimates(
+            df, sample_info, unit_key, ["pixel type"] + args.metadata_keys_headings
+        )
+        population_size = sum(dict((k, N) for k, N, n in sample_info.values()).values())
+        sample_fraction = len(sample_info) / population_size
+        estimates.loc[len(estimates)] = [
+            "projected run time [sec]",
+            inspection_time / sample_fraction,
+            np.nan,
+            np.nan,
+        ]
+        estimates.to_csv(
+            f"{os.path.splitext(args.output_file)[0]}_sample_estimates.csv",
+            index=False,
+        )
+
+    # compute the perceptual hashes from the thumbnails before they are removed.
+    if args.near_duplicates:
+        df["perceptual hash"] = df["thumbnail"].apply(
+            lambda x: perceptual_hash(x) if isinstance(x, sitk.Image) else np.nan
+        )
     # create summary image and remove the column containing the thumbnail images from the
     # dataframe.
     if args.create_summary_image:
@@ -1179,17 +5877,34 @@ def characterize_data(argv=None):
             f"{os.path.splitext(args.output_file)[0]}_summary_image.nrrd",
             useCompression=True,
         )
+    if "thumbnail" in df.columns:
         df.drop("thumbnail", axis=1, inplace=True)
 
     # remove all rows associated with problematic files (non-image files or image files with problems).
-    # all the valid rows contain at least 2 non-na values so use that threshold when dropping rows.
+    # all the valid rows contain at least 2 non-na values so use that threshold when dropping rows,
+    # when sampling, all rows also include the sample weight.
+    valid_row_thresh = 3 if args.sample else 2
     if args.ignore_problems:
-        df.dropna(inplace=True, thresh=2)
+        df.dropna(inplace=True, thresh=valid_row_thresh)
+    if args.file_list_layout == "normalized":
+        df, file_table, directory_table = normalized_file_lists(df)
+        file_table.to_csv(
+            f"{os.path.splitext(args.output_file)[0]}_files.csv", index=False
+        )
+        directory_table.to_csv(
+            f"{os.path.splitext(args.output_file)[0]}_directories.csv", index=False
+        )
     # save the raw information, create directory structure if it doesn't exist
     # if floating point precision was specified, convert the floating point tuples to the
     # desired precision. the dataframe's to_csv method will format the columns with floating point type.
     float_format_str = None
-    if args.float_precision:
+    if args.float_precision and "geometry" not in args.columns:
+        float_format_str = f"%.{args.float_precision}f"
+    elif args.float_precision and args.geometry_layout == "columns":
+        float_format_str = f"%.{args.float_precision}f"
+        float_columns = geometry_columns("columns")[4:]
+        df[float_columns] = df[float_columns].round(args.float_precision)
+    elif args.float_precision:
         float_format_str = f"%.{args.float_precision}f"
         df["image spacing"] = df["image spacing"].apply(
             lambda x: np.round(x, decimals=args.float_precision)
@@ -1207,63 +5922,109 @@ def characterize_data(argv=None):
     # first drop the rows that correspond to problematic files if they weren't already dropped
     # based on program settings
     if not args.ignore_problems:
-        df.dropna(inplace=True, thresh=2)
-    image_counts = df["MD5 intensity hash"].value_counts().reset_index(name="count")
-    duplicates = df[
-        df["MD5 intensity hash"].isin(
-            image_counts[image_counts["count"] > 1]["MD5 intensity hash"]
-        )
-    ].sort_values(by=["MD5 intensity hash"])
-    if not duplicates.empty:
-        duplicates.to_csv(
-            f"{os.path.splitext(args.output_file)[0]}_duplicates.csv", index=False
-        )
-
-    size_fig, size_ax = plt.subplots()
-    spacing_fig, spacing_ax = plt.subplots()
-    # There are true 3D images in the dataset, convert 2D sizes
-    # to faux 3D ones by adding third dimension as 1 and treat all
-    # images as 3D. Plot as a scatterplot with x and y sizes axes
-    # and z size encoded via color.
-    if df["image size"].apply(lambda x: len(x) == 3 and x[2] > 1).any():
-        sizes = df["image size"].apply(lambda x: x if len(x) == 3 else x + (1,))
-        x_size, y_size, z_size = zip(*sizes)
-        sc = size_ax.scatter(x_size, y_size, c=z_size, cmap="viridis")
-        cb = size_fig.colorbar(sc)
-        cb.set_label("z size", rotation=270, verticalalignment="baseline")
-        cb.set_ticks(np.linspace(min(z_size), max(z_size), 5, endpoint=True, dtype=int))
-
-        spacings = df["image spacing"].apply(lambda x: x if len(x) == 3 else x + (1,))
-        x_spacing, y_spacing, z_spacing = zip(*spacings)
-        sc = spacing_ax.scatter(x_spacing, y_spacing, c=z_spacing, cmap="viridis")
-        cb = spacing_fig.colorbar(sc)
-        cb.set_label("z spacing [mm]", rotation=270, verticalalignment="baseline")
-
-    # All images are 2D, but some may be faux 3D, last dimension is 1,
-    # convert faux 3D sizes to 2D by removing the last dimension.
-    else:
-        sizes = df["image size"].apply(lambda x: x if len(x) == 2 else x[0:2])
-        x_size, y_size = zip(*sizes)
-        size_ax.scatter(x_size, y_size)
-
-        spacings = df["image spacing"].apply(lambda x: x if len(x) == 2 else x[0:2])
-        x_spacing, y_spacing = zip(*spacings)
-        spacing_ax.scatter(x_spacing, y_spacing)
-
-    size_ax.set_xlabel("x size")
-    size_ax.set_ylabel("y size")
-    size_fig.tight_layout()
-    size_fig.savefig(
-        f"{os.path.splitext(args.output_file)[0]}_image_size_scatterplot.{'png' if len(df) > PDF_FOMAT_THRESHOLD else 'pdf'}",
-        bbox_inches="tight",
-    )
-    spacing_ax.set_xlabel("x spacing [mm]")
-    spacing_ax.set_ylabel("y spacing [mm]")
-    spacing_fig.tight_layout()
-    spacing_fig.savefig(
-        f"{os.path.splitext(args.output_file)[0]}_image_spacing_scatterplot.{'png' if len(df) > PDF_FOMAT_THRESHOLD else 'pdf'}",
-        bbox_inches="tight",
-    )
+        df.dropna(inplace=True, thresh=valid_row_thresh)
+    hash_column = intensity_hash_column(args.intensity_hash)
+    if hash_column in df.columns:
+        image_counts = df[hash_column].value_counts().reset_index(name="count")
+        duplicates = df[
+            df[hash_column].isin(image_counts[image_counts["count"] > 1][hash_column])
+        ].sort_values(by=[hash_column])
+        if not duplicates.empty:
+            duplicates.to_csv(
+                f"{os.path.splitext(args.output_file)[0]}_duplicates.csv", index=False
+            )
+    if args.near_duplicates:
+        hashed_df = df.dropna(subset=["perceptual hash"])
+        groups = near_duplicate_groups(
+            hashed_df["perceptual hash"].to_list(), args.near_duplicate_distance
+        )
+        # groups in which all images are exact duplicates are already reported
+        if hash_column in df.columns:
+            groups = [g for g in groups if hashed_df[hash_column].iloc[g].nunique() > 1]
+        if groups:
+            near_duplicates = pd.concat(
+                [
+                    hashed_df.iloc[g].assign(**{"near duplicate group": i})
+                    for i, g in enumerate(groups)
+                ]
+            )
+            near_duplicates.insert(
+                0, "near duplicate group", near_duplicates.pop("near duplicate group")
+            )
+            near_duplicates.to_csv(
+                f"{os.path.splitext(args.output_file)[0]}_near_duplicates.csv",
+                index=False,
+            )
+
+    import matplotlib.pyplot as plt
+
+    # the geometry columns may not have been requested
+    if "geometry" in args.columns:
+        size_fig, size_ax = plt.subplots()
+        spacing_fig, spacing_ax = plt.subplots()
+        # There are true 3D images in the dataset, convert 2D sizes
+        # to faux 3D ones by adding third dimension as 1 and treat all
+        # images as 3D. Plot as a scatterplot with x and y sizes axes
+        # and z size encoded via color.
+        # All images are 2D, but some may be faux 3D, last dimension is 1,
+        # convert faux 3D sizes to 2D by removing the last dimension.
+        # In the "columns" layout 2D images are already embedded in 3D.
+        if args.geometry_layout == "columns":
+            plot_3d = (df["image size z"] > 1).any()
+            axes = ["x", "y", "z"] if plot_3d else ["x", "y"]
+            sizes = df[[f"image size {axis}" for axis in axes]].to_numpy(int).T
+            spacings = df[[f"image spacing {axis}" for axis in axes]].to_numpy(float).T
+        elif df["image size"].apply(lambda x: len(x) == 3 and x[2] > 1).any():
+            plot_3d = True
+            sizes = zip(
+                *df["image size"].apply(lambda x: x if len(x) == 3 else x + (1,))
+            )
+            # spacings may have been rounded to numpy arrays (float_precision)
+            spacings = zip(
+                *df["image spacing"].apply(
+                    lambda x: tuple(x) if len(x) == 3 else tuple(x) + (1,)
+                )
+            )
+        else:
+            plot_3d = False
+            sizes = zip(*df["image size"].apply(lambda x: x if len(x) == 2 else x[0:2]))
+            spacings = zip(
+                *df["image spacing"].apply(lambda x: x if len(x) == 2 else x[0:2])
+            )
+        if plot_3d:
+            x_size, y_size, z_size = sizes
+            sc = size_ax.scatter(x_size, y_size, c=z_size, cmap="viridis")
+            cb = size_fig.colorbar(sc)
+            cb.set_label("z size", rotation=270, verticalalignment="baseline")
+            cb.set_ticks(
+                np.linspace(min(z_size), max(z_size), 5, endpoint=True, dtype=int)
+            )
+
+            x_spacing, y_spacing, z_spacing = spacings
+            sc = spacing_ax.scatter(x_spacing, y_spacing, c=z_spacing, cmap="viridis")
+            cb = spacing_fig.colorbar(sc)
+            cb.set_label("z spacing [mm]", rotation=270, verticalalignment="baseline")
+        else:
+            x_size, y_size = sizes
+            size_ax.scatter(x_size, y_size)
+
+            x_spacing, y_spacing = spacings
+            spacing_ax.scatter(x_spacing, y_spacing)
+
+        size_ax.set_xlabel("x size")
+        size_ax.set_ylabel("y size")
+        size_fig.tight_layout()
+        size_fig.savefig(
+            f"{os.path.splitext(args.output_file)[0]}_image_size_scatterplot.{'png' if len(df) > PDF_FOMAT_THRESHOLD else 'pdf'}",
+            bbox_inches="tight",
+        )
+        spacing_ax.set_xlabel("x spacing [mm]")
+        spacing_ax.set_ylabel("y spacing [mm]")
+        spacing_fig.tight_layout()
+        spacing_fig.savefig(
+            f"{os.path.splitext(args.output_file)[0]}_image_spacing_scatterplot.{'png' if len(df) > PDF_FOMAT_THRESHOLD else 'pdf'}",
+            bbox_inches="tight",
+        )
 
     # there is at least one series/file that is grayscale
     if "min intensity" in df.columns:
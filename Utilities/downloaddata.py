@@ -33,6 +33,8 @@ Example json file contents:
 Notes:
 1. The file we download can be inside an archive. In this case, the sha512
 checksum is that of the archive.
+2. fetch_data_all fetches the files concurrently, with a limited number of
+concurrent downloads from each host.
 
 """
 
@@ -43,6 +45,10 @@ import json
 
 import errno
 import warnings
+import contextlib
+import threading
+import time
+import concurrent.futures
 
 # http://stackoverflow.com/questions/2028517/python-urllib2-progress-hook
 
@@ -68,52 +74,445 @@ def url_download_report(bytes_so_far, url_download_size, total_size):
         sys.stdout.flush()
 
 
-def url_download_read(url, outputfile, url_download_size=8192 * 2, report_hook=None):
-    # Use the urllib2 to download the data. The Requests package, highly
-    # recommended for this task, doesn't support the file scheme so we opted
-    # for urllib2 which does.
+class DownloadProgressReport(object):
+    """
+    Aggregate progress report for concurrent downloads, reporting the number of
+    fetched files and the total number of downloaded bytes on a single line.
+    Reports triggered by downloaded bytes are written at most once every
+    report_interval seconds, reports of fetched files are always written.
+    """
+
+    def __init__(self, total_files, report_interval=0.5):
+        self.total_files = total_files
+        self.fetched_files = 0
+        self.failed_files = 0
+        self.downloaded_bytes = 0
+        self.report_interval = report_interval
+        self.last_report_time = 0
+        self.lock = threading.Lock()
+
+    def report_hook(self):
+        """
+        Return a url_download_read report hook which adds the bytes of a single
+        download to the total. A new download starts from zero bytes, so a
+        hook can be reused when the download is attempted from several urls.
+        """
+        previous_bytes = [0]
+
+        def hook(bytes_so_far, url_download_size, total_size):
+            with self.lock:
+                if bytes_so_far < previous_bytes[0]:
+                    previous_bytes[0] = 0
+                self.downloaded_bytes += bytes_so_far - previous_bytes[0]
+                previous_bytes[0] = bytes_so_far
+                self.write(force=False)
+
+        return hook
+
+    def file_done(self, failed=False):
+        with self.lock:
+            self.fetched_files += 1
+            self.failed_files += int(failed)
+            self.write(force=True)
+
+    def write(self, force):
+        now = time.time()
+        if not force and now - self.last_report_time < self.report_interval:
+            return
+        self.last_report_time = now
+        # Carriage return at the beginning of the string, see url_download_report.
+        sys.stdout.write(
+            "\rFetched %d of %d files (%d failed), downloaded %d bytes"
+            % (
+                self.fetched_files,
+                self.total_files,
+                self.failed_files,
+                self.downloaded_bytes,
+            )
+        )
+        if self.fetched_files == self.total_files:
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+
+
+class HostConnectionLimiter(object):
+    """
+    Limit the number of concurrent downloads from each host. Calling the limiter
+    with a url returns the semaphore of the url's host, which is held for the
+    duration of the download.
+    """
+
+    def __init__(self, max_connections_per_host):
+        self.max_connections_per_host = max_connections_per_host
+        self.semaphores = {}
+        self.lock = threading.Lock()
 
+    def __call__(self, url):
+        try:
+            # Python 3
+            from urllib.parse import urlparse
+        except ImportError:
+            from urlparse import urlparse
+
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(
+                    self.max_connections_per_host
+                )
+            return self.semaphores[host]
+
+
+def read_download_state(state_file):
+    try:
+        with open(state_file, "r") as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_download_state(state_file, state):
+    with open(state_file, "w") as fp:
+        json.dump(state, fp)
+
+
+def response_header(url_response, name, default=None):
     try:
         # Python 3
-        from urllib.request import urlopen, URLError, HTTPError
-    except ImportError:
-        from urllib2 import urlopen, URLError, HTTPError
-    from xml.dom import minidom
+        return url_response.info().get(name, default)
+    except AttributeError:
+        return url_response.info().getheader(name, default)
+
 
-    # Open the url
+def copy_response(
+    url_response,
+    local_file,
+    length,
+    read_size,
+    progress,
+    hasher=None,
+    max_read_size=1 << 20,
+):
+    """
+    Copy length bytes of the url response to the local file and report the size
+    of each read to the progress callable. When a hasher (hashlib object) is given
+    it is updated with the copied bytes. The read size adapts to the connection,
+    doubling up to max_read_size while reads fill the buffer in under 25ms and
+    halving when a read takes more than 100ms.
+
+    Returns the number of copied bytes, fewer than length if the connection was
+    dropped, and the adapted read size.
+    """
     try:
-        url_response = urlopen(url)
-    except HTTPError as e:
-        return "HTTP Error: {0} {1}\n".format(e.code, url)
-    except URLError as e:
-        return "URL Error: {0} {1}\n".format(e.reason, url)
-
-    # We download all content types - the assumption is that the sha512 ensures
-    # that what we received is the expected data.
+        # Python 3
+        from http.client import IncompleteRead
+    except ImportError:
+        from httplib import IncompleteRead
+
+    min_read_size = read_size
+    copied = 0
+    while copied < length:
+        start_time = time.time()
+        try:
+            url_download = url_response.read(min(read_size, length - copied))
+        except (IncompleteRead, IOError):
+            break
+        if not url_download:
+            break
+        elapsed = time.time() - start_time
+        local_file.write(url_download)
+        if hasher:
+            hasher.update(url_download)
+        copied += len(url_download)
+        progress(len(url_download), read_size)
+        if len(url_download) == read_size and elapsed < 0.025:
+            read_size = min(2 * read_size, max_read_size)
+        elif elapsed > 0.1:
+            read_size = max(read_size // 2, min_read_size)
+    return copied, read_size
+
+
+def url_segments_download_read(
+    url,
+    url_response,
+    partial_file,
+    segments,
+    validator,
+    connections,
+    url_download_size,
+    progress,
+    max_resume_attempts,
+):
+    """
+    Download the segments, [position, end) byte ranges of the url, into the
+    preallocated partial file using the given number of concurrent connections.
+    The first segment is read from url_response when it is given. The segment
+    positions are advanced as data is written, so the segments record the
+    remaining ranges if the download fails. If the data changed on the server
+    the partial file is removed.
+
+    Returns the error message of the first failed segment, None if all segments
+    were downloaded.
+    """
     try:
         # Python 3
-        content_length = url_response.info().get("Content-Length")
-    except AttributeError:
-        content_length = url_response.info().getheader("Content-Length")
-    total_size = content_length.strip()
-    total_size = int(total_size)
-    bytes_so_far = 0
-    with open(outputfile, "wb") as local_file:
-        while 1:
-            try:
-                url_download = url_response.read(url_download_size)
-                bytes_so_far += len(url_download)
-                if not url_download:
-                    break
-                local_file.write(url_download)
-            # handle errors
-            except HTTPError as e:
-                return "HTTP Error: {0} {1}\n".format(e.code, url)
-            except URLError as e:
-                return "URL Error: {0} {1}\n".format(e.reason, url)
-            if report_hook:
-                report_hook(bytes_so_far, url_download_size, total_size)
-    return "Downloaded Successfully"
+        from urllib.request import urlopen, Request, URLError, HTTPError
+    except ImportError:
+        from urllib2 import urlopen, Request, URLError, HTTPError
+
+    def segment_progress(segment):
+        def segment_progress(bytes_read, read_size):
+            segment[0] += bytes_read
+            progress(bytes_read, read_size)
+
+        return segment_progress
+
+    def download_segment(segment, url_response):
+        read_size = url_download_size
+        resume_attempts = 0
+        with open(partial_file, "r+b") as local_file:
+            while segment[0] < segment[1]:
+                if url_response is None:
+                    request = Request(url)
+                    request.add_header(
+                        "Range", "bytes={0}-{1}".format(segment[0], segment[1] - 1)
+                    )
+                    if validator:
+                        request.add_header("If-Range", validator)
+                    try:
+                        url_response = urlopen(request)
+                    except HTTPError as e:
+                        return "HTTP Error: {0} {1}\n".format(e.code, url)
+                    except URLError as e:
+                        return "URL Error: {0} {1}\n".format(e.reason, url)
+                    content_range = response_header(url_response, "Content-Range", "")
+                    if url_response.getcode() != 206 or not content_range.startswith(
+                        "bytes {0}-".format(segment[0])
+                    ):
+                        url_response.close()
+                        data_changed.append(segment)
+                        return "Range Error: data changed on server {0}\n".format(url)
+                local_file.seek(segment[0])
+                copied, read_size = copy_response(
+                    url_response,
+                    local_file,
+                    segment[1] - segment[0],
+                    read_size,
+                    segment_progress(segment),
+                )
+                url_response.close()
+                url_response = None
+                if segment[0] < segment[1]:
+                    resume_attempts += 1
+                    if resume_attempts > max_resume_attempts:
+                        return "Connection Error: {0} bytes missing {1}\n".format(
+                            segment[1] - segment[0], url
+                        )
+        return None
+
+    data_changed = []
+    with concurrent.futures.ThreadPoolExecutor(connections) as executor:
+        errors = list(
+            executor.map(
+                download_segment,
+                segments,
+                [url_response] + [None] * (len(segments) - 1),
+            )
+        )
+    if data_changed:
+        os.remove(partial_file)
+    return next((error for error in errors if error), None)
+
+
+def url_download_read(
+    url,
+    outputfile,
+    url_download_size=8192 * 2,
+    report_hook=None,
+    connection_limiter=None,
+    max_resume_attempts=5,
+    max_segments=4,
+    min_segment_size=8 << 20,
+    sha512=None,
+):
+    # Use the urllib2 to download the data. The Requests package, highly
+    # recommended for this task, doesn't support the file scheme so we opted
+    # for urllib2 which does.
+    # The optional connection_limiter (see HostConnectionLimiter) bounds the
+    # number of concurrent downloads from the url's host.
+    # The data is written to a partial file, outputfile.part, which is renamed to
+    # outputfile once complete. The state of the download, the url, total size and
+    # the server's ETag or Last-Modified validator, is recorded in the sidecar file
+    # outputfile.part.json. A dropped connection, or a later call after a failed
+    # download, resumes from the end of the partial file using a Range request.
+    # If the server does not support ranges or the data changed (If-Range), the
+    # download restarts from the beginning.
+    # When the server supports ranges, data of at least 2*min_segment_size bytes is
+    # split into up to max_segments byte ranges downloaded concurrently into the
+    # preallocated partial file. The first range is read from the initial response.
+    # Each additional connection takes a free slot of the connection_limiter,
+    # without waiting for one, and the state file records the remaining ranges.
+    # The url_download_size is the initial read size, adapted per connection (see
+    # copy_response).
+    # When the sha512 is given, the data is verified before it is renamed to
+    # outputfile and discarded if its hash is incorrect. A single stream is hashed
+    # as it is downloaded, the partial file is only hashed from disk when a
+    # download is resumed from it in a later call. Segments are downloaded out of
+    # order, so a segmented download is hashed once it is complete.
+    partial_file = outputfile + ".part"
+    state_file = partial_file + ".json"
+    host_connections = connection_limiter(url) if connection_limiter else None
+    with host_connections or contextlib.nullcontext():
+        try:
+            # Python 3
+            from urllib.request import urlopen, Request, URLError, HTTPError
+        except ImportError:
+            from urllib2 import urlopen, Request, URLError, HTTPError
+
+        progress_lock = threading.Lock()
+        bytes_so_far = [0]
+
+        def progress(bytes_read, read_size):
+            with progress_lock:
+                bytes_so_far[0] += bytes_read
+                if report_hook:
+                    report_hook(bytes_so_far[0], read_size, state["size"])
+
+        resume_attempts = 0
+        hasher = None
+        hashed_bytes = 0
+        while True:
+            state = read_download_state(state_file)
+            offset = 0
+            if state.get("url") == url and os.path.exists(partial_file):
+                offset = os.path.getsize(partial_file)
+            url_response = None
+            if "segments" in state and offset != state["size"]:
+                # The preallocated file of a segmented download was modified.
+                offset = 0
+            if not offset or "segments" not in state:
+                # A segmented download is resumed by the requests of its segments,
+                # otherwise open the url
+                request = Request(url)
+                if offset:
+                    request.add_header("Range", "bytes={0}-".format(offset))
+                    if state.get("validator"):
+                        request.add_header("If-Range", state["validator"])
+                try:
+                    url_response = urlopen(request)
+                except HTTPError as e:
+                    if e.code == 416 and offset:
+                        # The partial file does not match the data on the server.
+                        os.remove(partial_file)
+                        continue
+                    return "HTTP Error: {0} {1}\n".format(e.code, url)
+                except URLError as e:
+                    return "URL Error: {0} {1}\n".format(e.reason, url)
+
+                # We download all content types - the assumption is that the sha512
+                # ensures that what we received is the expected data.
+                content_length = response_header(url_response, "Content-Length")
+                content_range = response_header(url_response, "Content-Range", "")
+                validator = response_header(url_response, "ETag") or response_header(
+                    url_response, "Last-Modified"
+                )
+                # A server which does not support ranges sends all of the data.
+                if url_response.getcode() != 206:
+                    offset = 0
+                elif not content_range.startswith("bytes {0}-".format(offset)):
+                    # The server did not send the requested range, restart.
+                    url_response.close()
+                    os.remove(partial_file)
+                    continue
+                total_size = content_length.strip()
+                total_size = offset + int(total_size)
+                state = {"url": url, "size": total_size, "validator": validator}
+                if (
+                    offset == 0
+                    and max_segments > 1
+                    and total_size >= 2 * min_segment_size
+                    and response_header(url_response, "Accept-Ranges") == "bytes"
+                ):
+                    segment_count = min(max_segments, total_size // min_segment_size)
+                    state["segments"] = [
+                        [
+                            total_size * i // segment_count,
+                            total_size * (i + 1) // segment_count,
+                        ]
+                        for i in range(segment_count)
+                    ]
+                write_download_state(state_file, state)
+                if "segments" in state:
+                    with open(partial_file, "wb") as local_file:
+                        local_file.truncate(total_size)
+
+            if "segments" in state:
+                # Take free connection slots of the host for the additional segments.
+                connections = 1
+                while connections < len(state["segments"]) and (
+                    host_connections is None or host_connections.acquire(False)
+                ):
+                    connections += 1
+                bytes_so_far[0] = state["size"] - sum(
+                    end - position for position, end in state["segments"]
+                )
+                try:
+                    error = url_segments_download_read(
+                        url,
+                        url_response,
+                        partial_file,
+                        state["segments"],
+                        state["validator"],
+                        connections,
+                        url_download_size,
+                        progress,
+                        max_resume_attempts,
+                    )
+                finally:
+                    if host_connections is not None:
+                        for i in range(connections - 1):
+                            host_connections.release()
+                if error:
+                    if os.path.exists(partial_file):
+                        write_download_state(state_file, state)
+                    else:
+                        os.remove(state_file)
+                    return error
+                if sha512:
+                    hasher = hashlib.sha512()
+                    update_file_hash(hasher, partial_file)
+            else:
+                if sha512 and (hasher is None or hashed_bytes != offset):
+                    # Hash the data of the partial file the download resumes from.
+                    hasher = hashlib.sha512()
+                    if offset:
+                        update_file_hash(hasher, partial_file, offset)
+                bytes_so_far[0] = offset
+                with open(partial_file, "ab" if offset else "wb") as local_file:
+                    copy_response(
+                        url_response,
+                        local_file,
+                        state["size"] - offset,
+                        url_download_size,
+                        progress,
+                        hasher,
+                    )
+                url_response.close()
+                hashed_bytes = bytes_so_far[0]
+                if bytes_so_far[0] < state["size"]:
+                    resume_attempts += 1
+                    if resume_attempts > max_resume_attempts:
+                        return "Connection Error: downloaded {0} of {1} bytes {2}\n".format(
+                            bytes_so_far[0], state["size"], url
+                        )
+                    continue
+            if sha512 and hasher.hexdigest() != sha512:
+                os.remove(partial_file)
+                os.remove(state_file)
+                return "Hash Error: {0} {1}\n".format(hasher.hexdigest(), url)
+            os.replace(partial_file, outputfile)
+            os.remove(state_file)
+            return "Downloaded Successfully"
 
 
 # http://stackoverflow.com/questions/600268/mkdir-p-functionality-in-python?rq=1
@@ -167,19 +566,42 @@ def get_servers():
     return servers
 
 
+def update_file_hash(hasher, file_name, length=None):
+    """
+    Update the hasher (hashlib object) with the first length bytes of the file,
+    all of its bytes when length is None.
+    """
+    with open(file_name, "rb") as fp:
+        while length is None or length > 0:
+            read_size = 128 * hasher.block_size
+            url_download = fp.read(
+                read_size if length is None else min(read_size, length)
+            )
+            if not url_download:
+                break
+            hasher.update(url_download)
+            if length is not None:
+                length -= len(url_download)
+
+
 def output_hash_is_valid(known_sha512, output_file):
     sha512 = hashlib.sha512()
     if not os.path.exists(output_file):
         return False
-    with open(output_file, "rb") as fp:
-        for url_download in iter(lambda: fp.read(128 * sha512.block_size), b""):
-            sha512.update(url_download)
+    update_file_hash(sha512, output_file)
     retreived_sha512 = sha512.hexdigest()
     return retreived_sha512 == known_sha512
 
 
 def fetch_data_one(
-    onefilename, output_directory, manifest_file, verify=True, force=False
+    onefilename,
+    output_directory,
+    manifest_file,
+    verify=True,
+    force=False,
+    report_hook=url_download_report,
+    connection_limiter=None,
+    verbose=True,
 ):
     import tarfile, zipfile
 
@@ -189,7 +611,8 @@ def fetch_data_one(
         onefilename, manifest_file
     )
 
-    sys.stdout.write("Fetching {0}\n".format(onefilename))
+    if verbose:
+        sys.stdout.write("Fetching {0}\n".format(onefilename))
     output_file = os.path.realpath(os.path.join(output_directory, onefilename))
     data_dictionary = manifest[onefilename]
     sha512 = data_dictionary["sha512"]
@@ -206,14 +629,22 @@ def fetch_data_one(
         # Only download if force is true or the file does not exist.
         if force or not os.path.exists(output_file):
             mkdir_p(os.path.dirname(output_file))
-            url_download_read(url, output_file, report_hook=url_download_report)
-            # Check if a file was downloaded and has the correct hash
-            if output_hash_is_valid(sha512, output_file):
+            # The hash is verified while downloading, the output file is only
+            # written if it is correct.
+            result = url_download_read(
+                url,
+                output_file,
+                report_hook=report_hook,
+                connection_limiter=connection_limiter,
+                sha512=sha512,
+            )
+            # Check if a file was downloaded
+            if result == "Downloaded Successfully":
                 new_download = True
                 # Stop looking once found
                 break
             # If the file exists this means the hash is invalid we have a problem.
-            elif os.path.exists(output_file):
+            elif result.startswith("Hash Error") or os.path.exists(output_file):
                 error_msg = "File " + output_file
                 error_msg += " has incorrect hash value, " + sha512 + " was expected."
                 raise Exception(error_msg)
@@ -233,7 +664,14 @@ def fetch_data_one(
         ):
             # Attempt to download if sha512 is incorrect.
             fetch_data_one(
-                onefilename, output_directory, manifest_file, verify, force=True
+                onefilename,
+                output_directory,
+                manifest_file,
+                verify,
+                force=True,
+                report_hook=report_hook,
+                connection_limiter=connection_limiter,
+                verbose=verbose,
             )
     # If the file is in an archive, unpack it.
     if tarfile.is_tarfile(output_file) or zipfile.is_zipfile(output_file):
@@ -250,11 +688,81 @@ def fetch_data_one(
     return output_file
 
 
-def fetch_data_all(output_directory, manifest_file, verify=True):
+def fetch_data_all(
+    output_directory,
+    manifest_file,
+    verify=True,
+    max_workers=8,
+    max_connections_per_host=4,
+):
+    """
+    Fetch all the files listed in the manifest file using max_workers concurrent
+    tasks, with at most max_connections_per_host concurrent downloads from each
+    host.
+
+    Entries which are extracted from the same archive into the same directory
+    are fetched one after the other by a single task, so the archive is downloaded
+    and extracted only once. Failing to fetch an entry does not stop the others.
+    Once all entries were handled, the failures are raised in a single exception
+    listing them in manifest order.
+    """
     with open(manifest_file, "r") as fp:
         manifest = json.load(fp)
-    for filename in manifest:
-        fetch_data_one(filename, output_directory, manifest_file, verify, force=False)
+    tasks = {}
+    for filename, data_dictionary in manifest.items():
+        key = filename
+        if "archive" in data_dictionary:
+            output_file = os.path.realpath(os.path.join(output_directory, filename))
+            key = (data_dictionary["sha512"], os.path.dirname(output_file))
+        tasks.setdefault(key, []).append(filename)
+
+    progress = DownloadProgressReport(len(manifest))
+    connection_limiter = HostConnectionLimiter(max_connections_per_host)
+
+    def fetch_task(filenames):
+        errors = {}
+        archive_filename = None
+        for filename in filenames:
+            output_file = os.path.realpath(os.path.join(output_directory, filename))
+            try:
+                if archive_filename and not os.path.exists(output_file):
+                    raise Exception(
+                        "File '{0}' was not extracted from the archive of '{1}'".format(
+                            filename, archive_filename
+                        )
+                    )
+                downloaded = not os.path.exists(output_file)
+                fetch_data_one(
+                    filename,
+                    output_directory,
+                    manifest_file,
+                    verify,
+                    force=False,
+                    report_hook=progress.report_hook(),
+                    connection_limiter=connection_limiter,
+                    verbose=False,
+                )
+                if downloaded:
+                    archive_filename = archive_filename or filename
+            except Exception as e:
+                errors[filename] = e
+            progress.file_done(failed=filename in errors)
+        return errors
+
+    errors = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        for task_errors in executor.map(fetch_task, tasks.values()):
+            errors.update(task_errors)
+    if errors:
+        error_msg = "Failed to fetch {0} of {1} files:\n".format(
+            len(errors), len(manifest)
+        )
+        error_msg += "\n".join(
+            "{0}: {1}".format(filename, errors[filename])
+            for filename in manifest
+            if filename in errors
+        )
+        raise Exception(error_msg)
 
 
 def fetch_data(cache_file_name, verify=False, cache_directory_name="../Data"):
@@ -0,0 +1,394 @@
+import hashlib
+import io
+import json
+import pathlib
+import sys
+import tarfile
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Add the utilities directory to the path so that we can import
+sys.path.append(str(pathlib.Path(__file__).parent.parent.absolute() / "Utilities"))
+
+import downloaddata
+from downloaddata import fetch_data_all, url_download_read, HostConnectionLimiter
+
+
+class DataStoreHandler(BaseHTTPRequestHandler):
+    """
+    Serve the files of the data store directory, recording the requested paths,
+    the number of bytes sent and the maximal number of concurrent requests.
+    Range requests are supported unless supports_ranges is False. When drop_after
+    is set, the connection is dropped after sending that many bytes of a response.
+    """
+
+    directory = None
+    supports_ranges = True
+    drop_after = None
+    requests = Counter()
+    bytes_sent = 0
+    active_requests = 0
+    max_active_requests = 0
+    lock = threading.Lock()
+    delay = threading.Event()
+
+    def do_GET(self):
+        cls = DataStoreHandler
+        with cls.lock:
+            cls.requests[self.path] += 1
+            cls.active_requests += 1
+            cls.max_active_requests = max(cls.max_active_requests, cls.active_requests)
+        # hold the request briefly so that requests overlap, the request is
+        # counted as active before its response is sent
+        cls.delay.wait(0.05)
+        with cls.lock:
+            cls.active_requests -= 1
+        file_path = pathlib.Path(cls.directory) / self.path.lstrip("/")
+        if not file_path.is_file():
+            self.send_error(404)
+            return
+        data = file_path.read_bytes()
+        etag = '"{0}"'.format(hashlib.md5(data).hexdigest())
+        first, last = 0, len(data) - 1
+        range_header = self.headers.get("Range")
+        if (
+            cls.supports_ranges
+            and range_header
+            and self.headers.get("If-Range", etag) == etag
+        ):
+            first, last = range_header[len("bytes=") :].split("-")
+            first, last = int(first), int(last) if last else len(data) - 1
+            if first >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes {0}-{1}/{2}".format(first, last, len(data))
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(last + 1 - first))
+        self.send_header("ETag", etag)
+        if cls.supports_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        body = data[first : last + 1]
+        if cls.drop_after is not None and len(body) > cls.drop_after:
+            body = body[: cls.drop_after]
+            self.close_connection = True
+        # counted before writing, the client may finish before the write returns
+        with cls.lock:
+            cls.bytes_sent += len(body)
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def data_store(tmp_path, monkeypatch):
+    """
+    Local HTTP stand-in for the data servers, objects are stored by their
+    sha512 hash in the SHA512 directory.
+    """
+    store_path = tmp_path / "store"
+    (store_path / "SHA512").mkdir(parents=True)
+    DataStoreHandler.directory = str(store_path)
+    DataStoreHandler.supports_ranges = True
+    DataStoreHandler.drop_after = None
+    DataStoreHandler.requests = Counter()
+    DataStoreHandler.bytes_sent = 0
+    DataStoreHandler.active_requests = 0
+    DataStoreHandler.max_active_requests = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DataStoreHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = "http://127.0.0.1:{0}".format(server.server_address[1])
+    monkeypatch.setattr(downloaddata, "get_servers", lambda: [url + "/SHA512/%(hash)"])
+
+    def add(content):
+        sha512 = hashlib.sha512(content).hexdigest()
+        (store_path / "SHA512" / sha512).write_bytes(content)
+        return sha512
+
+    yield add
+    server.shutdown()
+    server.server_close()
+
+
+def data_store_url(sha512):
+    return downloaddata.get_servers()[0].replace("%(hash)", sha512)
+
+
+class TestDownloadData:
+    def test_fetch_data_all(self, tmp_path, data_store, capsys, monkeypatch):
+        manifest = {}
+        contents = {}
+        for i in range(12):
+            contents["images/{0}.raw".format(i)] = b"image %d " % i * (100 + i)
+        for file_name, content in contents.items():
+            manifest[file_name] = {"sha512": data_store(content)}
+        # two entries extracted from the same archive
+        archive_contents = {"a.txt": b"first member", "b.txt": b"second member"}
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            for member_name, content in archive_contents.items():
+                info = tarfile.TarInfo(member_name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        archive_sha512 = data_store(archive.getvalue())
+        for member_name in archive_contents:
+            manifest["archive/" + member_name] = {
+                "sha512": archive_sha512,
+                "archive": "true",
+            }
+            contents["archive/" + member_name] = archive_contents[member_name]
+        manifest_file = tmp_path / "manifest.json"
+        manifest_file.write_text(json.dumps(manifest))
+        output_directory = tmp_path / "data"
+        # downloads are hash verified while downloading, without reading the files
+        output_hash_is_valid = downloaddata.output_hash_is_valid
+        monkeypatch.setattr(downloaddata, "output_hash_is_valid", None)
+
+        fetch_data_all(
+            str(output_directory),
+            str(manifest_file),
+            max_workers=6,
+            max_connections_per_host=2,
+        )
+        for file_name, content in contents.items():
+            assert (output_directory / file_name).read_bytes() == content
+        assert DataStoreHandler.requests["/SHA512/" + archive_sha512] == 1
+        assert DataStoreHandler.max_active_requests == 2
+        assert "Fetched 14 of 14 files (0 failed)" in capsys.readouterr().out
+
+        # all files exist so nothing is downloaded again
+        monkeypatch.setattr(downloaddata, "output_hash_is_valid", output_hash_is_valid)
+        DataStoreHandler.requests.clear()
+        fetch_data_all(str(output_directory), str(manifest_file), max_workers=6)
+        assert not DataStoreHandler.requests
+
+    def test_fetch_data_all_errors(self, tmp_path, data_store):
+        manifest = {
+            "missing_{0}.raw".format(i): {
+                "sha512": hashlib.sha512(b"%d" % i).hexdigest()
+            }
+            for i in [3, 1, 2]
+        }
+        manifest["found.raw"] = {"sha512": data_store(b"found")}
+        manifest_file = tmp_path / "manifest.json"
+        manifest_file.write_text(json.dumps(manifest))
+        with pytest.raises(Exception) as error:
+            fetch_data_all(str(tmp_path / "data"), str(manifest_file), max_workers=4)
+        # failures are reported in manifest order and do not stop other downloads
+        message = str(error.value)
+        assert message.startswith("Failed to fetch 3 of 4 files:\n")
+        assert (
+            message.index("\nmissing_3.raw: ")
+            < message.index("\nmissing_1.raw: ")
+            < message.index("\nmissing_2.raw: ")
+        )
+        assert "found.raw: " not in message
+        assert (tmp_path / "data" / "found.raw").read_bytes() == b"found"
+
+    def test_host_connection_limiter(self):
+        limiter = HostConnectionLimiter(3)
+        assert limiter("http://a.org/x") is limiter("http://a.org/y")
+        assert limiter("http://a.org/x") is not limiter("http://b.org/x")
+
+    def test_resume_download(self, tmp_path, data_store):
+        content = bytes(range(256)) * 4096
+        url = data_store_url(data_store(content))
+        output_file = str(tmp_path / "data.raw")
+        # dropped connections are resumed from the end of the partial file
+        DataStoreHandler.drop_after = 100000
+        assert url_download_read(url, output_file, max_resume_attempts=20) == (
+            "Downloaded Successfully"
+        )
+        assert pathlib.Path(output_file).read_bytes() == content
+        assert DataStoreHandler.bytes_sent == len(content)
+        assert not list(tmp_path.glob("*.part*"))
+
+        # a failed download is resumed by a later call
+        DataStoreHandler.bytes_sent = 0
+        DataStoreHandler.drop_after = 300000
+        output_file = str(tmp_path / "resumed.raw")
+        assert url_download_read(url, output_file, max_resume_attempts=0).startswith(
+            "Connection Error"
+        )
+        assert not pathlib.Path(output_file).exists()
+        assert pathlib.Path(output_file + ".part").stat().st_size == 300000
+        assert json.loads(pathlib.Path(output_file + ".part.json").read_text())[
+            "size"
+        ] == len(content)
+        DataStoreHandler.drop_after = None
+        assert url_download_read(url, output_file) == "Downloaded Successfully"
+        assert pathlib.Path(output_file).read_bytes() == content
+        assert DataStoreHandler.bytes_sent == len(content)
+
+        # a partial file of data which changed on the server is not resumed
+        output_file = str(tmp_path / "changed.raw")
+        pathlib.Path(output_file + ".part").write_bytes(b"x" * 1000)
+        pathlib.Path(output_file + ".part.json").write_text(
+            json.dumps({"url": url, "size": len(content), "validator": '"old"'})
+        )
+        assert url_download_read(url, output_file) == "Downloaded Successfully"
+        assert pathlib.Path(output_file).read_bytes() == content
+
+    def test_resume_download_without_ranges(self, tmp_path, data_store):
+        content = bytes(range(256)) * 1024
+        url = data_store_url(data_store(content))
+        output_file = str(tmp_path / "data.raw")
+        # each attempt restarts from the beginning when ranges are not supported
+        DataStoreHandler.supports_ranges = False
+        DataStoreHandler.drop_after = 100000
+        assert url_download_read(url, output_file, max_resume_attempts=2).startswith(
+            "Connection Error"
+        )
+        assert DataStoreHandler.bytes_sent == 3 * 100000
+        assert pathlib.Path(output_file + ".part").stat().st_size == 100000
+        DataStoreHandler.drop_after = None
+        assert url_download_read(url, output_file) == "Downloaded Successfully"
+        assert pathlib.Path(output_file).read_bytes() == content
+
+    @pytest.mark.parametrize("drop_after", [None, 100000])
+    def test_segmented_download(self, tmp_path, data_store, drop_after):
+        content = bytes(range(256)) * 4096 * 3
+        sha512 = data_store(content)
+        url = data_store_url(sha512)
+        DataStoreHandler.drop_after = drop_after
+        assert url_download_read(
+            url,
+            str(tmp_path / "data.raw"),
+            max_segments=4,
+            min_segment_size=512 * 1024,
+            max_resume_attempts=20,
+        ) == ("Downloaded Successfully")
+        assert (tmp_path / "data.raw").read_bytes() == content
+        if drop_after is None:
+            assert DataStoreHandler.requests["/SHA512/" + sha512] == 4
+        else:
+            # the first segment is resumed after the initial response is dropped
+            assert DataStoreHandler.bytes_sent == len(content)
+
+        # the number of segments is limited by the free connections of the host
+        DataStoreHandler.max_active_requests = 0
+        DataStoreHandler.drop_after = None
+        limiter = HostConnectionLimiter(2)
+        assert url_download_read(
+            url,
+            str(tmp_path / "limited.raw"),
+            connection_limiter=limiter,
+            max_segments=4,
+            min_segment_size=512 * 1024,
+        ) == ("Downloaded Successfully")
+        assert (tmp_path / "limited.raw").read_bytes() == content
+        assert DataStoreHandler.max_active_requests == 2
+
+        # without range support the data is downloaded in a single stream
+        DataStoreHandler.requests.clear()
+        DataStoreHandler.supports_ranges = False
+        assert url_download_read(
+            url, str(tmp_path / "single.raw"), min_segment_size=512 * 1024
+        ) == ("Downloaded Successfully")
+        assert (tmp_path / "single.raw").read_bytes() == content
+        assert DataStoreHandler.requests["/SHA512/" + sha512] == 1
+
+    def test_resume_segmented_download(self, tmp_path, data_store):
+        content = bytes(range(256)) * 4096 * 2
+        url = data_store_url(data_store(content))
+        output_file = str(tmp_path / "data.raw")
+        DataStoreHandler.drop_after = 200000
+        assert url_download_read(
+            url,
+            output_file,
+            max_resume_attempts=0,
+            max_segments=4,
+            min_segment_size=256 * 1024,
+        ).startswith("Connection Error")
+        # the segments record the remaining byte ranges
+        state = json.loads(pathlib.Path(output_file + ".part.json").read_text())
+        assert [end - position for position, end in state["segments"]] == [
+            len(content) // 4 - 200000
+        ] * 4
+        DataStoreHandler.drop_after = None
+        assert url_download_read(url, output_file) == "Downloaded Successfully"
+        assert pathlib.Path(output_file).read_bytes() == content
+        assert DataStoreHandler.bytes_sent == len(content)
+
+        # a segmented download of data which changed on the server is restarted
+        DataStoreHandler.drop_after = 200000
+        output_file = str(tmp_path / "changed.raw")
+        assert url_download_read(
+            url,
+            output_file,
+            max_resume_attempts=0,
+            max_segments=4,
+            min_segment_size=256 * 1024,
+        ).startswith("Connection Error")
+        state = json.loads(pathlib.Path(output_file + ".part.json").read_text())
+        state["validator"] = '"old"'
+        pathlib.Path(output_file + ".part.json").write_text(json.dumps(state))
+        DataStoreHandler.drop_after = None
+        assert url_download_read(url, output_file).startswith("Range Error")
+        assert not list(tmp_path.glob("changed.raw.part*"))
+        assert url_download_read(url, output_file) == "Downloaded Successfully"
+        assert pathlib.Path(output_file).read_bytes() == content
+
+    def test_download_hash(self, tmp_path, data_store, monkeypatch):
+        content = bytes(range(256)) * 4096
+        sha512 = data_store(content)
+        url = data_store_url(sha512)
+        hashed_lengths = []
+        update_file_hash = downloaddata.update_file_hash
+
+        def recording_update_file_hash(hasher, file_name, length=None):
+            hashed_lengths.append(length)
+            update_file_hash(hasher, file_name, length)
+
+        monkeypatch.setattr(
+            downloaddata, "update_file_hash", recording_update_file_hash
+        )
+        # a single stream is hashed while downloading, also when resumed after a
+        # dropped connection
+        DataStoreHandler.drop_after = 100000
+        output_file = str(tmp_path / "data.raw")
+        assert url_download_read(
+            url, output_file, max_resume_attempts=20, sha512=sha512
+        ) == ("Downloaded Successfully")
+        assert pathlib.Path(output_file).read_bytes() == content
+        assert hashed_lengths == []
+
+        # the partial file is hashed when resumed by a later call
+        DataStoreHandler.drop_after = 300000
+        output_file = str(tmp_path / "resumed.raw")
+        assert url_download_read(
+            url, output_file, max_resume_attempts=0, sha512=sha512
+        ).startswith("Connection Error")
+        DataStoreHandler.drop_after = None
+        assert url_download_read(url, output_file, sha512=sha512) == (
+            "Downloaded Successfully"
+        )
+        assert hashed_lengths == [300000]
+
+        # a segmented download is hashed once complete
+        hashed_lengths.clear()
+        output_file = str(tmp_path / "segmented.raw")
+        assert url_download_read(
+            url, output_file, min_segment_size=256 * 1024, sha512=sha512
+        ) == ("Downloaded Successfully")
+        assert hashed_lengths == [None]
+
+        # data with an incorrect hash is discarded
+        for min_segment_size in [256 * 1024, len(content)]:
+            output_file = str(tmp_path / "incorrect.raw")
+            assert url_download_read(
+                url,
+                output_file,
+                min_segment_size=min_segment_size,
+                sha512=hashlib.sha512(b"other").hexdigest(),
+            ).startswith("Hash Error")
+            assert not list(tmp_path.glob("incorrect.raw*"))
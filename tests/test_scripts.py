@@ -1,3 +1,4 @@
+import ast
 import os
 
 import pytest
@@ -5,11 +6,47 @@ import pathlib
 import hashlib
 import sys
 import pandas as pd
+import SimpleITK as sitk
+import zipfile
+import numpy as np
+import struct
+import json
+import concurrent.futures
+import time
+from collections import defaultdict
+import functools
+import platform
 
 # Add the script source directory to the path so that we can import
 sys.path.append(str(pathlib.Path(__file__).parent.parent.absolute() / "Python/scripts"))
 
-from characterize_data import characterize_data
+from characterize_data import (
+    characterize_data,
+    near_duplicate_groups,
+    perceptual_hash,
+    stratified_sample,
+    get_all_file_names,
+    cached_object,
+    inspect_single_file,
+    requires_pixel_data,
+    get_series_key_fname,
+    get_dicomdir_series_files,
+    inspect_files,
+    inspect_series,
+    image_geometry_columns,
+    intensity_histogram_statistics,
+    completed_futures,
+    ProgressMetrics,
+    resolve_backend,
+    SerialExecutor,
+    sniff_image_io,
+    ReadAheadPrefetcher,
+    srgb_to_gray,
+    output_columns,
+    DirectoryChangeMonitor,
+    append_thumbnails_to_summary_image,
+    watch_directory,
+)
 
 
 class TestScripts:
@@ -109,3 +146,1092 @@ class TestScripts:
             )
             == result_md5hash
         )
+
+    def test_perceptual_hash(self):
+        # each bit records whether a block is brighter than its left neighbor
+        ramp = np.tile(np.arange(64, dtype=np.uint8) * 4, (64, 1))
+        assert perceptual_hash(sitk.GetImageFromArray(ramp)) == "f" * 16
+        assert perceptual_hash(sitk.GetImageFromArray(ramp[:, ::-1].copy())) == "0" * 16
+        constant = np.full((64, 64), 7, dtype=np.uint8)
+        assert perceptual_hash(sitk.GetImageFromArray(constant)) == "0" * 16
+        # sizes which are not multiples of the 8x9 grid are supported
+        rng = np.random.default_rng(42)
+        assert len(perceptual_hash(sitk.GetImageFromArray(ramp[:13, :10]))) == 16
+
+        def distance(arr1, arr2):
+            h1 = int(perceptual_hash(sitk.GetImageFromArray(arr1)), 16)
+            h2 = int(perceptual_hash(sitk.GetImageFromArray(arr2)), 16)
+            return (h1 ^ h2).bit_count()
+
+        image = rng.integers(0, 256, size=(64, 64)).astype(np.uint8)
+        # monotonic intensity changes and small noise keep the hash (almost) unchanged,
+        # unrelated images have distant hashes
+        assert distance(image, (image // 2 + 50).astype(np.uint8)) == 0
+        noisy_image = np.clip(image + rng.integers(-3, 4, image.shape), 0, 255)
+        assert distance(image, noisy_image.astype(np.uint8)) <= 4
+        other_image = rng.integers(0, 256, size=(64, 64)).astype(np.uint8)
+        assert distance(image, other_image) > 16
+
+    def test_near_duplicate_groups(self):
+        # hashes 0 and 1 differ by two bits, 2 differs from 0 by 16 bits, 3 is identical
+        # to 2 and 4 differs from 0 by five bits and from 1 by three bits.
+        perceptual_hashes = [
+            "0f0f0f0f0f0f0f0f",
+            "0f0f0f0f0f0f0f0c",
+            "f0f00f0f0f0f0f0f",
+            "f0f00f0f0f0f0f0f",
+            "0f0f0f0f0f0f080c",
+        ]
+        groups = sorted(near_duplicate_groups(perceptual_hashes, max_distance=2))
+        assert groups == [[0, 1], [2, 3]]
+        groups = sorted(near_duplicate_groups(perceptual_hashes, max_distance=0))
+        assert groups == [[2, 3]]
+        # chained near duplicates, 0~1 and 1~4, are combined into a single group
+        groups = sorted(near_duplicate_groups(perceptual_hashes, max_distance=3))
+        assert groups == [[0, 1, 4], [2, 3]]
+        # a large bucket of hashes sharing most of their bits, such as the hashes of blank
+        # images, is split further and all near duplicates are found
+        rng = np.random.default_rng(42)
+        cluster = {
+            0x00FF00FF00FF00FF ^ sum(1 << int(b) for b in rng.choice(24, 3, False))
+            for i in range(300)
+        }
+        cluster_hashes = [f"{h:016x}" for h in cluster] + ["f0f0f0f0f0f0f0f0"]
+        groups = near_duplicate_groups(cluster_hashes, max_distance=6)
+        assert groups == [list(range(len(cluster)))]
+        groups = near_duplicate_groups(cluster_hashes, max_distance=2)
+        assert sum(len(g) for g in groups) == len(cluster)
+
+    def test_near_duplicate_groups_dense_cluster(self):
+        # hashes which vary in a few bits around a common value, the multi-index
+        # buckets do not shrink, all pairs are candidates
+        rng = np.random.default_rng(42)
+        bits = rng.choice(64, 24, replace=False).astype(np.uint64)
+        flips = rng.integers(0, 2, (20000, len(bits)), dtype=np.uint64) << bits
+        cluster = np.unique(
+            np.uint64(0x00FF00FF00FF00FF) ^ np.bitwise_or.reduce(flips, 1)
+        )
+        start_time = time.perf_counter()
+        groups = near_duplicate_groups([f"{h:016x}" for h in cluster], max_distance=6)
+        assert time.perf_counter() - start_time < 20
+        assert groups == [list(range(len(cluster)))]
+        # the groups of a sparser cluster match the connected components found by
+        # comparing all pairs
+        values = [int(h) for h in cluster[:1000]]
+        perceptual_hashes = [f"{h:016x}" for h in values]
+        for max_distance in [3, 5]:
+            components = list(range(len(values)))
+
+            def find(i):
+                while components[i] != i:
+                    i = components[i]
+                return i
+
+            for i, h1 in enumerate(values):
+                for j, h2 in enumerate(values[:i]):
+                    if (h1 ^ h2).bit_count() <= max_distance:
+                        components[find(i)] = find(j)
+            expected_groups = defaultdict(list)
+            for i in range(len(values)):
+                expected_groups[find(i)].append(i)
+            groups = near_duplicate_groups(perceptual_hashes, max_distance)
+            assert sorted(groups) == sorted(
+                g for g in expected_groups.values() if len(g) > 1
+            )
+
+    def test_stratified_sample(self):
+        file_names = [f"/data/a/{i}.dcm" for i in range(90)] + [
+            f"/data/b/{i}.png" for i in range(10)
+        ]
+        sample_file_names, sample_info = stratified_sample(
+            file_names, "per_file", 20, np.random.default_rng(42)
+        )
+        assert len(sample_file_names) == 20
+        assert set(sample_file_names) <= set(file_names)
+        # proportional allocation, 18 from the first stratum and 2 from the second
+        assert sum(1 for f in sample_file_names if f.endswith(".png")) == 2
+        # the sampling weights add up to the population size
+        assert sum(N / n for stratum, N, n in sample_info.values()) == pytest.approx(
+            100
+        )
+        # the sample is selected in a single pass over the file names, files are
+        # selected uniformly even though only a bounded number are kept per stratum
+        counts = dict.fromkeys(file_names[:90], 0)
+        for seed in range(1000):
+            sample_file_names, sample_info = stratified_sample(
+                iter(file_names[:90]), "per_file", 10, np.random.default_rng(seed)
+            )
+            for f in sample_file_names:
+                counts[f] += 1
+        assert 50 < min(counts.values()) and max(counts.values()) < 170
+        # per_series, all the files of the sampled directories are inspected, even if
+        # they are not listed consecutively
+        file_names = [
+            f"/data/{s}/{d}/{i}.dcm" for i in range(3) for s in "ab" for d in range(20)
+        ]
+        sample_file_names, sample_info = stratified_sample(
+            iter(file_names), "per_series", 6, np.random.default_rng(42)
+        )
+        assert len(sample_info) == 6
+        assert sorted(sample_file_names) == sorted(
+            f for f in file_names if os.path.dirname(f) in sample_info
+        )
+        assert (
+            sorted(sample_info.values())
+            == [("/data/a", 20, 3)] * 3 + [("/data/b", 20, 3)] * 3
+        )
+        assert stratified_sample(
+            iter([]), "per_file", 6, np.random.default_rng(42)
+        ) == (
+            [],
+            {},
+        )
+
+    def test_archive_members(self, tmp_path):
+        image = sitk.Image([16, 12], sitk.sitkUInt8) + 7
+        sitk.WriteImage(image, str(tmp_path / "image.mha"))
+        with zipfile.ZipFile(tmp_path / "images.zip", "w") as zf:
+            zf.write(tmp_path / "image.mha", "a/image.mha")
+            zf.writestr("a/readme.txt", "not an image")
+        (tmp_path / "image.mha").unlink()
+        file_names = sorted(get_all_file_names(str(tmp_path), inspect_archives=True))
+        assert file_names == [
+            str(tmp_path / "images.zip") + "!/a/image.mha",
+            str(tmp_path / "images.zip") + "!/a/readme.txt",
+        ]
+        file_info = inspect_single_file(file_names[0])
+        assert file_info["files"] == [file_names[0]]
+        assert file_info["image size"] == (16, 12)
+        assert file_info["max intensity"] == 7
+        assert list(inspect_single_file(file_names[1]).keys()) == ["files"]
+        # the data files of split header formats are extracted with the header, only those in
+        # the same archive directory
+        sitk.WriteImage(image + 1, str(tmp_path / "image.mhd"))
+        with zipfile.ZipFile(tmp_path / "split_header.zip", "w") as zf:
+            for i in range(3):
+                zf.write(tmp_path / "image.mhd", f"{i}/image.mhd")
+                zf.write(tmp_path / "image.raw", f"{i}/image.raw")
+            zf.writestr("3/image.raw", "not the data file")
+        archive_name = str(tmp_path / "split_header.zip")
+        for i in range(3):
+            file_info = inspect_single_file(f"{archive_name}!/{i}/image.mhd")
+            assert file_info["image size"] == (16, 12)
+            assert file_info["max intensity"] == 8
+
+    def test_sample_archive_members(self, tmp_path):
+        data_path = tmp_path / "data"
+        data_path.mkdir()
+        file_sizes = []
+        for i in range(6):
+            image = sitk.Image([16 + i, 12], sitk.sitkUInt8) + i
+            sitk.WriteImage(image, str(data_path / f"image{i}.png"))
+            file_sizes.append((data_path / f"image{i}.png").stat().st_size)
+        with zipfile.ZipFile(data_path / "images.zip", "w") as zf:
+            for i in range(4):
+                zf.write(data_path / f"image{i}.png", f"inner/image{i}.png")
+                (data_path / f"image{i}.png").unlink()
+        output_file = tmp_path / "output.csv"
+        characterize_data(
+            [
+                str(data_path),
+                str(output_file),
+                "per_file",
+                "--inspect_archives",
+                "--sample",
+                "6",
+                "--sample_seed",
+                "42",
+            ]
+        )
+        assert len(pd.read_csv(output_file)) == 6
+        estimates = pd.read_csv(
+            tmp_path / "output_sample_estimates.csv", index_col="quantity"
+        )
+        assert estimates.loc["number of images", "estimate"] == pytest.approx(6)
+        # archive members are left out of the file size estimate
+        assert estimates.loc["mean file size", "estimate"] == pytest.approx(
+            np.mean(file_sizes[4:])
+        )
+
+    def test_url_data_source(self, tmp_path, monkeypatch):
+        pytest.importorskip("fsspec")
+        monkeypatch.setenv("CHARACTERIZE_DATA_CACHE_DIRECTORY", str(tmp_path / "cache"))
+        (tmp_path / "data").mkdir()
+        image = sitk.Image([16, 12], sitk.sitkUInt8) + 7
+        sitk.WriteImage(image, str(tmp_path / "data" / "image.mha"))
+        root_url = (tmp_path / "data").as_uri()
+        file_names = get_all_file_names(root_url)
+        assert file_names == [root_url + "/image.mha"]
+        # storage errors are raised and do not leave partial files in the cache
+        import fsspec.implementations.local
+
+        def cat_file(*args, **kwargs):
+            raise OSError("storage error")
+
+        with monkeypatch.context() as m:
+            m.setattr(
+                fsspec.implementations.local.LocalFileSystem, "cat_file", cat_file
+            )
+            with pytest.raises(OSError, match="storage error"):
+                cached_object(file_names[0])
+        assert not any(f.is_file() for f in (tmp_path / "cache").rglob("*"))
+        file_info = inspect_single_file(file_names[0])
+        assert file_info["files"] == file_names
+        assert file_info["image size"] == (16, 12)
+        assert any((tmp_path / "cache").rglob("image.mha"))
+        # the data file of a split header format is cached with the header
+        sitk.WriteImage(image + 1, str(tmp_path / "data" / "split_header.mhd"))
+        file_info = inspect_single_file(root_url + "/split_header.mhd")
+        assert file_info["image size"] == (16, 12)
+        assert file_info["max intensity"] == 8
+        # the file sizes of a sample are the object sizes
+        characterize_data(
+            [
+                root_url,
+                str(tmp_path / "output.csv"),
+                "per_file",
+                "--sample",
+                "3",
+                "--sample_seed",
+                "42",
+            ]
+        )
+        estimates = pd.read_csv(
+            tmp_path / "output_sample_estimates.csv", index_col="quantity"
+        )
+        assert estimates.loc["number of images", "estimate"] == pytest.approx(2)
+        assert estimates.loc["mean file size", "estimate"] == pytest.approx(
+            np.mean(
+                [
+                    (tmp_path / "data" / f).stat().st_size
+                    for f in ["image.mha", "split_header.mhd"]
+                ]
+            )
+        )
+
+    def test_s3_data_source(self, tmp_path, monkeypatch):
+        pytest.importorskip("s3fs")
+        moto_server = pytest.importorskip("moto.server")
+        monkeypatch.setenv("CHARACTERIZE_DATA_CACHE_DIRECTORY", str(tmp_path / "cache"))
+        monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+        monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+        monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+        server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+        server.start()
+        try:
+            host, port = server.get_host_and_port()
+            monkeypatch.setenv("AWS_ENDPOINT_URL", f"http://{host}:{port}")
+            import s3fs
+
+            s3fs.S3FileSystem.clear_instance_cache()
+            fs = s3fs.S3FileSystem()
+            fs.mkdir("bucket")
+            # larger than the header read when the pixel data is not required
+            image = sitk.Image([512, 512], sitk.sitkUInt8) + 7
+            sitk.WriteImage(image, str(tmp_path / "image.mha"))
+            sitk.WriteImage(image + 1, str(tmp_path / "split_header.mhd"))
+            fs.put_file(str(tmp_path / "image.mha"), "bucket/data/image.mha")
+            for file_name in ["split_header.mhd", "split_header.raw"]:
+                fs.put_file(str(tmp_path / file_name), f"bucket/data/sub/{file_name}")
+            file_names = sorted(get_all_file_names("s3://bucket/data"))
+            assert file_names == [
+                "s3://bucket/data/image.mha",
+                "s3://bucket/data/sub/split_header.mhd",
+                "s3://bucket/data/sub/split_header.raw",
+            ]
+            # only the beginning of the object is read
+            file_info = inspect_single_file(
+                file_names[0], columns=["geometry", "pixel type"]
+            )
+            assert file_info["image size"] == (512, 512)
+            assert file_info["pixel type"] == "8-bit unsigned integer gray"
+            cached_file_names = list((tmp_path / "cache").rglob("image.mha"))
+            assert [f.parent.name for f in cached_file_names] == ["header"]
+            # the whole object is read when the pixel data is required
+            file_info = inspect_single_file(file_names[0])
+            assert file_info["max intensity"] == 7
+            cached_file_names = list((tmp_path / "cache").rglob("image.mha"))
+            assert len(cached_file_names) == 2
+            cached_file_stats = {f: f.stat().st_mtime_ns for f in cached_file_names}
+            # the data object of a split header format is cached with the header
+            file_info = inspect_single_file(file_names[1])
+            assert file_info["max intensity"] == 8
+            # objects are read from the cache
+            assert inspect_single_file(file_names[0])["max intensity"] == 7
+            assert {
+                f: f.stat().st_mtime_ns for f in (tmp_path / "cache").rglob("image.mha")
+            } == cached_file_stats
+            # modified objects are read again, the data object is replaced by a header
+            fs.put_file(
+                str(tmp_path / "split_header.mhd"), "bucket/data/sub/split_header.raw"
+            )
+            file_info = inspect_single_file(file_names[1])
+            assert "max intensity" not in file_info
+        finally:
+            s3fs.S3FileSystem.clear_instance_cache()
+            server.stop()
+
+    def write_dicomdir(self, file_name, records):
+        """
+        Write a minimal explicit VR little endian DICOMDIR. The records are given as a list of
+        (record type, parent record index or None, list of (group, element, vr, value)) tuples.
+        """
+
+        def element(group, element, vr, value):
+            if len(value) % 2:
+                value += b"\0" if vr == b"UI" else b" "
+            if vr in [b"OB", b"SQ"]:
+                return struct.pack("<HH2s2xI", group, element, vr, len(value)) + value
+            return struct.pack("<HH2sH", group, element, vr, len(value)) + value
+
+        def encode_records(offsets):
+            items = []
+            for i, (record_type, parent, record_elements) in enumerate(records):
+                children = [j for j, r in enumerate(records) if r[1] == i]
+                siblings = [j for j, r in enumerate(records) if r[1] == parent]
+                next_sibling = siblings[siblings.index(i) + 1 :]
+                item = (
+                    element(
+                        0x0004,
+                        0x1400,
+                        b"UL",
+                        struct.pack(
+                            "<I", offsets[next_sibling[0]] if next_sibling else 0
+                        ),
+                    )
+                    + element(
+                        0x0004,
+                        0x1420,
+                        b"UL",
+                        struct.pack("<I", offsets[children[0]] if children else 0),
+                    )
+                    + element(0x0004, 0x1430, b"CS", record_type.encode())
+                    + b"".join(element(*e[:3], e[3].encode()) for e in record_elements)
+                )
+                items.append(struct.pack("<HHI", 0xFFFE, 0xE000, len(item)) + item)
+            return items
+
+        meta = element(0x0002, 0x0010, b"UI", b"1.2.840.10008.1.2.1")
+        meta = element(0x0002, 0x0000, b"UL", struct.pack("<I", len(meta))) + meta
+        header = b"\0" * 128 + b"DICM" + meta
+        # the records have a fixed size, so the offsets computed using placeholder
+        # offsets remain valid
+        items = encode_records([0] * len(records))
+        dataset_prefix_size = len(header) + 12 + 12
+        offsets = [
+            dataset_prefix_size + sum(len(item) for item in items[:i])
+            for i in range(len(items))
+        ]
+        items = encode_records(offsets)
+        dataset = element(
+            0x0004, 0x1200, b"UL", struct.pack("<I", offsets[0])
+        ) + element(0x0004, 0x1220, b"SQ", b"".join(items))
+        with open(file_name, "wb") as fp:
+            fp.write(header + dataset)
+
+    def test_dicomdir_series_files(self, tmp_path):
+        series_file_names = []
+        records = [
+            ("PATIENT", None, []),
+            ("STUDY", 0, [(0x0020, 0x000D, b"UI", "1.2.3")]),
+        ]
+        for series_index, (series_uid, number_of_slices) in enumerate(
+            [("1.2.3.4", 3), ("1.2.3.5.1", 2)]
+        ):
+            records.append(
+                (
+                    "SERIES",
+                    1,
+                    [
+                        (0x0020, 0x000E, b"UI", series_uid),
+                        (0x0020, 0x0011, b"IS", str(series_index)),
+                    ],
+                )
+            )
+            series_record_index = len(records) - 1
+            for i in range(number_of_slices):
+                image = sitk.Image([8, 8], sitk.sitkInt16)
+                image.SetMetaData("0020|000e", series_uid)
+                image.SetMetaData("0020|000d", "1.2.3")
+                image.SetMetaData("0020|0011", str(series_index))
+                image.SetMetaData("0020|0013", str(i))
+                file_name = tmp_path / f"series{series_index}" / f"im{i}"
+                file_name.parent.mkdir(exist_ok=True)
+                writer = sitk.ImageFileWriter()
+                writer.KeepOriginalImageUIDOn()
+                writer.SetImageIO("GDCMImageIO")
+                writer.SetFileName(str(file_name))
+                writer.Execute(image)
+                series_file_names.append(str(file_name))
+                records.append(
+                    (
+                        "IMAGE",
+                        series_record_index,
+                        [(0x0004, 0x1500, b"CS", f"SERIES{series_index}\\IM{i}")],
+                    )
+                )
+        self.write_dicomdir(tmp_path / "DICOMDIR", records)
+        additional_series_tags = ["0020|0011"]
+        expected = {}
+        for file_name in series_file_names:
+            key, _ = get_series_key_fname(file_name, additional_series_tags)
+            expected.setdefault(key, set()).add(file_name)
+        file_names = {file_name.lower(): file_name for file_name in series_file_names}
+        series_files = get_dicomdir_series_files(
+            str(tmp_path / "DICOMDIR"), file_names, additional_series_tags
+        )
+        assert {key: set(value) for key, value in series_files.items()} == expected
+        # referenced file missing, the DICOMDIR is inconsistent
+        del file_names[series_file_names[0].lower()]
+        os.remove(series_file_names[0])
+        with pytest.raises(ValueError):
+            get_dicomdir_series_files(
+                str(tmp_path / "DICOMDIR"), file_names, additional_series_tags
+            )
+
+    def test_pipelined_series_inspection(self, tmp_path):
+        # series 0 is confined to a single directory, series 1 is split across two
+        # directories and series 2 has a file in the directory of series 0
+        for series_index, directories in enumerate(
+            [["a", "a"], ["b", "c", "c"], ["d", "a"]]
+        ):
+            for i, directory in enumerate(directories):
+                image = sitk.Image([8, 8], sitk.sitkUInt8) + 10 * series_index + i
+                image.SetMetaData("0020|000e", f"1.2.3.{series_index}")
+                image.SetMetaData("0020|000d", "1.2.3")
+                image.SetMetaData("0020|0032", f"0\\0\\{i}")
+                # GDCM ignores the position of secondary capture images, the default
+                # for images without a modality, and does not sort their slices
+                image.SetMetaData("0008|0060", "MR")
+                (tmp_path / directory).mkdir(exist_ok=True)
+                writer = sitk.ImageFileWriter()
+                writer.KeepOriginalImageUIDOn()
+                writer.SetFileName(
+                    str(tmp_path / directory / f"{series_index}_{i}.dcm")
+                )
+                writer.Execute(image)
+        (tmp_path / "a" / "notes.txt").write_text("not an image")
+        # the slice order, and hence the intensity hash, does not depend on the order
+        # in which the files were listed, and the series have different intensities
+        # so the hash identifies them
+        results = []
+        for pipeline in [False, True]:
+            df = inspect_series(str(tmp_path), 2, True, [], pipeline=pipeline)
+            results.append(
+                df.sort_values(by="MD5 intensity hash").reset_index(drop=True)
+            )
+        assert sorted(len(f) for f in results[1]["files"]) == [2, 2, 3]
+        pd.testing.assert_frame_equal(results[0], results[1])
+
+    def test_image_geometry_columns(self):
+        image = sitk.Image([16, 12], sitk.sitkUInt8)
+        image.SetSpacing([0.5, 2.0])
+        image.SetOrigin([3.0, 4.0])
+        image.SetDirection([0.0, 1.0, 1.0, 0.0])
+        geometry = image_geometry_columns(image)
+        assert geometry["image dimension"] == 2
+        assert [geometry[f"image size {axis}"] for axis in "xyz"] == [16, 12, 1]
+        assert [geometry[f"image spacing {axis}"] for axis in "xyz"] == [0.5, 2.0, 1.0]
+        assert [geometry[f"image origin {axis}"] for axis in "xyz"] == [3.0, 4.0, 0.0]
+        assert [geometry[f"axis direction {i}"] for i in range(9)] == [
+            0.0,
+            1.0,
+            0.0,
+            1.0,
+            0.0,
+            0.0,
+            0.0,
+            0.0,
+            1.0,
+        ]
+
+    @pytest.mark.parametrize("dtype", [np.uint8, np.int16, np.uint16])
+    def test_intensity_histogram_statistics(self, dtype):
+        rng = np.random.default_rng(42)
+        arr = rng.integers(
+            -1000 if np.issubdtype(dtype, np.signedinteger) else 0,
+            255,
+            size=(5, 20, 30),
+        ).astype(dtype)
+        arr.flat[:3] = np.iinfo(dtype).max
+        statistics = intensity_histogram_statistics(arr)
+        percentiles = [1, 5, 25, 50, 75, 95, 99]
+        assert [statistics[f"p{q} intensity"] for q in percentiles] == pytest.approx(
+            np.percentile(arr, percentiles)
+        )
+        values, counts = np.unique(arr, return_counts=True)
+        p = counts / arr.size
+        assert statistics["intensity entropy"] == pytest.approx(-np.sum(p * np.log2(p)))
+        assert statistics["mode intensity"] == values[np.argmax(counts)]
+        assert statistics["zero fraction"] == np.count_nonzero(arr == 0) / arr.size
+        assert statistics["saturated fraction"] == 3 / arr.size
+
+    def test_shared_thumbnails(self, tmp_path):
+        # more images than shared memory slots (four per process), so the slots are reused
+        for i in range(10):
+            image = sitk.Image([16 + i, 12], sitk.sitkUInt16)
+            image[i, :] = 100 * i + 1
+            sitk.WriteImage(image, str(tmp_path / f"image{i}.mha"))
+        (tmp_path / "readme.txt").write_text("not an image")
+        thumbnail_settings = {
+            "thumbnail_sizes": [12, 8],
+            "projection_axis": 2,
+            "interpolator": sitk.sitkLinear,
+        }
+        results = []
+        for shared_thumbnails in [False, True]:
+            df = inspect_files(
+                str(tmp_path),
+                1,
+                True,
+                thumbnail_settings=thumbnail_settings,
+                shared_thumbnails=shared_thumbnails,
+            )
+            df["files"] = df["files"].str[0]
+            results.append(df.set_index("files").sort_index())
+        assert results[1]["thumbnail"].isna().sum() == 1
+        for thumbnail, shared_thumbnail in zip(
+            results[0]["thumbnail"].dropna(), results[1]["thumbnail"].dropna()
+        ):
+            assert shared_thumbnail.GetSize() == (12, 8)
+            assert np.array_equal(
+                sitk.GetArrayViewFromImage(thumbnail),
+                sitk.GetArrayViewFromImage(shared_thumbnail),
+            )
+
+    @pytest.mark.parametrize("metrics_file_name", ["metrics.json", "metrics.prom"])
+    def test_progress_metrics(self, tmp_path, metrics_file_name):
+        def inspect(file_name):
+            if file_name.endswith("corrupt.dat"):
+                raise ValueError(file_name)
+            return {"files": [file_name]}
+
+        file_names = []
+        for name in ["a.dat", "b.dat", "corrupt.dat", "c.dat"]:
+            (tmp_path / name).write_bytes(bytes(100))
+            file_names.append(str(tmp_path / name))
+        metrics_file = tmp_path / metrics_file_name
+        metrics = ProgressMetrics(str(metrics_file), "file inspection", len(file_names))
+        failed_file_names = []
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            for file_name, future in completed_futures(
+                executor, inspect, file_names, metrics=metrics
+            ):
+                # failures are attributed to the file that failed, not the completion order
+                if future.exception() is not None:
+                    assert str(future.exception()) == file_name
+                    failed_file_names.append(file_name)
+                else:
+                    assert future.result()["files"] == [file_name]
+        metrics.write()
+        assert failed_file_names == [str(tmp_path / "corrupt.dat")]
+        if metrics_file_name.endswith(".prom"):
+            lines = metrics_file.read_text().splitlines()
+            assert 'characterize_data_completed{phase="file inspection"} 4' in lines
+            assert 'characterize_data_failures{phase="file inspection"} 1' in lines
+        else:
+            status = json.loads(metrics_file.read_text())
+            assert status["completed"] == 4
+            assert status["in flight"] == 0
+            assert status["failures"] == 1
+            assert status["eta seconds"] == 0
+            assert status["bytes per second"] > 0
+            # threads of a single process, a single worker
+            assert list(status["worker utilization"]) == [str(os.getpid())]
+        assert not (tmp_path / (metrics_file_name + ".tmp")).exists()
+
+    def test_column_selection(self, tmp_path):
+        image = sitk.Image([16, 12], sitk.sitkInt16) + 5
+        image.SetSpacing([0.5, 2.0])
+        image.SetMetaData("modality", "CT")
+        sitk.WriteImage(image, str(tmp_path / "image.nrrd"))
+        sitk.WriteImage(
+            sitk.Compose([sitk.Cast(image, sitk.sitkUInt8)] * 3),
+            str(tmp_path / "rgb.png"),
+        )
+        meta_data_info = {"modality": "modality"}
+        header_columns = ["geometry", "pixel type", "meta data"]
+        assert not requires_pixel_data(header_columns, {}, False)
+        assert requires_pixel_data(header_columns, {"thumbnail_sizes": [64, 64]}, False)
+        assert requires_pixel_data(["geometry", "hash"], {}, False)
+        for file_name in ["image.nrrd", "rgb.png"]:
+            full = inspect_single_file(
+                str(tmp_path / file_name), meta_data_info=meta_data_info
+            )
+            if file_name == "image.nrrd":
+                assert full["modality"] == "CT"
+            # header only read, the pixel type of the multi-channel image requires the pixel data
+            header = inspect_single_file(
+                str(tmp_path / file_name),
+                meta_data_info=meta_data_info,
+                columns=header_columns,
+            )
+            assert header == {
+                k: v
+                for k, v in full.items()
+                if k not in ["MD5 intensity hash"] and "intensity" not in k
+            }
+            hash_only = inspect_single_file(
+                str(tmp_path / file_name),
+                meta_data_info=meta_data_info,
+                columns=["hash"],
+            )
+            assert hash_only == {
+                "files": full["files"],
+                "MD5 intensity hash": full["MD5 intensity hash"],
+            }
+        assert (
+            header["pixel type"] == "vector of 8-bit unsigned integer 3 channels gray"
+        )
+
+    def test_streamed_series_inspection(self, tmp_path):
+        rng = np.random.default_rng(42)
+        writer = sitk.ImageFileWriter()
+        writer.KeepOriginalImageUIDOn()
+        for i in range(5):
+            image = sitk.GetImageFromArray(
+                rng.integers(-100, 1000, size=(1, 12, 16)).astype(np.int16)
+            )
+            image.SetMetaData("0020|000e", "1.2.3.4")
+            image.SetMetaData("0020|000d", "1.2.3")
+            image.SetMetaData("0020|0013", str(i))
+            image.SetMetaData("0020|0032", f"0\\0\\{2.5 * i}")
+            image.SetMetaData("0020|0037", "1\\0\\0\\0\\1\\0")
+            image.SetMetaData("0008|0060", "CT")
+            writer.SetFileName(str(tmp_path / f"{i}.dcm"))
+            writer.Execute(image)
+        for projection_axis in range(3):
+            thumbnail_settings = {
+                "thumbnail_sizes": [32, 32],
+                "projection_axis": projection_axis,
+                "interpolator": sitk.sitkLinear,
+            }
+            volume, streamed = [
+                inspect_series(
+                    str(tmp_path),
+                    1,
+                    True,
+                    [],
+                    meta_data_info={"modality": "0008|0060"},
+                    thumbnail_settings=thumbnail_settings,
+                    histogram_statistics=True,
+                    stream=stream,
+                )
+                for stream in [False, True]
+            ]
+            assert streamed.loc[0, "image spacing"] == (1.0, 1.0, 2.5)
+            assert streamed.loc[0, "modality"] == "CT"
+            assert np.array_equal(
+                sitk.GetArrayViewFromImage(volume.loc[0, "thumbnail"]),
+                sitk.GetArrayViewFromImage(streamed.loc[0, "thumbnail"]),
+            )
+            # the mean and std are accumulated slice by slice
+            pd.testing.assert_frame_equal(
+                volume.drop(columns="thumbnail"),
+                streamed.drop(columns="thumbnail"),
+                check_exact=False,
+                rtol=1e-12,
+            )
+
+    def test_execution_backends(self, tmp_path):
+        data_path = tmp_path / "data"
+        data_path.mkdir()
+        for i in range(4):
+            sitk.WriteImage(
+                sitk.Image([8, 8], sitk.sitkUInt8) + i, str(data_path / f"{i}.nrrd")
+            )
+        (data_path / "notes.txt").write_text("not an image")
+        results = []
+        for backend in ["process", "thread", "serial"]:
+            df = inspect_files(
+                str(data_path),
+                2,
+                True,
+                metrics_file=str(tmp_path / f"{backend}.json"),
+                backend=backend,
+            )
+            results.append(df.sort_values(by="files").reset_index(drop=True))
+            worker_utilization = json.loads((tmp_path / f"{backend}.json").read_text())[
+                "worker utilization"
+            ]
+            # worker threads are reported separately, serial tasks run in this process
+            if backend == "thread":
+                assert all("/" in worker_id for worker_id in worker_utilization)
+            elif backend == "serial":
+                assert list(worker_utilization) == [str(os.getpid())]
+        for df in results[1:]:
+            pd.testing.assert_frame_equal(results[0], df)
+        # serially executed tasks are yielded in submission order
+        assert [
+            future.result()
+            for _, future in completed_futures(SerialExecutor(), abs, [-3, 2, -1])
+        ] == [3, 2, 1]
+        assert resolve_backend("auto", 1) == "serial"
+        assert resolve_backend("auto", 4, shared_thumbnails=True) == "process"
+        assert resolve_backend("thread", 1) == "thread"
+
+    def test_plan(self, tmp_path):
+        data_path = tmp_path / "data"
+        data_path.mkdir()
+        for i in range(4):
+            sitk.WriteImage(
+                sitk.Image([16 * (i + 1), 16], sitk.sitkUInt8) + i,
+                str(data_path / f"{i}.nrrd"),
+            )
+        (data_path / "notes.txt").write_text("not an image")
+        output_file = tmp_path / "output.csv"
+        arguments = [
+            str(data_path),
+            str(output_file),
+            "per_file",
+            "--create_summary_image",
+            "--tile_sizes",
+            "2",
+            "2",
+        ]
+        assert characterize_data(arguments + ["--plan"]) == 0
+        # the data is not characterized
+        assert not output_file.exists()
+        plan = json.loads((tmp_path / "output_plan.json").read_text())
+        assert plan["largest unit"] == str(data_path / "3.nrrd")
+        assert plan["formats"][".nrrd"]["readable fraction"] == 1.0
+        assert plan["formats"][".txt"]["readable fraction"] == 0.0
+        assert plan["predicted images"] == 4
+        # the largest file and two randomly selected ones are inspected
+        assert len(plan["inspection samples"]) == 3
+        assert plan["recommended processes"] >= 1
+        assert plan["predicted summary image bytes"] == 128 * 128
+        characterize_data(arguments)
+        assert plan["predicted csv bytes"] == pytest.approx(
+            output_file.stat().st_size, rel=0.1
+        )
+
+    def test_normalized_file_lists(self, tmp_path):
+        data_path = tmp_path / "data"
+        writer = sitk.ImageFileWriter()
+        writer.KeepOriginalImageUIDOn()
+        for series in range(2):
+            (data_path / f"series{series}").mkdir(parents=True)
+            for i in range(3):
+                image = sitk.Image([8, 8, 1], sitk.sitkInt16) + i
+                image.SetMetaData("0020|000e", f"1.2.3.{series}")
+                image.SetMetaData("0020|000d", "1.2.3")
+                image.SetMetaData("0020|0013", str(i))
+                image.SetMetaData("0020|0032", f"0\\0\\{i}")
+                image.SetMetaData("0020|0037", "1\\0\\0\\0\\1\\0")
+                writer.SetFileName(str(data_path / f"series{series}" / f"{i}.dcm"))
+                writer.Execute(image)
+        (data_path / "notes.txt").write_text("not an image")
+        arguments = [str(data_path), str(tmp_path / "inline.csv"), "per_series"]
+        assert characterize_data(arguments) == 0
+        arguments[1] = str(tmp_path / "normalized.csv")
+        assert characterize_data(arguments + ["--file_list_layout", "normalized"]) == 0
+        inline = pd.read_csv(tmp_path / "inline.csv")
+        normalized = pd.read_csv(tmp_path / "normalized.csv")
+        directories = pd.read_csv(tmp_path / "normalized_directories.csv")
+        files = pd.read_csv(tmp_path / "normalized_files.csv")
+        assert directories["directory"].is_monotonic_increasing
+        files["path"] = [
+            os.path.join(d, f)
+            for d, f in zip(
+                files["directory id"].map(directories["directory"]), files["file name"]
+            )
+        ]
+        # the rows are in completion order, which differs between runs
+        normalized.insert(
+            0,
+            "files",
+            [
+                str(files.loc[files["series id"] == i, "path"].to_list())
+                for i in normalized.pop("series id")
+            ],
+        )
+        pd.testing.assert_frame_equal(
+            inline.sort_values(by="files").reset_index(drop=True),
+            normalized.sort_values(by="files").reset_index(drop=True),
+        )
+        assert (
+            characterize_data(
+                arguments[:2] + ["per_file", "--file_list_layout", "normalized"]
+            )
+            == 1
+        )
+
+    def test_sniff_image_io(self, tmp_path):
+        data_path = tmp_path / "data"
+        data_path.mkdir()
+        image = sitk.Image([8, 8], sitk.sitkUInt8) + 1
+        expected_image_ios = {
+            "image.nrrd": "NrrdImageIO",
+            "image.mha": "MetaImageIO",
+            "image.mhd": "MetaImageIO",
+            "image.nii": "NiftiImageIO",
+            "image.nii.gz": "NiftiImageIO",
+            "image.hdr": "NiftiImageIO",
+            "image.png": "PNGImageIO",
+            "image.jpg": "JPEGImageIO",
+            "image.tif": "TIFFImageIO",
+            "image.bmp": "BMPImageIO",
+            "image.vtk": "VTKImageIO",
+            "image.dcm": "GDCMImageIO",
+            # HDF5 containers are probed, they may be HDF5ImageIO or MINC2 images
+            "image.hdf5": "",
+            "image.mnc": "",
+        }
+        for file_name in expected_image_ios:
+            sitk.WriteImage(image, str(data_path / file_name))
+        # the Analyze image data file has no header
+        expected_image_ios["image.img"] = ""
+        expected_image_ios["image.raw"] = None
+        (data_path / "notes.txt").write_text("not an image")
+        expected_image_ios["notes.txt"] = None
+        for file_name, image_io in expected_image_ios.items():
+            assert sniff_image_io(str(data_path / file_name)) == image_io, file_name
+        # the sniffed image IO reads the same information as probing all image IOs
+        df, sniffed_df = [
+            inspect_files(str(data_path), 1, True, sniff_formats=sniff_formats)
+            .sort_values(by="files")
+            .reset_index(drop=True)
+            for sniff_formats in [False, True]
+        ]
+        pd.testing.assert_frame_equal(df, sniffed_df)
+
+    def test_read_ahead(self, tmp_path, capsys):
+        data_path = tmp_path / "data"
+        data_path.mkdir()
+        file_names = []
+        for i in range(8):
+            file_names.append(str(data_path / f"{i}.nrrd"))
+            sitk.WriteImage(sitk.Image([64, 64], sitk.sitkUInt16) + i, file_names[-1])
+        file_size = os.path.getsize(file_names[0])
+        # the byte budget limits the read-ahead to the files of two tasks, released as the tasks
+        # complete
+        with ReadAheadPrefetcher(file_names, 1, 4, 2 * file_size) as prefetcher:
+            prefetcher.read_ahead()
+            # the first task is in flight
+            assert prefetcher.read_ahead_files == 2
+            assert prefetcher.pending_bytes == 2 * file_size
+            for file_name in file_names:
+                future = concurrent.futures.Future()
+                future.set_result({"files": [file_name]})
+                prefetcher.task_done(file_name, future)
+                assert prefetcher.pending_bytes <= 2 * file_size
+            assert prefetcher.read_ahead_files == 7
+            assert prefetcher.pending_bytes == 0
+        df, read_ahead_df = [
+            inspect_files(str(data_path), 2, True, read_ahead_files=read_ahead_files)
+            .sort_values(by="files")
+            .reset_index(drop=True)
+            for read_ahead_files in [0, 2]
+        ]
+        pd.testing.assert_frame_equal(df, read_ahead_df)
+        assert "page cache hit rate" in capsys.readouterr().out
+        with pytest.raises(SystemExit):
+            characterize_data(
+                [
+                    str(data_path),
+                    str(tmp_path / "output.csv"),
+                    "per_file",
+                    "--read_ahead_files",
+                    "-1",
+                ]
+            )
+        assert "expected value >= 0" in capsys.readouterr().err
+
+    @pytest.mark.parametrize("intensity_hash", ["sha256", "blake2b"])
+    def test_intensity_hash(self, tmp_path, intensity_hash):
+        rng = np.random.default_rng(42)
+        writer = sitk.ImageFileWriter()
+        writer.KeepOriginalImageUIDOn()
+        volume = rng.integers(-100, 1000, size=(4, 12, 16)).astype(np.int16)
+        for i in range(len(volume)):
+            image = sitk.GetImageFromArray(volume[i : i + 1])
+            image.SetMetaData("0020|000e", "1.2.3.4")
+            image.SetMetaData("0020|000d", "1.2.3")
+            image.SetMetaData("0020|0013", str(i))
+            image.SetMetaData("0020|0032", f"0\\0\\{i}")
+            image.SetMetaData("0020|0037", "1\\0\\0\\0\\1\\0")
+            writer.SetFileName(str(tmp_path / f"{i}.dcm"))
+            writer.Execute(image)
+        hash_column = f"{intensity_hash.upper()} intensity hash"
+        expected_hash = hashlib.new(intensity_hash, volume).hexdigest()
+        # the hash is the same whether computed from the volume or one slice at a time
+        for stream in [False, True]:
+            df = inspect_series(
+                str(tmp_path),
+                1,
+                True,
+                [],
+                stream=stream,
+                intensity_hash=intensity_hash,
+            )
+            assert df.loc[0, hash_column] == expected_hash
+            assert "MD5 intensity hash" not in df.columns
+        df = inspect_files(str(tmp_path), 1, True, intensity_hash=intensity_hash)
+        assert set(df[hash_column]) == {
+            hashlib.new(intensity_hash, volume[i : i + 1]).hexdigest()
+            for i in range(len(volume))
+        }
+
+    def test_srgb_to_gray(self):
+        rng = np.random.default_rng(42)
+        for low, high in [(0, 256), (100, 110)]:
+            image = sitk.GetImageFromArray(
+                rng.integers(low, high, size=(64, 48, 4), dtype=np.uint8),
+                isVector=True,
+            )
+            gray = sitk.GetArrayFromImage(srgb_to_gray(image))
+            # the float computation is used for all pixel types other than 8-bit
+            float_gray = sitk.GetArrayFromImage(
+                srgb_to_gray(sitk.Cast(image, sitk.sitkVectorFloat32))
+            )
+            assert gray.dtype == np.uint8
+            assert gray.min() == 0 and gray.max() == 255
+            assert np.abs(gray.astype(int) - float_gray).max() <= 1
+        constant_image = sitk.Image([8, 8], sitk.sitkVectorUInt8, 3) + 7
+        assert not sitk.GetArrayViewFromImage(srgb_to_gray(constant_image)).any()
+
+    @pytest.mark.parametrize("system", [platform.system(), "polling"])
+    def test_directory_change_monitor(self, tmp_path, monkeypatch, system):
+        # on non-Linux systems the directory structure is polled
+        monkeypatch.setattr(platform, "system", lambda: system)
+        (tmp_path / "existing.txt").write_text("existing")
+        monitor = DirectoryChangeMonitor(tmp_path)
+        try:
+            assert monitor.changed_files() == set()
+            (tmp_path / "new.txt").write_text("new")
+            (tmp_path / "existing.txt").write_text("modified")
+            (tmp_path / "sub_dir").mkdir()
+            (tmp_path / "sub_dir" / "sub_dir_file.txt").write_text("new")
+            assert monitor.changed_files() == {
+                str(tmp_path / "new.txt"),
+                str(tmp_path / "existing.txt"),
+                str(tmp_path / "sub_dir" / "sub_dir_file.txt"),
+            }
+            # files in the new sub directory are also monitored
+            (tmp_path / "sub_dir" / "another_file.txt").write_text("new")
+            assert monitor.changed_files() == {
+                str(tmp_path / "sub_dir" / "another_file.txt")
+            }
+            assert monitor.changed_files() == set()
+        finally:
+            monitor.close()
+
+    def test_append_thumbnails_to_summary_image(self, tmp_path):
+        tile_size = [2, 2]
+        thumbnails = [
+            sitk.GetImageFromArray(np.full((3, 4), 10 * (i + 1), dtype=np.uint8))
+            for i in range(6)
+        ]
+        summary_image_file_name = str(tmp_path / "summary_image")
+        # incremental updates, the second one starts in the middle of a slice
+        append_thumbnails_to_summary_image(
+            summary_image_file_name, thumbnails[:3], 0, tile_size
+        )
+        append_thumbnails_to_summary_image(
+            summary_image_file_name, thumbnails[3:], 3, tile_size
+        )
+        arr = sitk.GetArrayFromImage(sitk.ReadImage(summary_image_file_name + ".nhdr"))
+        assert arr.shape == (2, 6, 8)
+        for i, thumbnail in enumerate(thumbnails):
+            z, index_in_slice = divmod(i, 4)
+            y, x = divmod(index_in_slice, 2)
+            assert np.array_equal(
+                arr[z, 3 * y : 3 * (y + 1), 4 * x : 4 * (x + 1)],
+                sitk.GetArrayViewFromImage(thumbnail),
+            )
+        # unused tiles are background
+        assert not arr[1, 3:, :].any()
+
+    @pytest.mark.parametrize("analysis_type", ["per_file", "per_series"])
+    def test_watch_directory(self, tmp_path, analysis_type):
+        data_path = tmp_path / "data"
+
+        def write_series(series_index):
+            # two slice DICOM series, each in its own directory
+            (data_path / str(series_index)).mkdir(parents=True)
+            file_names = []
+            for i in range(2):
+                image = sitk.Image([16, 12], sitk.sitkUInt8)
+                image[4 * series_index : 4 * series_index + 4, :] = 100 + 100 * i
+                image.SetMetaData("0020|000e", f"1.2.3.{series_index}")
+                image.SetMetaData("0020|000d", "1.2.3")
+                image.SetMetaData("0020|0032", f"0\\0\\{i}")
+                file_names.append(str(data_path / str(series_index) / f"{i}.dcm"))
+                writer = sitk.ImageFileWriter()
+                writer.KeepOriginalImageUIDOn()
+                writer.SetFileName(file_names[-1])
+                writer.Execute(image)
+            return file_names
+
+        series_file_names = [write_series(i) for i in range(2)]
+        thumbnail_settings = {
+            "thumbnail_sizes": [8, 6],
+            "projection_axis": 2,
+            "interpolator": sitk.sitkLinear,
+        }
+        if analysis_type == "per_file":
+            inspection_function = functools.partial(
+                inspect_files,
+                str(data_path),
+                1,
+                True,
+                thumbnail_settings=thumbnail_settings,
+            )
+            expected_files = [[f] for files in series_file_names for f in files]
+        else:
+            inspection_function = functools.partial(
+                inspect_series,
+                str(data_path),
+                1,
+                True,
+                [],
+                thumbnail_settings=thumbnail_settings,
+            )
+            expected_files = series_file_names
+        columns = ["files"] + output_columns(
+            ["geometry", "pixel type"], "tuples", False
+        )
+        output_file = str(tmp_path / "output.csv")
+        summary_image_file_name = str(tmp_path / "output_summary_image.nhdr")
+
+        def watch():
+            watch_directory(
+                str(data_path),
+                output_file,
+                analysis_type,
+                inspection_function,
+                columns,
+                polling_interval=0,
+                quiescence_period=0,
+                tile_sizes=[2, 2],
+                max_polls=1,
+            )
+            df = pd.read_csv(output_file)
+            df["files"] = df["files"].apply(lambda x: sorted(ast.literal_eval(x)))
+            return df
+
+        df = watch()
+        assert df.columns.to_list() == columns
+        assert sorted(df["files"]) == expected_files
+        # watching is resumed, only the new series is characterized
+        new_file_names = write_series(2)
+        if analysis_type == "per_file":
+            new_files = [[f] for f in new_file_names]
+        else:
+            new_files = [new_file_names]
+        df = watch()
+        # the rows of the new series are appended after the existing ones
+        assert sorted(df["files"].iloc[: len(expected_files)]) == expected_files
+        assert sorted(df["files"].iloc[len(expected_files) :]) == new_files
+        # the summary image tiles are the thumbnails of the rows, in order
+        summary_image = sitk.GetArrayFromImage(sitk.ReadImage(summary_image_file_name))
+        assert summary_image.shape == ((len(df) + 3) // 4, 12, 16)
+        for i, file_names in enumerate(df["files"]):
+            thumbnail = inspection_function(file_names=file_names)["thumbnail"][0]
+            z, index_in_slice = divmod(i, 4)
+            y, x = divmod(index_in_slice, 2)
+            assert np.array_equal(
+                summary_image[z, 6 * y : 6 * (y + 1), 8 * x : 8 * (x + 1)],
+                sitk.GetArrayViewFromImage(thumbnail),
+            )